@@ -0,0 +1,94 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../modules')))
+
+from utils.label_functions.gene_index import GeneIndex, gene_info_columns, gene_info_url
+
+
+def query_gene_tag(gene_desc, gene_id, gene_name):
+    """
+    This function is a copy of the old LF_DG_CHECK_GENE_TAG body
+    (dataframe query plus substring scans) used as the baseline.
+
+    gene_desc - the ncbi gene info dataframe
+    gene_id - the entrez gene id of the mention
+    gene_name - the lowercased gene mention
+    """
+    gene_entry_df = gene_desc.query("GeneID == @gene_id")
+
+    if gene_entry_df.empty:
+        return -1
+
+    for token in gene_name.split(" "):
+        if gene_entry_df["Symbol"].values[0].lower() == token or token in gene_entry_df["Synonyms"].values[0].lower():
+            return 0
+        elif token in gene_entry_df["description"].values[0].lower():
+            return 0
+    return -1
+
+
+def make_mentions(gene_desc, num_candidates, seed=100):
+    """
+    This function is designed to sample fake gene mentions from the gene info table.
+    Mentions are a mix of symbols, synonyms and random (mismatched) symbols.
+
+    gene_desc - the ncbi gene info dataframe
+    num_candidates - the number of mentions to generate
+    seed - the random seed
+    """
+    random_state = np.random.RandomState(seed)
+    rows = random_state.randint(0, gene_desc.shape[0], size=num_candidates)
+    other_rows = random_state.randint(0, gene_desc.shape[0], size=num_candidates)
+    kind = random_state.randint(0, 3, size=num_candidates)
+
+    mentions = []
+    for row, other_row, mention_kind in zip(rows, other_rows, kind):
+        gene_id = int(gene_desc.GeneID.values[row])
+        if mention_kind == 0:
+            name = gene_desc.Symbol.values[row]
+        elif mention_kind == 1:
+            name = gene_desc.Synonyms.values[row].split("|")[0]
+        else:
+            name = gene_desc.Symbol.values[other_row]
+        mentions.append((gene_id, name.lower()))
+    return mentions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the gene tag check")
+    parser.add_argument("--candidates", type=int, default=300000, help="number of mentions for the indexed check")
+    parser.add_argument("--baseline-candidates", type=int, default=2000, help="number of mentions for the dataframe query baseline")
+    args = parser.parse_args()
+
+    gene_desc = pd.read_table(gene_info_url, sep="\t", names=gene_info_columns, compression="gzip", skiprows=1)
+    mentions = make_mentions(gene_desc, args.candidates)
+
+    start = time.perf_counter()
+    gene_index = GeneIndex(gene_desc)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    baseline_labels = [
+        query_gene_tag(gene_desc, gene_id, gene_name)
+        for gene_id, gene_name in mentions[:args.baseline_candidates]
+    ]
+    baseline_rate = args.baseline_candidates/(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index_labels = [
+        0 if gene_index.matches(gene_id, gene_name) else -1
+        for gene_id, gene_name in mentions
+    ]
+    index_rate = len(mentions)/(time.perf_counter() - start)
+
+    agreement = np.mean(np.array(baseline_labels) == np.array(index_labels[:args.baseline_candidates]))
+    print("Index build time: {:.2f} sec for {:,} genes".format(build_time, len(gene_index.records)))
+    print("DataFrame.query baseline: {:,.1f} candidates/sec".format(baseline_rate))
+    print("GeneIndex lookup:         {:,.1f} candidates/sec".format(index_rate))
+    print("speedup: {:.1f}x, label agreement on baseline sample: {:.3f}".format(index_rate/baseline_rate, agreement))
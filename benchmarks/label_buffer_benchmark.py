@@ -0,0 +1,103 @@
+import argparse
+import os
+import queue
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy.sparse as sparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../modules')))
+
+from utils.notebook_utils.label_buffer import LabelBuffer
+
+
+def make_label_rows(num_candidates, num_lfs, density, seed=100):
+    """
+    This function is designed to generate fake label function output.
+    Each candidate gets a list with one label (-1, 0 or 1) per label function.
+
+    num_candidates - the number of candidates (rows)
+    num_lfs - the number of label functions (columns)
+    density - the fraction of labels that are nonzero
+    seed - the random seed
+    """
+    random_state = np.random.RandomState(seed)
+    labels = random_state.choice([-1, 1], size=(num_candidates, num_lfs))
+    labels[random_state.rand(num_candidates, num_lfs) > density] = 0
+    return labels.tolist()
+
+
+def queue_path(label_rows, num_lfs):
+    """
+    This function copies the old assembly path: one tuple per nonzero label
+    on a synchronized queue, drained into python lists before building the matrix.
+
+    label_rows - the output of make_label_rows
+    num_lfs - the number of label functions
+    """
+    data_queue = queue.Queue()
+    for row_index, labels in enumerate(label_rows):
+        for col_index, val in enumerate(labels):
+            if val != 0:
+                data_queue.put((row_index, col_index, val))
+
+    row = []
+    col = []
+    data = []
+    while not(data_queue.empty()):
+        entry = data_queue.get()
+        row.append(entry[0])
+        col.append(entry[1])
+        data.append(entry[2])
+
+    return sparse.csr_matrix((data, (row, col)), shape=(len(label_rows), num_lfs))
+
+
+def buffer_path(label_rows, num_lfs):
+    """
+    This function assembles the same matrix with a LabelBuffer.
+
+    label_rows - the output of make_label_rows
+    num_lfs - the number of label functions
+    """
+    buffer = LabelBuffer(capacity=2*len(label_rows))
+    for row_index, labels in enumerate(label_rows):
+        buffer.add_row(row_index, labels)
+    return buffer.to_csr(shape=(len(label_rows), num_lfs))
+
+
+def measure(func, *args):
+    """
+    This function is designed to report the wall time and
+    peak traced memory of a function call.
+
+    func - the function to run
+    args - the arguments passed into func
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark label matrix assembly")
+    parser.add_argument("--candidates", type=int, default=200000, help="number of candidates")
+    parser.add_argument("--lfs", type=int, default=35, help="number of label functions")
+    parser.add_argument("--density", type=float, default=0.2, help="fraction of nonzero labels")
+    args = parser.parse_args()
+
+    label_rows = make_label_rows(args.candidates, args.lfs, args.density)
+
+    queue_matrix, queue_time, queue_peak = measure(queue_path, label_rows, args.lfs)
+    buffer_matrix, buffer_time, buffer_peak = measure(buffer_path, label_rows, args.lfs)
+
+    assert (queue_matrix != buffer_matrix).nnz == 0
+    print("{:,} candidates x {} label functions, {:,} nonzero labels".format(args.candidates, args.lfs, buffer_matrix.nnz))
+    print("queue + lists: {:7.2f} sec, peak memory {:8.1f} MB".format(queue_time, queue_peak/1e6))
+    print("LabelBuffer:   {:7.2f} sec, peak memory {:8.1f} MB".format(buffer_time, buffer_peak/1e6))
@@ -0,0 +1,73 @@
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../modules')))
+
+from utils.label_functions.regex_bank import ahocorasick, ltp
+from utils.notebook_utils.dataframe_helper import load_candidate_dataframes
+
+
+def benchmark_phrase_matcher(phrase_matcher, texts, repeats=3):
+    """
+    This function is designed to time searching every phrase set of a
+    PhraseMatcher in a list of texts. The "before" run searches each set
+    with one big regex alternation (how the label functions used to work)
+    and the "after" run scans each text once and then asks about every set.
+
+    phrase_matcher - the PhraseMatcher object exported by a label function module
+    texts - a list of sentences to search through
+    repeats - the number of times to repeat each run (best time is kept)
+
+    returns a tuple of sentences/sec for the before and after runs
+    """
+    patterns = [
+        re.compile(ltp(phrases), flags)
+        for phrases, flags in phrase_matcher.sources.values()
+    ]
+    names = list(phrase_matcher.sources)
+
+    before_times = []
+    after_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        before = [[bool(pattern.search(text)) for pattern in patterns] for text in texts]
+        before_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        after = []
+        for text in texts:
+            hits = phrase_matcher.scan(text)
+            after.append([hits.search(name) for name in names])
+        after_times.append(time.perf_counter() - start)
+
+    if before != after:
+        raise AssertionError("The phrase matcher disagrees with the regular expressions")
+
+    return len(texts)/min(before_times), len(texts)/min(after_times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the label function phrase matcher")
+    parser.add_argument("relation", choices=["DG", "CG"], help="which label function module to benchmark")
+    parser.add_argument("spreadsheet", help="the candidate spreadsheet (e.g. sentence_labels_train.xlsx)")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timing repeats")
+    args = parser.parse_args()
+
+    if args.relation == "DG":
+        from utils.label_functions.disease_gene_lf import phrase_matcher
+    else:
+        from utils.label_functions.compound_gene_lf import phrase_matcher
+
+    candidate_df = load_candidate_dataframes(args.spreadsheet)
+    texts = candidate_df["sentence"].astype(str).tolist()
+
+    before, after = benchmark_phrase_matcher(phrase_matcher, texts, repeats=args.repeats)
+    print("Sentences: {:d}, Phrase sets: {:d}, pyahocorasick: {}".format(
+        len(texts), len(phrase_matcher), "yes" if ahocorasick is not None else "no"
+    ))
+    print("one regex per phrase set: {:,.1f} sentences/sec".format(before))
+    print("phrase matcher:           {:,.1f} sentences/sec".format(after))
+    print("speedup: {:.2f}x".format(after/before))
@@ -0,0 +1,85 @@
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../modules')))
+
+from utils.notebook_utils.dataframe_helper import load_candidate_dataframes
+
+
+def make_tagged_text(sentence, first_mention, second_mention):
+    """
+    This function is designed to mimic snorkel's get_tagged_text
+    using the columns stored in the curated spreadsheets.
+
+    sentence - the candidate sentence
+    first_mention - the text of the first entity (replaced with {{A}})
+    second_mention - the text of the second entity (replaced with {{B}})
+
+    returns the sentence with both mentions replaced by their tags
+    """
+    tagged = sentence.replace(str(first_mention), "{{A}}", 1)
+    return tagged.replace(str(second_mention), "{{B}}", 1)
+
+
+def benchmark_regex_bank(regex_bank, texts, repeats=3):
+    """
+    This function is designed to time every pattern in a regex bank
+    against a list of texts. The "before" run calls re.search with the
+    raw pattern string (how the label functions used to work) and the
+    "after" run uses the precompiled patterns.
+
+    regex_bank - the RegexBank object exported by a label function module
+    texts - a list of tagged sentences to search through
+    repeats - the number of times to repeat each run (best time is kept)
+
+    returns a tuple of candidates/sec for the before and after runs
+    """
+    sources = list(regex_bank.sources.values())
+    patterns = list(regex_bank.patterns.values())
+
+    before_times = []
+    after_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for text in texts:
+            for pattern, flags in sources:
+                re.search(pattern, text, flags=flags)
+        before_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for text in texts:
+            for pattern in patterns:
+                pattern.search(text)
+        after_times.append(time.perf_counter() - start)
+
+    return len(texts)/min(before_times), len(texts)/min(after_times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the compiled label function patterns")
+    parser.add_argument("relation", choices=["DG", "CG"], help="which label function module to benchmark")
+    parser.add_argument("spreadsheet", help="the candidate spreadsheet (e.g. sentence_labels_train.xlsx)")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timing repeats")
+    args = parser.parse_args()
+
+    if args.relation == "DG":
+        from utils.label_functions.disease_gene_lf import regex_bank
+        first_col, second_col = "disease", "gene"
+    else:
+        from utils.label_functions.compound_gene_lf import regex_bank
+        first_col, second_col = "compound", "gene"
+
+    candidate_df = load_candidate_dataframes(args.spreadsheet)
+    texts = [
+        make_tagged_text(row.sentence, getattr(row, first_col), getattr(row, second_col))
+        for row in candidate_df.itertuples()
+    ]
+
+    before, after = benchmark_regex_bank(regex_bank, texts, repeats=args.repeats)
+    print("Candidates: {:d}, Patterns: {:d}".format(len(texts), len(regex_bank)))
+    print("re.search on pattern strings: {:,.1f} candidates/sec".format(before))
+    print("precompiled regex bank:       {:,.1f} candidates/sec".format(after))
+    print("speedup: {:.2f}x".format(after/before))
@@ -1,5 +1,13 @@
-import pandas as pd
 import os
+import sys
+
+import pandas as pd
+
+#Set up the path so my module scripts can be imported
+sys.path.append(os.path.abspath('../modules'))
+
+# Pinned tables are read from the local data cache (see modules/utils/data_cache.py)
+from utils.data_cache import cached_path
 
 #Set up the environment
 username = "danich1"
@@ -8,9 +16,9 @@ dbname = "pubmeddb"
 
 database_str = "postgresql+psycopg2://{}:{}@/{}?host=/var/run/postgresql".format(username, password, dbname)
 
-disease_url = 'https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/xrefs-prop-slim.tsv'
-compound_url = "https://raw.githubusercontent.com/dhimmel/drugbank/7b94454b14a2fa4bb9387cb3b4b9924619cfbd3e/data/drugbank.tsv"
-ctpd_url = "https://raw.githubusercontent.com/dhimmel/indications/11d535ba0884ee56c3cd5756fdfb4985f313bd80/catalog/indications.tsv"
+disease_url = cached_path('https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/xrefs-prop-slim.tsv')
+compound_url = cached_path("https://raw.githubusercontent.com/dhimmel/drugbank/7b94454b14a2fa4bb9387cb3b4b9924619cfbd3e/data/drugbank.tsv")
+ctpd_url = cached_path("https://raw.githubusercontent.com/dhimmel/indications/11d535ba0884ee56c3cd5756fdfb4985f313bd80/catalog/indications.tsv")
 
 base_dir = os.path.join(os.path.dirname(os.getcwd()), 'compound_disease')
 
@@ -1,6 +1,15 @@
+import os
+import sys
+
 import pandas as pd
 import tqdm
 
+#Set up the path so my module scripts can be imported
+sys.path.append(os.path.abspath('../modules'))
+
+# Pinned tables are read from the local data cache (see modules/utils/data_cache.py)
+from utils.data_cache import cached_path
+
 #Set up the environment
 username = "danich1"
 password = "snorkel"
@@ -9,10 +18,10 @@ dbname = "pubmeddb"
 #Path subject to change for different os
 database_str = "postgresql+psycopg2://{}:{}@/{}?host=/var/run/postgresql".format(username, password, dbname)
 
-compound_url = "https://raw.githubusercontent.com/dhimmel/drugbank/7b94454b14a2fa4bb9387cb3b4b9924619cfbd3e/data/drugbank.tsv"
-gene_url = "https://raw.githubusercontent.com/dhimmel/entrez-gene/a7362748a34211e5df6f2d185bb3246279760546/data/genes-human.tsv"
-cbg_url = "https://raw.githubusercontent.com/dhimmel/integrate/93feba1765fbcd76fd79e22f25121f5399629148/compile/CbG-binding.tsv"
-crg_url = "https://raw.githubusercontent.com/dhimmel/lincs/bbc6812b7d19e98637b44373cdfc52f61bce6327/data/consensi/signif/dysreg-drugbank.tsv"
+compound_url = cached_path("https://raw.githubusercontent.com/dhimmel/drugbank/7b94454b14a2fa4bb9387cb3b4b9924619cfbd3e/data/drugbank.tsv")
+gene_url = cached_path("https://raw.githubusercontent.com/dhimmel/entrez-gene/a7362748a34211e5df6f2d185bb3246279760546/data/genes-human.tsv")
+cbg_url = cached_path("https://raw.githubusercontent.com/dhimmel/integrate/93feba1765fbcd76fd79e22f25121f5399629148/compile/CbG-binding.tsv")
+crg_url = cached_path("https://raw.githubusercontent.com/dhimmel/lincs/bbc6812b7d19e98637b44373cdfc52f61bce6327/data/consensi/signif/dysreg-drugbank.tsv")
 
 base_dir = os.path.join(os.path.dirname(os.getcwd()), 'compound_gene')
 
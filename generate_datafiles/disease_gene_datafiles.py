@@ -1,5 +1,14 @@
+import os
+import sys
+
 import pandas as pd
 
+#Set up the path so my module scripts can be imported
+sys.path.append(os.path.abspath('../modules'))
+
+# Pinned tables are read from the local data cache (see modules/utils/data_cache.py)
+from utils.data_cache import cached_path
+
 #Set up the environment
 username = "danich1"
 password = "snorkel"
@@ -8,10 +17,10 @@ dbname = "pubmeddb"
 #Path subject to change for different os
 database_str = "postgresql+psycopg2://{}:{}@/{}?host=/var/run/postgresql".format(username, password, dbname)
 
-disease_url = "https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/xrefs-prop-slim.tsv"
-gene_url = "https://raw.githubusercontent.com/dhimmel/entrez-gene/a7362748a34211e5df6f2d185bb3246279760546/data/genes-human.tsv"
-dag_url = "https://github.com/dhimmel/integrate/raw/93feba1765fbcd76fd79e22f25121f5399629148/compile/DaG-association.tsv"
-drg_url = "https://raw.githubusercontent.com/dhimmel/stargeo/08b126cc1f93660d17893c4a3358d3776e35fd84/data/diffex.tsv"
+disease_url = cached_path("https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/xrefs-prop-slim.tsv")
+gene_url = cached_path("https://raw.githubusercontent.com/dhimmel/entrez-gene/a7362748a34211e5df6f2d185bb3246279760546/data/genes-human.tsv")
+dag_url = cached_path("https://github.com/dhimmel/integrate/raw/93feba1765fbcd76fd79e22f25121f5399629148/compile/DaG-association.tsv")
+drg_url = cached_path("https://raw.githubusercontent.com/dhimmel/stargeo/08b126cc1f93660d17893c4a3358d3776e35fd84/data/diffex.tsv")
 
 base_dir = os.path.join(os.path.dirname(os.getcwd()), 'disease_gene')
 
@@ -0,0 +1,19 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../modules')))
+
+from utils.label_functions.knowledge_base import KB_SPECS, build_knowledge_base
+
+"""
+Build the integer encoded knowledge base indices that the label functions memory map.
+Run this once after the pair files change, so label function imports
+(and every worker process) skip rebuilding the knowledge base.
+"""
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(KB_SPECS.keys())
+
+    for name in names:
+        index_dir = build_knowledge_base(name)
+        print("Wrote {} index to {}".format(name, index_dir))
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+NUM_DOCUMENTS = 5
+SENTENCES_PER_DOCUMENT = 4
+WORDS = "the gene {} is strongly associated with the disease {} in patients".split()
+
+
+@pytest.fixture
+def snorkel_db(tmpdir):
+    """
+    Build a small sqlite snorkel database of disease gene candidates.
+
+    returns (sessionmaker, candidate class, candidate ids)
+    """
+    snorkel_models = pytest.importorskip("snorkel.models")
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_engine(
+        "sqlite:///{}".format(tmpdir.join("snorkel.db")),
+        connect_args={"check_same_thread": False}
+    )
+    snorkel_models.SnorkelBase.metadata.create_all(engine)
+    DiseaseGene = snorkel_models.candidate_subclass('DiseaseGene', ['Disease', 'Gene'])
+
+    session = sessionmaker(bind=engine)()
+    candidates = []
+    for doc_index in range(NUM_DOCUMENTS):
+        document = snorkel_models.Document(name=str(1000 + doc_index), stable_id="doc::{}".format(doc_index))
+        for position in range(SENTENCES_PER_DOCUMENT):
+            words = [word.format("G{}".format(position), "D{}".format(doc_index)) for word in WORDS]
+            char_offsets = [sum(len(word) + 1 for word in words[:index]) for index in range(len(words))]
+            sentence = snorkel_models.Sentence(
+                document=document, position=position, text=" ".join(words),
+                words=words, char_offsets=char_offsets,
+                stable_id="sentence::{}::{}".format(doc_index, position)
+            )
+            spans = {}
+            for argname, word_index in (("Gene", 2), ("Disease", 9)):
+                char_start = char_offsets[word_index]
+                spans[argname] = snorkel_models.Span(
+                    sentence=sentence, char_start=char_start,
+                    char_end=char_start + len(words[word_index]) - 1,
+                    stable_id="span::{}::{}::{}".format(doc_index, position, argname)
+                )
+            candidates.append(DiseaseGene(
+                Disease=spans["Disease"], Gene=spans["Gene"],
+                Disease_cid="DOID:{}".format(doc_index), Gene_cid=str(position)
+            ))
+    session.add_all(candidates)
+    session.commit()
+    candidate_ids = [candidate.id for candidate in candidates]
+    session.close()
+
+    return sessionmaker(bind=engine), DiseaseGene, candidate_ids
@@ -0,0 +1,15 @@
+import pytest
+
+pytest.importorskip("snorkel")
+
+from utils.label_functions.candidate_context import CandidateBatch
+
+
+def test_batch_from_records():
+    batch = CandidateBatch.from_records([
+        {"candidate_id": 1, "span0_word_start": 0, "span0_word_end": 1, "span1_word_start": 5, "span1_word_end": 5},
+        {"candidate_id": 2, "span0_word_start": 4, "span0_word_end": 4, "span1_word_start": 3, "span1_word_end": 3},
+    ])
+    assert len(batch) == 2
+    assert list(batch["candidate_id"]) == [1, 2]
+    assert list(batch.between_token_counts()) == [3, 0]
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip("snorkel")
+
+from sqlalchemy import event
+
+from utils.notebook_utils.candidate_loader import load_candidates
+
+
+def count_statements(engine):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return statements
+
+
+def test_load_candidates_in_one_statement(snorkel_db):
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+    statements = count_statements(session.get_bind())
+
+    candidates = load_candidates(session, candidate_ids, DiseaseGene)
+    assert len(candidates) == len(candidate_ids)
+    assert len(statements) == 1
+
+    # everything the label functions touch is already loaded
+    for candidate in candidates:
+        for span in candidate.get_contexts():
+            span.get_span()
+            span.get_word_start()
+            span.sentence.position
+            span.sentence.document.name
+        candidate.Gene_cid
+    assert len(statements) == 1
+    session.close()
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from utils import data_cache
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    monkeypatch.setenv("SNORKELING_CACHE_DIR", str(tmpdir.join("cache")))
+    monkeypatch.delenv("SNORKELING_OFFLINE", raising=False)
+    return tmpdir.join("cache")
+
+
+def test_corrupted_entry_is_downloaded_again(tmpdir, cache_dir):
+    source = tmpdir.join("table.tsv")
+    source.write("a\tb\n1\t2\n")
+    url = "file://" + str(source)
+
+    path = data_cache.cached_path(url)
+    assert open(path).read() == "a\tb\n1\t2\n"
+
+    # truncate the cached copy, the next read has to notice and fetch it again
+    with open(path, "w") as f:
+        f.write("a\tb\n")
+    assert open(data_cache.cached_path(url)).read() == "a\tb\n1\t2\n"
+
+
+def test_corrupted_entry_raises_offline(tmpdir, cache_dir, monkeypatch):
+    source = tmpdir.join("table.tsv")
+    source.write("a\tb\n1\t2\n")
+    url = "file://" + str(source)
+
+    path = data_cache.cached_path(url)
+    with open(path, "w") as f:
+        f.write("a\tb\n")
+
+    monkeypatch.setenv("SNORKELING_OFFLINE", "1")
+    with pytest.raises(FileNotFoundError):
+        data_cache.cached_path(url)
+    assert not os.path.exists(path)
+
+
+def test_failed_download_removes_tmp_file(tmpdir, cache_dir, monkeypatch):
+    class BrokenResponse:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def read(self, size):
+            raise IOError("connection reset")
+
+    monkeypatch.setattr(data_cache, "urlopen", lambda url: BrokenResponse())
+    with pytest.raises(IOError):
+        data_cache.cached_path("https://example.org/table.tsv")
+
+    assert cache_dir.join("tmp").listdir() == []
+    assert not cache_dir.join("urls").check()
@@ -0,0 +1,42 @@
+import multiprocessing
+import os
+
+import pandas as pd
+
+from utils.label_functions import knowledge_base
+from utils.label_functions.knowledge_base import KB_KEEP_BUILDS, KnowledgeBaseIndex
+
+
+def make_knowledge_base(tmpdir, monkeypatch):
+    pair_file = tmpdir.join("pairs.csv")
+    pd.DataFrame({
+        "entrez_gene_id": ["1", "2"],
+        "doid_id": ["DOID:1", "DOID:2"],
+        "sources": ["A|B", "B"]
+    }).to_csv(str(pair_file), index=False)
+
+    monkeypatch.setitem(knowledge_base.KB_SPECS, "test", {
+        "index_dir": tmpdir.join("test_kb_index"),
+        "files": [(str(pair_file), ",", "doid_id", "", None)]
+    })
+    return pair_file
+
+
+def lookup_after_fork(_):
+    return int(KnowledgeBaseIndex("test").load().lookup("2", "DOID:2"))
+
+
+def test_stale_rebuilds_keep_live_indices_readable(tmpdir, monkeypatch):
+    pair_file = make_knowledge_base(tmpdir, monkeypatch)
+    index = KnowledgeBaseIndex("test").load()
+    assert index.lookup("1", "DOID:1") == index.source_mask("A", "B")
+    pair_keys = index.pair_keys
+
+    for rebuild in range(4):
+        os.utime(str(pair_file), (rebuild, rebuild))
+        with multiprocessing.get_context("fork").Pool(3) as pool:
+            assert pool.map(lookup_after_fork, range(6)) == [index.source_mask("B")]*6
+
+    # the first build was removed, but its memory mapped arrays still read fine
+    assert list(pair_keys) == list(KnowledgeBaseIndex("test").load().pair_keys)
+    assert len(os.listdir(str(tmpdir.join("test_kb_index_builds")))) == KB_KEEP_BUILDS
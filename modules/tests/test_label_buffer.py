@@ -0,0 +1,31 @@
+import numpy as np
+
+from utils.notebook_utils.label_buffer import LABEL_MATRIX_DTYPE, LabelBuffer
+from utils.notebook_utils.sharded_label_matrix import ShardedLabelMatrix
+
+
+def test_label_matrix_keeps_int64_labels():
+    buffer = LabelBuffer(capacity=1)
+    for row in range(300):
+        buffer.add_row(row, [1, 0, -1])
+
+    L = buffer.to_csr(shape=(300, 3))
+    assert L.dtype == LABEL_MATRIX_DTYPE
+    # would wrap around at int8
+    assert (L.T @ L).toarray()[0, 0] == 300
+    assert list(np.ravel(L.sum(axis=0))) == [300, 0, -300]
+
+
+def test_sharded_label_matrix_reads_int64_labels(tmpdir):
+    buffer = LabelBuffer()
+    for row in range(10):
+        buffer.add_row(row, [1, -1])
+
+    label_matrix = ShardedLabelMatrix.create(str(tmpdir.join("labels")), list(range(10)), 4, 2)
+    L = buffer.to_csr(shape=(10, 2))
+    for shard_index in range(label_matrix.num_shards):
+        start, end = label_matrix.shard_rows(shard_index)
+        label_matrix.write_shard(shard_index, [L[start:end]])
+
+    assert label_matrix.to_csr().dtype == LABEL_MATRIX_DTYPE
+    assert (label_matrix.to_csr() != L).nnz == 0
@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("snorkel")
+
+from utils.notebook_utils.label_cache import lf_fingerprint
+
+
+def test_runtime_caches_are_not_fingerprinted():
+    pos_tag_cache = pytest.importorskip("utils.label_functions.pos_tag_cache")
+    before = lf_fingerprint(pos_tag_cache.sentence_has_verb)
+
+    pos_tag_cache.verb_cache["sentence::0::0"] = True
+    try:
+        assert lf_fingerprint(pos_tag_cache.sentence_has_verb) == before
+    finally:
+        pos_tag_cache.verb_cache.pop("sentence::0::0")
+
+
+def test_settings_are_fingerprinted(monkeypatch):
+    pos_tag_cache = pytest.importorskip("utils.label_functions.pos_tag_cache")
+    before = lf_fingerprint(pos_tag_cache.sentence_has_verb)
+
+    monkeypatch.setattr(pos_tag_cache, "USE_STORED_POS_TAGS", not pos_tag_cache.USE_STORED_POS_TAGS)
+    assert lf_fingerprint(pos_tag_cache.sentence_has_verb) != before
+
+
+def test_lazy_indices_are_fingerprinted_the_same_before_and_after_loading(monkeypatch):
+    import pandas as pd
+
+    from utils.label_functions import disease_index
+
+    monkeypatch.setattr(disease_index, "_disease_index", None)
+    before = lf_fingerprint(disease_index.get_disease_index)
+
+    normalization_df = pd.DataFrame({"subsumed_name": ["breast cancer"], "slim_id": ["DOID:1612"]})
+    monkeypatch.setattr(disease_index, "_disease_index", disease_index.DiseaseIndex(normalization_df))
+    assert lf_fingerprint(disease_index.get_disease_index) == before
+
+
+def LF_GENE_IS(c, gene_cid, label):
+    return label if c.Gene_cid == gene_cid else 0
+
+
+def test_partial_lfs_are_named_and_fingerprinted():
+    import functools
+
+    from utils.notebook_utils.label_cache import lf_name
+
+    lf = functools.partial(LF_GENE_IS, gene_cid="0", label=1)
+    assert lf_name(lf) == "LF_GENE_IS"
+    assert lf_fingerprint(lf) == lf_fingerprint(functools.partial(LF_GENE_IS, gene_cid="0", label=1))
+    assert lf_fingerprint(lf) != lf_fingerprint(functools.partial(LF_GENE_IS, gene_cid="1", label=1))
+
+
+def test_cached_labels(snorkel_db, tmpdir):
+    import functools
+
+    from utils.notebook_utils.label_cache import label_candidates_cached
+    from utils.notebook_utils.label_matrix_helper import label_candidates
+
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+    lfs = [functools.partial(LF_GENE_IS, gene_cid="0", label=1), functools.partial(LF_GENE_IS, gene_cid="1", label=-1)]
+    cache_dir = str(tmpdir.join("label_cache"))
+
+    L = label_candidates_cached(session, candidate_ids, lfs, cache_dir=cache_dir, verbose=False, num_workers=1)
+    assert (L != label_candidates(session, candidate_ids, lfs, num_workers=1)).nnz == 0
+    assert (label_candidates_cached(session, candidate_ids, lfs, cache_dir=cache_dir, verbose=False) != L).nnz == 0
+
+    with pytest.raises(ValueError):
+        label_candidates_cached(session, candidate_ids, lfs, cache_dir=cache_dir, output_dir=str(tmpdir.join("labels")))
+    session.close()
@@ -0,0 +1,80 @@
+import functools
+
+import pytest
+
+pytest.importorskip("snorkel")
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from utils.notebook_utils import label_matrix_helper
+from utils.notebook_utils.label_matrix_helper import extend_label_matrix, label_candidates
+
+
+def LF_GENE_ZERO(c):
+    return 1 if c.Gene_cid == "0" else -1
+
+
+def test_extend_label_matrix_labels_only_new_candidates(snorkel_db):
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+
+    existing_ids = candidate_ids[:7]
+    existing_L = label_candidates(session, existing_ids, [LF_GENE_ZERO], num_workers=1)
+    L, label_ids = extend_label_matrix(
+        session, existing_L, existing_ids, candidate_ids[5:] + candidate_ids[:5], [LF_GENE_ZERO], num_workers=1
+    )
+    assert label_ids == candidate_ids
+    assert (L != label_candidates(session, candidate_ids, [LF_GENE_ZERO], num_workers=1)).nnz == 0
+    session.close()
+
+
+def test_extend_label_matrix_with_output_dir(snorkel_db, tmpdir):
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+
+    existing_L = label_candidates(session, candidate_ids[:7], [LF_GENE_ZERO], num_workers=1)
+    with pytest.raises(ValueError):
+        extend_label_matrix(
+            session, existing_L, candidate_ids[:7], candidate_ids, [LF_GENE_ZERO],
+            num_workers=1, output_dir=str(tmpdir.join("labels"))
+        )
+    session.close()
+
+
+class ExpiringSession(Session):
+    # candidates can't read anything from the database once their batch's session is closed
+    def close(self):
+        self.expire_all()
+        super(ExpiringSession, self).close()
+
+
+def test_batch_lfs_match_scalar_lfs(snorkel_db, monkeypatch):
+    import numpy as np
+
+    from utils.label_functions.candidate_context import batch_lf
+
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+    monkeypatch.setattr(label_matrix_helper, "sessionmaker", functools.partial(sessionmaker, class_=ExpiringSession))
+
+    def LF_ODD_DOCUMENT(c):
+        return 1 if int(c.get_parent().document.name) % 2 else -1
+
+    @batch_lf(lambda batch: np.where(batch["document_name"].astype(int) % 2, 1, -1))
+    def LF_ODD_DOCUMENT_BATCH(c):
+        return LF_ODD_DOCUMENT(c)
+
+    @batch_lf(lambda batch: np.where(batch.between_token_counts() > 5, -1, 0))
+    def LF_DISTANCE_LONG(c):
+        left, right = sorted(c.get_contexts(), key=lambda span: span.get_word_start())
+        return -1 if right.get_word_start() - left.get_word_end() - 1 > 5 else 0
+
+    expected = label_candidates(session, candidate_ids, [LF_ODD_DOCUMENT, LF_GENE_ZERO, LF_DISTANCE_LONG], num_workers=1)
+    assert expected[:, 2].nnz == len(candidate_ids)
+    for prefetch_depth in (0, 2):
+        L = label_candidates(
+            session, candidate_ids, [LF_ODD_DOCUMENT_BATCH, LF_GENE_ZERO, LF_DISTANCE_LONG],
+            num_workers=1, batch_size=3, prefetch_depth=prefetch_depth
+        )
+        assert (L != expected).nnz == 0
+    session.close()
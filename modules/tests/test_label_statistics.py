@@ -0,0 +1,147 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sparse
+
+pytest.importorskip("snorkel")
+
+from utils.notebook_utils.label_matrix_helper import get_conflict_matrix, get_overlap_matrix, lf_statistics
+
+
+def baseline_overlap_matrix(L, normalize=False):
+    # the dense version get_overlap_matrix replaced
+    L = L.todense() if sparse.issparse(L) else L
+    n, m = L.shape
+    X = np.where(L != 0, 1, 0).T
+    G = X @ X.T
+
+    if normalize:
+        G = G / n
+    return G
+
+
+def baseline_conflict_matrix(L, normalize=False):
+    # the dense version get_conflict_matrix replaced
+    L = L.todense() if sparse.issparse(L) else L
+    n, m = L.shape
+    C = np.zeros((m, m))
+
+    for i in range(m):
+        for j in range(m):
+            overlaps = list(
+                set(np.where(L[:, i] != 0)[0]).intersection(
+                    np.where(L[:, j] != 0)[0]
+                )
+            )
+            C[i, j] = np.where(L[overlaps, i] != L[overlaps, j], 1, 0).sum()
+
+    if normalize:
+        C = C / n
+    return C
+
+
+def random_label_matrix(num_rows=60, num_columns=7, seed=0):
+    random_state = np.random.RandomState(seed)
+    L = random_state.choice([-1, 0, 0, 1], size=(num_rows, num_columns))
+    return sparse.csr_matrix(L)
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 7, 25, 1000])
+@pytest.mark.parametrize("normalize", [False, True])
+def test_overlap_and_conflict_match_dense(chunk_size, normalize):
+    L = random_label_matrix()
+
+    overlap = get_overlap_matrix(L, normalize=normalize, chunk_size=chunk_size)
+    conflict = get_conflict_matrix(L, normalize=normalize, chunk_size=chunk_size)
+    np.testing.assert_allclose(overlap, np.asarray(baseline_overlap_matrix(L, normalize=normalize)))
+    np.testing.assert_allclose(conflict, baseline_conflict_matrix(L, normalize=normalize))
+
+
+def test_conflicts_with_mixed_sign_and_abstain_rows():
+    L = sparse.csr_matrix(np.array([
+        [1, -1, 1, 0],    # mixed signs
+        [0, 0, 0, 0],     # every label function abstains
+        [-1, -1, 0, 1],   # mixed signs
+        [1, 1, 1, 0],     # agreement only
+        [0, 0, 0, 0],
+        [-1, 1, -1, -1],
+    ]))
+    # an explicitly stored zero is still an abstain (row 3, column 2)
+    L.data[L.indptr[3] + 2] = 0
+    assert L.nnz == 13 and L.count_nonzero() == 12
+
+    for chunk_size in (None, 1, 2, 4):
+        conflict = get_conflict_matrix(L, chunk_size=chunk_size)
+        np.testing.assert_allclose(conflict, baseline_conflict_matrix(L))
+    assert get_conflict_matrix(L)[0, 1] == 2
+
+    abstain_only = sparse.csr_matrix((3, 4), dtype=np.int64)
+    np.testing.assert_allclose(get_conflict_matrix(abstain_only), np.zeros((4, 4)))
+
+
+def baseline_lf_summary(L, Y=None, lf_names=None):
+    # metal 0.3.2's lf_summary (labels are 1...k and 0 abstains)
+    n, m = L.shape
+    if lf_names is not None:
+        col_names = ["j"]
+        d = {"j": list(range(m))}
+    else:
+        lf_names = list(range(m))
+        col_names = []
+        d = {}
+
+    polarities = [sorted(list(set(L[:, i].data))) for i in range(m)]
+    overlapped = np.where(np.ravel((L != 0).sum(axis=1)) > 1, 1, 0)
+    row_max = sparse.diags(np.ravel(L.max(axis=1).todense()))
+    conflicted = np.ravel(np.max(row_max @ (L != 0) != L, axis=1).astype(int).todense())
+
+    col_names.extend(["Polarity", "Coverage", "Overlaps", "Conflicts"])
+    d["Polarity"] = pd.Series(data=[p[0] if len(p) == 1 else p for p in polarities], index=lf_names)
+    d["Coverage"] = pd.Series(data=np.ravel((L != 0).sum(axis=0)) / n, index=lf_names)
+    d["Overlaps"] = pd.Series(data=np.nan_to_num((L != 0).T @ overlapped / n), index=lf_names)
+    d["Conflicts"] = pd.Series(data=np.nan_to_num((L != 0).T @ conflicted / n), index=lf_names)
+
+    if Y is not None:
+        col_names.extend(["Correct", "Incorrect", "Emp. Acc."])
+        corrects, incorrects = [], []
+        for i in range(m):
+            counter = Counter(zip(Y, L[:, i].toarray().ravel()))
+            k = max(max(pair) for pair in counter) + 1
+            mat = np.zeros((k, k), dtype=int)
+            for (gold, pred), count in counter.items():
+                mat[gold, pred] = count
+            mat = mat[1:, 1:]
+            corrects.append(np.diagonal(mat).sum())
+            incorrects.append(mat.sum() - corrects[-1])
+        dense = L.toarray()
+        X = np.where(dense == 0, 0, np.where(dense == np.vstack([Y] * m).T, 1, -1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            accs = 0.5 * (X.sum(axis=0) / (dense != 0).sum(axis=0) + 1)
+        d["Correct"] = pd.Series(data=corrects, index=lf_names)
+        d["Incorrect"] = pd.Series(data=incorrects, index=lf_names)
+        d["Emp. Acc."] = pd.Series(data=accs, index=lf_names)
+
+    return pd.DataFrame(data=d, index=lf_names)[col_names]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 9])
+@pytest.mark.parametrize("with_gold", [False, True])
+@pytest.mark.parametrize("lf_names", [None, ["LF_A", "LF_B", "LF_C", "LF_D", "LF_E"]])
+def test_lf_statistics_match_metal(chunk_size, with_gold, lf_names):
+    random_state = np.random.RandomState(1)
+    L = random_state.choice([0, 0, 1, 2], size=(40, 5))
+    L[:, 3] = np.where(L[:, 3] != 0, 2, 0)    # a single polarity
+    L[:, 4] = 0                               # never labels
+    L[:2] = 0
+    L = sparse.csr_matrix(L)
+    Y = random_state.choice([0, 1, 2], size=40) if with_gold else None
+
+    expected = baseline_lf_summary(L, Y=Y, lf_names=lf_names)
+    stats_df = lf_statistics(L, Y=Y, lf_names=lf_names, chunk_size=chunk_size)
+
+    assert list(stats_df.columns) == list(expected.columns)
+    assert list(stats_df.dtypes) == list(expected.dtypes)
+    assert list(stats_df["Polarity"]) == list(expected["Polarity"])
+    pd.testing.assert_frame_equal(stats_df.drop(columns="Polarity"), expected.drop(columns="Polarity"))
@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip("snorkel")
+pytest.importorskip("nltk")
+
+from utils.label_functions import pos_tag_cache
+from utils.notebook_utils.label_matrix_helper import label_candidates
+
+
+def fake_pos_tag(tokens):
+    return [(token, "VBZ" if token == "is" else "NN") for token in tokens]
+
+
+def LF_NO_VERB(c):
+    return 0 if pos_tag_cache.sentence_has_verb(c.get_parent()) else -1
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_worker_verb_checks_are_saved(snorkel_db, tmpdir, monkeypatch, num_workers):
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+
+    # the workers are forked, so they see the patched tagger and the empty cache
+    monkeypatch.setattr(pos_tag_cache, "verb_cache", {})
+    monkeypatch.setattr(pos_tag_cache, "word_tokenize", str.split)
+    monkeypatch.setattr(pos_tag_cache.nltk, "pos_tag", fake_pos_tag)
+
+    L = label_candidates(session, candidate_ids, [LF_NO_VERB], num_workers=num_workers, shard_size=3)
+    assert L.nnz == 0
+
+    sentence_ids = set(candidate.get_parent().stable_id for candidate in session.query(DiseaseGene).all())
+    assert set(pos_tag_cache.verb_cache) == sentence_ids
+
+    path = str(tmpdir.join("verb_cache.pkl"))
+    assert pos_tag_cache.save_pos_tag_cache(path) == len(sentence_ids)
+    session.close()
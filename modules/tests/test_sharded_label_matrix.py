@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+pytest.importorskip("snorkel")
+
+from utils.notebook_utils.label_matrix_helper import label_candidates
+from utils.notebook_utils.sharded_label_matrix import ShardedLabelMatrix
+
+
+def LF_GENE_ZERO(c):
+    if os.environ.get("TEST_LF_CRASH_AFTER") and c.id > int(os.environ["TEST_LF_CRASH_AFTER"]):
+        raise RuntimeError("crash")
+    return 1 if c.Gene_cid == "0" else -1
+
+
+def LF_DOCUMENT(c):
+    return 1 if c.get_parent().document.name.endswith("1") else 0
+
+
+def test_resume_after_crash(snorkel_db, tmpdir, monkeypatch):
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+    output_dir = str(tmpdir.join("labels"))
+
+    monkeypatch.setenv("TEST_LF_CRASH_AFTER", str(candidate_ids[12]))
+    with pytest.raises(RuntimeError):
+        label_candidates(session, candidate_ids, [LF_GENE_ZERO], num_workers=1, output_dir=output_dir, output_shard_size=5)
+    assert ShardedLabelMatrix(output_dir).missing_shards() == [2, 3]
+
+    monkeypatch.delenv("TEST_LF_CRASH_AFTER")
+    label_matrix = label_candidates(session, candidate_ids, [LF_GENE_ZERO], num_workers=1, output_dir=output_dir, output_shard_size=5)
+    expected = label_candidates(session, candidate_ids, [LF_GENE_ZERO], num_workers=1)
+    assert label_matrix.is_complete
+    assert (label_matrix.to_csr() != expected).nnz == 0
+    session.close()
+
+
+def test_refuse_resume_with_other_lfs(snorkel_db, tmpdir):
+    session_factory, DiseaseGene, candidate_ids = snorkel_db
+    session = session_factory()
+    output_dir = str(tmpdir.join("labels"))
+
+    label_candidates(session, candidate_ids, [LF_GENE_ZERO], num_workers=1, output_dir=output_dir, output_shard_size=5)
+    with pytest.raises(ValueError):
+        label_candidates(session, candidate_ids, [LF_DOCUMENT], num_workers=1, output_dir=output_dir, output_shard_size=5)
+    session.close()
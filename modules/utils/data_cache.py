@@ -0,0 +1,153 @@
+"""
+Local content addressed cache for the remote reference tables.
+
+Every url below is pinned to a commit, so the bytes behind it never change.
+The first download stores the file under objects/<sha256 of the content> and
+records url -> sha256 in urls/<sha256 of the url>.json. Later reads never touch
+the network. Each read checks the file against its recorded sha256, so a
+truncated or corrupted entry is deleted and downloaded again.
+Prefetch everything on a machine with internet access:
+
+    python modules/utils/data_cache.py
+
+and copy (or share) the cache directory with the air-gapped nodes.
+
+SNORKELING_CACHE_DIR - where the cache lives (default ~/.cache/snorkeling)
+SNORKELING_OFFLINE - set to 1 to raise an error instead of downloading missing files
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+PINNED_URLS = [
+    # label functions
+    "https://github.com/dhimmel/entrez-gene/blob/a7362748a34211e5df6f2d185bb3246279760546/download/Homo_sapiens.gene_info.gz?raw=true",
+    "https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/slim-terms-prop.tsv",
+    # generate_datafiles
+    "https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/xrefs-prop-slim.tsv",
+    "https://raw.githubusercontent.com/dhimmel/entrez-gene/a7362748a34211e5df6f2d185bb3246279760546/data/genes-human.tsv",
+    "https://github.com/dhimmel/integrate/raw/93feba1765fbcd76fd79e22f25121f5399629148/compile/DaG-association.tsv",
+    "https://raw.githubusercontent.com/dhimmel/stargeo/08b126cc1f93660d17893c4a3358d3776e35fd84/data/diffex.tsv",
+    "https://raw.githubusercontent.com/dhimmel/drugbank/7b94454b14a2fa4bb9387cb3b4b9924619cfbd3e/data/drugbank.tsv",
+    "https://raw.githubusercontent.com/dhimmel/integrate/93feba1765fbcd76fd79e22f25121f5399629148/compile/CbG-binding.tsv",
+    "https://raw.githubusercontent.com/dhimmel/lincs/bbc6812b7d19e98637b44373cdfc52f61bce6327/data/consensi/signif/dysreg-drugbank.tsv",
+    "https://raw.githubusercontent.com/dhimmel/indications/11d535ba0884ee56c3cd5756fdfb4985f313bd80/catalog/indications.tsv",
+]
+
+
+def get_cache_dir():
+    return pathlib.Path(os.environ.get("SNORKELING_CACHE_DIR", "~/.cache/snorkeling")).expanduser()
+
+
+def is_offline():
+    return os.environ.get("SNORKELING_OFFLINE", "0") == "1"
+
+
+def _url_entry(url):
+    url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return get_cache_dir() / "urls" / (url_hash + ".json")
+
+
+def _object_path(content_hash, url):
+    # keep the file extension so pandas can still infer the compression
+    suffix = "".join(pathlib.PurePosixPath(urlparse(url).path).suffixes)
+    return get_cache_dir() / "objects" / content_hash[:2] / (content_hash + suffix)
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(str(path), "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _remove(path):
+    try:
+        os.remove(str(path))
+    except FileNotFoundError:
+        pass
+
+
+def download(url):
+    """
+    This function is designed to download a url into the cache.
+
+    url - the pinned url to download
+
+    returns the path of the cached file
+    """
+    cache_dir = get_cache_dir()
+    (cache_dir / "tmp").mkdir(parents=True, exist_ok=True)
+
+    sha256 = hashlib.sha256()
+    tmp_file = tempfile.NamedTemporaryFile(dir=str(cache_dir / "tmp"), delete=False)
+    try:
+        with urlopen(url) as response, tmp_file:
+            for chunk in iter(lambda: response.read(1 << 20), b""):
+                sha256.update(chunk)
+                tmp_file.write(chunk)
+
+        object_path = _object_path(sha256.hexdigest(), url)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(tmp_file.name, str(object_path))
+    finally:
+        # only left behind if the download failed
+        _remove(tmp_file.name)
+
+    entry = _url_entry(url)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp_entry = entry.with_suffix(".tmp")
+    with open(str(tmp_entry), "w") as f:
+        json.dump({"url": url, "sha256": sha256.hexdigest(), "path": str(object_path.relative_to(cache_dir))}, f)
+    os.replace(str(tmp_entry), str(entry))
+    return object_path
+
+
+def cached_path(url):
+    """
+    This function is designed to return a local copy of a pinned url.
+    The file is only downloaded if it isn't already in the cache.
+    Pass the returned path to pandas instead of the url.
+
+    url - the pinned url of the file
+    """
+    entry = _url_entry(url)
+    if entry.exists():
+        with open(str(entry), "r") as f:
+            record = json.load(f)
+        object_path = get_cache_dir() / record["path"]
+        if object_path.exists():
+            if _file_sha256(object_path) == record["sha256"]:
+                return str(object_path)
+            # truncated or corrupted, drop the entry and download it again
+            _remove(object_path)
+        _remove(entry)
+
+    if is_offline():
+        raise FileNotFoundError(
+            "{} isn't in the data cache ({}). Run python modules/utils/data_cache.py "
+            "on a machine with internet access first.".format(url, get_cache_dir())
+        )
+    return str(download(url))
+
+
+def prefetch(urls=PINNED_URLS):
+    """
+    This function is designed to fill the cache with every pinned url.
+
+    urls - the urls to download
+    """
+    for url in urls:
+        print("{} -> {}".format(url, cached_path(url)))
+
+
+if __name__ == "__main__":
+    prefetch(sys.argv[1:] if len(sys.argv) > 1 else PINNED_URLS)
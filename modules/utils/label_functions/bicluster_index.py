@@ -0,0 +1,122 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+class BiclusterIndex(object):
+    """Bicluster Theme Index
+    This class collapses the bicluster results (https://zenodo.org/record/1035500)
+    into one row of summed theme scores per (pubmed_id, sentence_num).
+    Label functions look up a sentence with a single dictionary access instead
+    of querying the full bicluster dataframe, and a whole batch of candidates
+    can be scored at once with lookup_batch.
+    """
+
+    def __init__(self, bicluster_df, themes):
+        """ Initialize the index
+
+        Keyword arguments:
+        self -- the class object
+        bicluster_df -- the dataframe created by notebook_utils.bicluster.create_bicluster_df
+        themes -- the theme columns to sum up (e.g. U, Ud, D, J ...)
+        """
+        grouped_df = (
+            bicluster_df
+            .groupby(["pubmed_id", "sentence_num"])[list(themes)]
+            .sum()
+        )
+
+        self.themes = list(themes)
+        self.theme_index = {theme: col for col, theme in enumerate(self.themes)}
+        self.scores = grouped_df.values.astype(np.float64)
+        self.index = {
+            (int(pubmed_id), int(sentence_num)): row
+            for row, (pubmed_id, sentence_num) in enumerate(grouped_df.index)
+        }
+        self._fingerprint = None
+
+    @classmethod
+    def from_file(cls, path, themes):
+        """Read the bicluster results file and build the index
+
+        Keyword arguments:
+        cls -- the class object
+        path -- the path to the bicluster results tsv
+        themes -- the theme columns to sum up
+        """
+        bicluster_df = pd.read_table(path, usecols=["pubmed_id", "sentence_num"] + list(themes))
+        return cls(bicluster_df, themes)
+
+    def lookup(self, pubmed_id, sentence_num):
+        """Return the summed theme scores for a sentence or None if it isn't in the index
+
+        Keyword arguments:
+        self -- the class object
+        pubmed_id -- the pubmed id of the document (the snorkel document name)
+        sentence_num -- the position of the sentence in the document
+        """
+        row = self.index.get((int(pubmed_id), int(sentence_num)))
+        return None if row is None else self.scores[row]
+
+    def score(self, pubmed_id, sentence_num, theme):
+        """Return the summed score for a single theme (0 if the sentence isn't indexed)
+
+        Keyword arguments:
+        self -- the class object
+        pubmed_id -- the pubmed id of the document (the snorkel document name)
+        sentence_num -- the position of the sentence in the document
+        theme -- the theme column of interest
+        """
+        row = self.index.get((int(pubmed_id), int(sentence_num)))
+        return 0.0 if row is None else self.scores[row, self.theme_index[theme]]
+
+    def lookup_batch(self, pubmed_ids, sentence_nums):
+        """Return the summed theme scores for a batch of sentences
+
+        Keyword arguments:
+        self -- the class object
+        pubmed_ids -- an iterable of pubmed ids
+        sentence_nums -- an iterable of sentence positions
+
+        Returns:
+        A (number of sentences x number of themes) array. Sentences that aren't
+        in the index get a row of zeros.
+        """
+        rows = np.array([
+            self.index.get((int(pubmed_id), int(sentence_num)), -1)
+            for pubmed_id, sentence_num in zip(pubmed_ids, sentence_nums)
+        ], dtype=np.int64)
+
+        scores = np.zeros((len(rows), len(self.themes)), dtype=np.float64)
+        found = rows >= 0
+        scores[found] = self.scores[rows[found]]
+        return scores
+
+    def label_batch(self, pubmed_ids, sentence_nums):
+        """Evaluate every bicluster label function for a batch of sentences
+
+        Keyword arguments:
+        self -- the class object
+        pubmed_ids -- an iterable of pubmed ids
+        sentence_nums -- an iterable of sentence positions
+
+        Returns:
+        A (number of sentences x number of themes) int array that contains
+        1 where a theme's summed score is above 0 and 0 otherwise
+        """
+        return (self.lookup_batch(pubmed_ids, sentence_nums) > 0.0).astype(np.int8)
+
+    def fingerprint(self):
+        """Return a hash of the indexed sentences and their theme scores
+        (used to tell when cached label function output is stale)
+
+        Keyword arguments:
+        self -- the class object
+        """
+        if self._fingerprint is None:
+            sha256 = hashlib.sha256("|".join(self.themes).encode("utf-8"))
+            sha256.update(np.array(list(self.index.keys()), dtype=np.int64).tobytes())
+            sha256.update(np.ascontiguousarray(self.scores).tobytes())
+            self._fingerprint = sha256.hexdigest()
+        return self._fingerprint
@@ -0,0 +1,379 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from snorkel.lf_helpers import (
+    get_left_tokens as snorkel_get_left_tokens,
+    get_right_tokens as snorkel_get_right_tokens,
+    get_between_tokens as snorkel_get_between_tokens,
+    get_tagged_text as snorkel_get_tagged_text,
+    get_text_between as snorkel_get_text_between,
+)
+
+
+# seed of every label function that draws random numbers
+LF_RANDOM_SEED = 100
+
+
+class CandidateContext(object):
+    """Memoized Candidate Wrapper
+    This class wraps a snorkel candidate so every label function applied to it
+    shares the same tagged text, between text, token windows and parent sentence.
+    Each value is computed the first time a label function asks for it.
+    Anything else (c[0], c.Gene_cid, c.id ...) is passed through to the candidate.
+    """
+
+    def __init__(self, candidate):
+        """ Initialize the context
+
+        Keyword arguments:
+        self -- the class object
+        candidate -- the snorkel candidate object to be labeled
+        """
+        self.candidate = candidate
+        self._cache = {}
+
+    def lookup(self, key, func, *args, **kwargs):
+        """Compute a value once and store it for every later call
+
+        Keyword arguments:
+        self -- the class object
+        key -- the cache key for the value
+        func -- the function that computes the value
+        args, kwargs -- arguments passed into func
+        """
+        if key not in self._cache:
+            self._cache[key] = func(*args, **kwargs)
+        return self._cache[key]
+
+    def __getattr__(self, name):
+        # Only called when the attribute isn't found on the context itself
+        if name in ("candidate", "_cache"):
+            raise AttributeError(name)
+        return getattr(self.candidate, name)
+
+    def __getitem__(self, index):
+        return self.candidate[index]
+
+    def __len__(self):
+        return len(self.candidate)
+
+    def __repr__(self):
+        return "CandidateContext({!r})".format(self.candidate)
+
+    @property
+    def tagged_text(self):
+        return self.lookup("tagged_text", snorkel_get_tagged_text, self.candidate)
+
+    @property
+    def text_between(self):
+        return self.lookup("text_between", snorkel_get_text_between, self.candidate)
+
+    @property
+    def between_tokens(self):
+        return self.lookup(
+            "between_tokens",
+            lambda: list(snorkel_get_between_tokens(self.candidate))
+        )
+
+    @property
+    def parent(self):
+        return self.lookup("parent", self.candidate.get_parent)
+
+    @property
+    def sentence_id(self):
+        return self.lookup("sentence_id", lambda: self.parent.id)
+
+    @property
+    def sentence_text(self):
+        return self.lookup("sentence_text", lambda: self.parent.text)
+
+    @property
+    def document_name(self):
+        return self.lookup("document_name", lambda: self.parent.document.name)
+
+    @property
+    def sentence_position(self):
+        return self.lookup("sentence_position", lambda: self.parent.position)
+
+    def get_parent(self):
+        return self.parent
+
+    def left_tokens(self, span_index, window=3):
+        """Return the (lowercased) tokens to the left of a span
+
+        Keyword arguments:
+        self -- the class object
+        span_index -- the position of the span in the candidate (0 or 1)
+        window -- the number of tokens to grab
+        """
+        return self.lookup(
+            ("left_tokens", span_index, window),
+            lambda: list(snorkel_get_left_tokens(self.candidate[span_index], window=window))
+        )
+
+    def right_tokens(self, span_index, window=3):
+        """Return the (lowercased) tokens to the right of a span
+
+        Keyword arguments:
+        self -- the class object
+        span_index -- the position of the span in the candidate (0 or 1)
+        window -- the number of tokens to grab
+        """
+        return self.lookup(
+            ("right_tokens", span_index, window),
+            lambda: list(snorkel_get_right_tokens(self.candidate[span_index], window=window))
+        )
+
+
+"""
+Drop in replacements for snorkel's lf helpers.
+They read from the context when label_candidates passes one in
+and fall back to snorkel when a label function is given a raw candidate.
+"""
+
+
+def get_tagged_text(c):
+    if isinstance(c, CandidateContext):
+        return c.tagged_text
+    return snorkel_get_tagged_text(c)
+
+
+def get_text_between(c):
+    if isinstance(c, CandidateContext):
+        return c.text_between
+    return snorkel_get_text_between(c)
+
+
+def get_between_tokens(c):
+    if isinstance(c, CandidateContext):
+        return c.between_tokens
+    return list(snorkel_get_between_tokens(c))
+
+
+def left_tokens(c, span_index, window=3):
+    if isinstance(c, CandidateContext):
+        return c.left_tokens(span_index, window=window)
+    return list(snorkel_get_left_tokens(c[span_index], window=window))
+
+
+def right_tokens(c, span_index, window=3):
+    if isinstance(c, CandidateContext):
+        return c.right_tokens(span_index, window=window)
+    return list(snorkel_get_right_tokens(c[span_index], window=window))
+
+
+def memoize(c, key, func, *args):
+    """
+    This function is designed to let label function modules cache their own
+    per candidate values (e.g. knowledge base lookups) on the context.
+    Raw candidates just get func(*args).
+
+    c - the candidate or CandidateContext
+    key - the cache key for the value
+    func - the function that computes the value
+    args - arguments passed into func
+    """
+    if isinstance(c, CandidateContext):
+        return c.lookup(key, func, *args)
+    return func(*args)
+
+
+def get_phrase_hits(c, matcher, text):
+    """
+    This function is designed to scan a text for every phrase set of a
+    PhraseMatcher once per candidate, so all the phrase based label functions
+    that look at the same text (tagged text, between text, sentence) share one scan.
+
+    c - the candidate or CandidateContext
+    matcher - the PhraseMatcher exported by the label function module
+    text - the text to scan (e.g. get_tagged_text(c))
+    """
+    return memoize(c, ("phrase_hits", id(matcher), text), matcher.scan, text)
+
+
+def candidate_uniform(candidate_id, lf_name, seed=LF_RANDOM_SEED):
+    """
+    This function is designed to give label functions a random number that only
+    depends on the candidate, the label function and the seed (not on the order
+    candidates are labeled in), so serial, sharded and multiprocess labeling
+    produce the same labels and cached columns stay valid.
+
+    candidate_id - the id of the candidate
+    lf_name - the name of the label function drawing the number
+    seed - change to draw a different set of numbers
+
+    returns a float in [0, 1)
+    """
+    key = "{}:{}:{}".format(seed, lf_name, int(candidate_id)).encode("utf-8")
+    value = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+    # the top 53 bits fill a double's mantissa exactly
+    return (value >> 11) / float(1 << 53)
+
+
+def candidate_uniform_batch(candidate_ids, lf_name, seed=LF_RANDOM_SEED):
+    """
+    This function is designed to draw candidate_uniform for a batch of candidates.
+
+    candidate_ids - an iterable of candidate ids
+    lf_name - the name of the label function drawing the numbers
+    seed - change to draw a different set of numbers
+
+    returns a float array with one number per candidate
+    """
+    return np.array([candidate_uniform(cid, lf_name, seed) for cid in candidate_ids], dtype=np.float64)
+
+
+def get_sentence_text(c):
+    if isinstance(c, CandidateContext):
+        return c.sentence_text
+    return c.get_parent().text
+
+
+def get_document_name(c):
+    if isinstance(c, CandidateContext):
+        return c.document_name
+    return c.get_parent().document.name
+
+
+def get_sentence_position(c):
+    if isinstance(c, CandidateContext):
+        return c.sentence_position
+    return c.get_parent().position
+
+
+def sentence_scoped(lf):
+    """
+    This function is designed to be used as a decorator for label functions
+    whose output only depends on the parent sentence (not the candidate pair).
+    label_candidates evaluates these label functions once per sentence and
+    reuses the result for every candidate in that sentence.
+
+    lf - the label function to mark as sentence scoped
+    """
+    lf.scope = "sentence"
+    return lf
+
+
+def is_sentence_scoped(lf):
+    return getattr(lf, "scope", None) == "sentence"
+
+
+def batch_lf(batch_func):
+    """
+    This function is designed to be used as a decorator that attaches a
+    column oriented version to a label function. batch_func takes a
+    CandidateBatch and returns a numpy array with one label per candidate.
+    label_candidates calls batch_func once per shard instead of calling the
+    label function once per candidate. The label function itself still works
+    on single candidates (notebooks, debugging) and both have to agree.
+
+    batch_func - the batch version of the label function
+    """
+    def decorate(lf):
+        lf.batch = batch_func
+        return lf
+    return decorate
+
+
+def has_batch(lf):
+    return callable(getattr(lf, "batch", None))
+
+
+class CandidateBatch(object):
+    """Column Oriented Candidate Batch
+    This class holds the candidates of a shard as one dataframe with a row per candidate:
+    candidate_id, the entity ids (e.g. Disease_cid, Gene_cid), sentence_id, document_name,
+    sentence_position, sentence_text and the word/char offsets of each span (span0_word_start ...).
+    batch["column"] returns the column as a numpy array and lookup caches values
+    (e.g. knowledge base bitmasks) shared by several batch label functions.
+    label_candidates builds the rows while each database batch is loaded and only keeps
+    the rows (see from_records), so batch label functions should only read the columns.
+    """
+
+    def __init__(self, candidates):
+        """ Initialize the batch
+
+        Keyword arguments:
+        self -- the class object
+        candidates -- a list of candidates or CandidateContext objects
+        """
+        self.frame = pd.DataFrame.from_records([
+            self.record(c if isinstance(c, CandidateContext) else CandidateContext(c))
+            for c in candidates
+        ])
+        self._cache = {}
+
+    @classmethod
+    def from_records(cls, records):
+        """Build a batch from rows that were already read (see record),
+        e.g. while the candidates' session was still open
+
+        Keyword arguments:
+        cls -- the class object
+        records -- a list of row dictionaries
+        """
+        batch = cls([])
+        batch.frame = pd.DataFrame.from_records(records)
+        return batch
+
+    @staticmethod
+    def record(c):
+        """Return the row of one candidate as a dictionary
+
+        Keyword arguments:
+        c -- the CandidateContext of the candidate
+        """
+        candidate = c.candidate
+        record = {
+            "candidate_id": candidate.id,
+            "sentence_id": c.sentence_id,
+            "document_name": c.document_name,
+            "sentence_position": c.sentence_position,
+            "sentence_text": c.sentence_text,
+        }
+        for argname in getattr(candidate, "__argnames__", []):
+            record["{}_cid".format(argname)] = getattr(candidate, "{}_cid".format(argname), None)
+        for span_index, span in enumerate(candidate.get_contexts()):
+            record["span{}_word_start".format(span_index)] = span.get_word_start()
+            record["span{}_word_end".format(span_index)] = span.get_word_end()
+            record["span{}_char_start".format(span_index)] = span.char_start
+            record["span{}_char_end".format(span_index)] = span.char_end
+        return record
+
+    def lookup(self, key, func, *args, **kwargs):
+        """Compute a value for the whole batch once and store it for every later call
+
+        Keyword arguments:
+        self -- the class object
+        key -- the cache key for the value
+        func -- the function that computes the value
+        args, kwargs -- arguments passed into func
+        """
+        if key not in self._cache:
+            self._cache[key] = func(*args, **kwargs)
+        return self._cache[key]
+
+    def __getitem__(self, column):
+        return self.frame[column].values
+
+    def __len__(self):
+        return len(self.frame)
+
+    def between_token_counts(self):
+        """Return the number of tokens between the two spans of every candidate
+        (len(get_between_tokens(c)) computed from the word offsets)
+
+        Keyword arguments:
+        self -- the class object
+        """
+        def count():
+            start0, end0 = self["span0_word_start"], self["span0_word_end"]
+            start1, end1 = self["span1_word_start"], self["span1_word_end"]
+            # snorkel counts from the end of the span that starts first
+            # (span1 when both start on the same word) to the start of the other one
+            first_is_span0 = start0 < start1
+            between = np.where(first_is_span0, start1 - end0 - 1, start0 - end1 - 1)
+            return np.maximum(between, 0)
+        return self.lookup("between_token_counts", count)
@@ -1,27 +1,33 @@
 from snorkel.lf_helpers import (
     get_left_tokens,
     get_right_tokens,
-    get_between_tokens,
-    get_tagged_text,
-    get_text_between,
-    is_inverted,
-    rule_regex_search_tagged_text,
-    rule_regex_search_btw_AB,
-    rule_regex_search_btw_BA,
-    rule_regex_search_before_A,
-    rule_regex_search_before_B,
 )
 import numpy as np
-import random
 import re
 import pathlib
-import pandas as pd
-import nltk
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
 
-random.seed(100)
+from utils.label_functions.bicluster_index import BiclusterIndex
+from utils.label_functions.candidate_context import (
+    batch_lf,
+    candidate_uniform,
+    candidate_uniform_batch,
+    get_between_tokens,
+    get_document_name,
+    get_phrase_hits,
+    get_sentence_position,
+    get_sentence_text,
+    get_tagged_text,
+    get_text_between,
+    left_tokens,
+    memoize,
+    right_tokens,
+    sentence_scoped,
+)
+from utils.label_functions.gene_index import get_gene_index
+from utils.label_functions.knowledge_base import KnowledgeBaseIndex
+from utils.label_functions.pos_tag_cache import sentence_has_verb
+from utils.label_functions.regex_bank import PhraseMatcher, RegexBank
+
 
 """
 Debugging to understand how LFs work
@@ -59,100 +65,106 @@ def LF_DEBUG(c):
     return 0
 
 
-# Helper function for label functions
-def ltp(tokens):
-    return '(' + '|'.join(tokens) + ')'
-
-
 """
 DISTANT SUPERVISION
 """
-path = pathlib.Path(__file__).joinpath('../../../../compound_gene/compound_binds_gene/compound_gene_pairs_binds.csv').resolve()
-pair_df = pd.read_csv(path, dtype={"sources": str})
-knowledge_base = set()
-for row in pair_df.itertuples():
-    if not row.sources or pd.isnull(row.sources):
-        continue
-    for source in row.sources.split('|'):
-        source = re.sub(r' \(\w+\)', '', source)
-        key = str(row.entrez_gene_id), row.drugbank_id, source
-        knowledge_base.add(key)
+# Opened on the first lookup (see knowledge_base.py and generate_datafiles/knowledge_base_index.py)
+knowledge_base = KnowledgeBaseIndex("compound_gene")
 
+def hetnet_sources(c):
+    """
+    This function returns the bitmask of knowledge base sources that contain
+    the candidate's compound gene pair. The lookup is done once per candidate
+    and shared by every LF_HETNET_* label function.
+    """
+    return memoize(c, "hetnet_sources", knowledge_base.lookup, c.Gene_cid, c.Compound_cid)
+
+def hetnet_sources_batch(batch):
+    """
+    This function returns the knowledge base bitmask of every candidate
+    in a CandidateBatch (the batch version of hetnet_sources).
+    """
+    return batch.lookup("hetnet_sources", knowledge_base.lookup_batch, batch["Gene_cid"], batch["Compound_cid"])
+
+def hetnet_batch(sources, found_label, missing_label):
+    """
+    This function builds the batch version of a LF_HETNET_* label function,
+    which labels a pair found_label if any of the sources contain it and missing_label otherwise.
+    """
+    def label_batch(batch):
+        found = hetnet_sources_batch(batch) & knowledge_base.source_mask(*sources)
+        return np.where(found, found_label, missing_label)
+    return label_batch
+
+@batch_lf(hetnet_batch(["DrugBank"], 1, 0))
 def LF_HETNET_DRUGBANK(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the Drugbank database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "DrugBank") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("DrugBank") else 0
 
+@batch_lf(hetnet_batch(["DrugCentral"], 1, 0))
 def LF_HETNET_DRUGCENTRAL(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the Drugcentral database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "DrugCentral") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("DrugCentral") else 0
 
+@batch_lf(hetnet_batch(["ChEMBL"], 1, 0))
 def LF_HETNET_ChEMBL(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the ChEMBL database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "ChEMBL") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("ChEMBL") else 0
 
+@batch_lf(hetnet_batch(["BindingDB"], 1, 0))
 def LF_HETNET_BINDINGDB(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the BindingDB database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "BindingDB") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("BindingDB") else 0
 
+@batch_lf(hetnet_batch(["PDSP Ki"], 1, 0))
 def LF_HETNET_PDSP_KI(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the PDSP_KI database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "PDSP Ki") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("PDSP Ki") else 0
 
+@batch_lf(hetnet_batch(["US Patent"], 1, 0))
 def LF_HETNET_US_PATENT(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the US PATENT database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "US Patent") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("US Patent") else 0
 
+@batch_lf(hetnet_batch(["PubChem"], 1, 0))
 def LF_HETNET_PUBCHEM(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the PUBCHEM database
     """
-    return 1 if (c.Gene_cid, c.Compound_cid, "PubChem") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("PubChem") else 0
 
+@batch_lf(hetnet_batch(
+    ["DrugBank", "DrugCentral", "ChEMBL", "BindingDB", "PDSP Ki", "US Patent", "PubChem"], 0, -1
+))
 def LF_HETNET_CG_ABSENT(c):
     """
     This label function fires -1 if the given Disease Gene pair does not appear 
     in the databases above.
     """
-    return 0 if any([
-        LF_HETNET_DRUGBANK(c),
-        LF_HETNET_DRUGCENTRAL(c),
-        LF_HETNET_ChEMBL(c),
-        LF_HETNET_BINDINGDB(c),
-        LF_HETNET_PDSP_KI(c),
-        LF_HETNET_US_PATENT(c),
-        LF_HETNET_PUBCHEM(c)
-    ]) else -1
-
-
-# obtained from ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/ (ncbi's ftp server)
-# https://github.com/dhimmel/entrez-gene/blob/a7362748a34211e5df6f2d185bb3246279760546/download/Homo_sapiens.gene_info.gz <-- use pandas and trim i guess
-columns = [
-    "tax_id", "GeneID", "Symbol",
-    "LocusTag", "Synonyms", "dbXrefs",
-    "chromosome", "map_location", "description",
-    "type_of_gene", "Symbol_from_nomenclature_authority", "Full_name_from_nomenclature_authority",
-    "Nomenclature_status", "Other_designations", "Modification_date"
-]
-gene_desc = pd.read_table("https://github.com/dhimmel/entrez-gene/blob/a7362748a34211e5df6f2d185bb3246279760546/download/Homo_sapiens.gene_info.gz?raw=true", sep="\t", names=columns, compression="gzip", skiprows=1)
+    return 0 if hetnet_sources(c) & knowledge_base.source_mask(
+        "DrugBank", "DrugCentral", "ChEMBL", "BindingDB",
+        "PDSP Ki", "US Patent", "PubChem"
+    ) else -1
+
 
 
 def LF_CG_CHECK_GENE_TAG(c):
@@ -164,17 +176,7 @@ def LF_CG_CHECK_GENE_TAG(c):
     sen = c[1].get_parent()
     gene_name = re.sub("\)", "", c[1].get_span().lower())
     gene_id = sen.entity_cids[c[1].get_word_start()]
-    gene_entry_df = gene_desc.query("GeneID == @gene_id")
-
-    if gene_entry_df.empty:
-        return -1
-
-    for token in gene_name.split(" "):
-        if gene_entry_df["Symbol"].values[0].lower() == token or token in gene_entry_df["Synonyms"].values[0].lower():
-            return 0
-        elif token in gene_entry_df["description"].values[0].lower():
-            return 0
-    return -1
+    return 0 if get_gene_index().matches(gene_id, gene_name) else -1
 
 """
 SENTENCE PATTERN MATCHING
@@ -220,16 +222,32 @@ compound_indentifiers = {
 }
 
 
+"""
+Register every phrase set once so the label functions below
+scan each text a single time for all of them
+"""
+phrase_matcher = PhraseMatcher()
+phrase_matcher.register("BINDING", binding_indication)
+phrase_matcher.register("WEAK_BINDING", weak_binding_indications)
+phrase_matcher.register("UPREGULATES", upregulates)
+phrase_matcher.register("DOWNREGULATES", downregulates)
+phrase_matcher.register("GENE_RECEIVERS", gene_receivers, flags=0)
+phrase_matcher.register("GENE_RECEIVERS_SPAN", gene_receivers)
+
+regex_bank = RegexBank()
+regex_bank.register("ASE_SUFFIX", r"ase\b")
+
+
 def LF_CG_BINDING(c):
     """
     This label function is designed to look for phrases
     that imply a compound binding to a gene/protein
     """
-    if re.search(ltp(binding_indication), get_text_between(c), flags=re.I):
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("BINDING"):
         return 1
-    elif re.search(ltp(binding_indication), " ".join(get_left_tokens(c[0], window=5)), flags=re.I):
+    elif get_phrase_hits(c, phrase_matcher, " ".join(left_tokens(c, 0, window=5))).search("BINDING"):
         return 1
-    elif re.search(ltp(binding_indication), " ".join(get_right_tokens(c[0], window=5)), flags=re.I):
+    elif get_phrase_hits(c, phrase_matcher, " ".join(right_tokens(c, 0, window=5))).search("BINDING"):
         return 1
     else:
         return 0
@@ -239,7 +257,7 @@ def LF_CG_WEAK_BINDING(c):
     This label function is designed to look for phrases
     that could imply a compound binding to a gene/protein
     """
-    if re.search(ltp(weak_binding_indications), get_text_between(c), flags=re.I):
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("WEAK_BINDING"):
         return 1
     else:
         return 0
@@ -249,9 +267,9 @@ def LF_CG_UPREGULATES(c):
     This label function is designed to look for phrases
     that implies a compound increaseing activity of a gene/protein
     """
-    if re.search(ltp(upregulates), get_text_between(c), flags=re.I):
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("UPREGULATES"):
         return 1
-    elif upregulates.intersection(get_left_tokens(c[1], window=2)):
+    elif upregulates.intersection(left_tokens(c, 1, window=2)):
         return 1
     else:
         return 0
@@ -261,9 +279,9 @@ def LF_CG_DOWNREGULATES(c):
     This label function is designed to look for phrases
     that could implies a compound decreasing the activity of a gene/protein
     """
-    if re.search(ltp(downregulates), get_text_between(c), flags=re.I):
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("DOWNREGULATES"):
         return 1
-    elif downregulates.intersection(get_right_tokens(c[1], window=2)):
+    elif downregulates.intersection(right_tokens(c, 1, window=2)):
         return 1
     else:
         return 0
@@ -274,9 +292,9 @@ def LF_CG_GENE_RECEIVERS(c):
     that imples a kinases or sort of protein that receives
     a stimulus to function
     """
-    if re.search(ltp(gene_receivers), " ".join(get_right_tokens(c[1], window=4))) or re.search(ltp(gene_receivers), " ".join(get_left_tokens(c[1], window=4))):
+    if get_phrase_hits(c, phrase_matcher, " ".join(right_tokens(c, 1, window=4))).search("GENE_RECEIVERS") or get_phrase_hits(c, phrase_matcher, " ".join(left_tokens(c, 1, window=4))).search("GENE_RECEIVERS"):
         return 1
-    elif re.search(ltp(gene_receivers), c[1].get_span(), flags=re.I):
+    elif get_phrase_hits(c, phrase_matcher, c[1].get_span()).search("GENE_RECEIVERS_SPAN"):
         return 1
     else:
         return 0
@@ -286,7 +304,7 @@ def LF_CG_ASE_SUFFIX(c):
     This label function is designed to look parts of the gene tags
     that implies a sort of "ase" or enzyme
     """
-    if re.search(r"ase\b", c[1].get_span(), flags=re.I):
+    if regex_bank["ASE_SUFFIX"].search(c[1].get_span()):
         return 1
     else:
         return 0
@@ -296,8 +314,8 @@ def LF_CG_IN_SERIES(c):
     This label function is designed to look for a mention being caught
     in a series of other genes or compounds
     """
-    if len(re.findall(r',', get_tagged_text(c))) >= 2:
-        if re.search(', and', get_tagged_text(c)):
+    if get_tagged_text(c).count(',') >= 2:
+        if ', and' in get_tagged_text(c):
             return -1
     return 0
 
@@ -306,9 +324,9 @@ def LF_CG_ANTIBODY(c):
     This label function is designed to look for phrase
     antibody.
     """
-    if "antibody" in c[1].get_span() or re.search("antibody", " ".join(get_right_tokens(c[1], window=3))):
+    if "antibody" in c[1].get_span() or "antibody" in " ".join(right_tokens(c, 1, window=3)):
         return 1
-    elif "antibodies" in c[1].get_span() or re.search("antibodies", " ".join(get_right_tokens(c[1], window=3))):
+    elif "antibodies" in c[1].get_span() or "antibodies" in " ".join(right_tokens(c, 1, window=3)):
         return 1
     else:
         return 0
@@ -326,6 +344,7 @@ method_indication = {
     "we examine", "we evaluated", "to establish", "were selected", "authors determmined",
     "we investigated", "to assess", "analyses were done", "useful tool for the study of", r"^The effect of",
     }
+phrase_matcher.register("METHOD_DESC", method_indication)
 
 
 def LF_CG_METHOD_DESC(c):
@@ -333,7 +352,7 @@ def LF_CG_METHOD_DESC(c):
     This label function is designed to look for phrases 
     that imply a sentence is description an experimental design
     """
-    if re.search(ltp(method_indication), get_tagged_text(c), flags=re.I):
+    if get_phrase_hits(c, phrase_matcher, get_tagged_text(c)).search("METHOD_DESC"):
         return -1
     else:
         return 0
@@ -365,6 +384,7 @@ def LF_CG_CONCLUSION(c):
     else:
         return 0
 
+@batch_lf(lambda batch: np.where(batch.between_token_counts() <= 2, -1, 0))
 def LF_CG_DISTANCE_SHORT(c):
     """
     This LF is designed to make sure that the compound mention
@@ -372,6 +392,7 @@ def LF_CG_DISTANCE_SHORT(c):
     """
     return -1 if len(list(get_between_tokens(c))) <= 2 else 0
 
+@batch_lf(lambda batch: np.where(batch.between_token_counts() > 25, -1, 0))
 def LF_CG_DISTANCE_LONG(c):
     """
     This LF is designed to make sure that the compound mention
@@ -379,25 +400,38 @@ def LF_CG_DISTANCE_LONG(c):
     """
     return -1 if len(list(get_between_tokens(c))) > 25 else 0
 
+def allowed_distance_batch(batch):
+    """
+    This function is the batch version of LF_CG_ALLOWED_DISTANCE.
+    """
+    counts = batch.between_token_counts()
+    draws = candidate_uniform_batch(batch["candidate_id"], "LF_CG_ALLOWED_DISTANCE")
+    return np.where((counts <= 2) | (counts > 25), 0, np.where(draws < 0.65, 1, 0))
+
+@batch_lf(allowed_distance_batch)
 def LF_CG_ALLOWED_DISTANCE(c):
     """
     This LF is designed to make sure that the compound mention
     and the gene mention are in an acceptable distance between 
     each other
+    The random draw comes from a hash of the candidate id (see candidate_uniform),
+    so the label doesn't depend on the order candidates are labeled in
     """
     return 0 if any([
         LF_CG_DISTANCE_LONG(c),
         LF_CG_DISTANCE_SHORT(c)
-        ]) else 1 if random.random() < 0.65 else 0
+        ]) else 1 if candidate_uniform(c.id, "LF_CG_ALLOWED_DISTANCE") < 0.65 else 0
 
+@sentence_scoped
 def LF_CG_NO_VERB(c):
     """
     This label function is designed to fire if a given
     sentence doesn't contain a verb. Helps cut out some of the titles
     hidden in Pubtator abstracts
+    The verb check is cached per sentence (see pos_tag_cache)
     """
-    if len([x for x in  nltk.pos_tag(word_tokenize(c.get_parent().text)) if "VB" in x[1]]) == 0:
-        if "correlates with" in c.get_parent().text:
+    if not sentence_has_verb(c.get_parent()):
+        if "correlates with" in get_sentence_text(c):
             return 0
         return -1
     return 0
@@ -407,7 +441,7 @@ def LF_CG_PARENTHETICAL_DESC(c):
     This label function looks for mentions that are in paranthesis.
     Some of the gene mentions are abbreviations rather than names of a gene.
     """
-    if ")" in c[1].get_span() and "(" in list(get_left_tokens(c[1], window=1)):
+    if ")" in c[1].get_span() and "(" in list(left_tokens(c, 1, window=1)):
         if LF_CG_DISTANCE_SHORT(c):
             return -1
     return 0
@@ -417,97 +451,111 @@ def LF_CG_PARENTHETICAL_DESC(c):
 Bi-Clustering LFs
 """
 path = pathlib.Path(__file__).joinpath("../../../../compound_gene/biclustering/compound_gene_bicluster_results.tsv.xz").resolve()
-bicluster_dep_df = pd.read_table(path)
+bicluster_themes = ["B", "A+", "A-", "E+", "E-", "E", "N"]
+bicluster_index = BiclusterIndex.from_file(path, bicluster_themes)
+
+def bicluster_batch(theme):
+    """
+    This function builds the batch version of a LF_CG_BICLUSTER_* label function,
+    which labels a candidate 1 if its sentence has a score above 0 for the theme.
+    """
+    def label_batch(batch):
+        labels = batch.lookup(
+            "bicluster_labels", bicluster_index.label_batch,
+            batch["document_name"], batch["sentence_position"]
+        )
+        return labels[:, bicluster_index.theme_index[theme]]
+    return label_batch
 
+@batch_lf(bicluster_batch("B"))
+@sentence_scoped
 def LF_CG_BICLUSTER_BINDS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["B"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "B") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("A+"))
+@sentence_scoped
 def LF_CG_BICLUSTER_AGONISM(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["A+"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "A+") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("A-"))
+@sentence_scoped
 def LF_CG_BICLUSTER_ANTAGONISM(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["A-"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "A-") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("E+"))
+@sentence_scoped
 def LF_CG_BICLUSTER_INC_EXPRESSION(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["E+"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "E+") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("E-"))
+@sentence_scoped
 def LF_CG_BICLUSTER_DEC_EXPRESSION(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["E-"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "E-") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("E"))
+@sentence_scoped
 def LF_CG_BICLUSTER_AFF_EXPRESSION(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["E"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "E") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("N"))
+@sentence_scoped
 def LF_CG_BICLUSTER_INHIBITS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["N"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "N") > 0.0:
+        return 1
     return 0
 
 """
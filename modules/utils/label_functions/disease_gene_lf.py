@@ -1,27 +1,35 @@
 from snorkel.lf_helpers import (
     get_left_tokens,
     get_right_tokens,
-    get_between_tokens,
-    get_tagged_text,
-    get_text_between,
-    is_inverted,
-    rule_regex_search_tagged_text,
-    rule_regex_search_btw_AB,
-    rule_regex_search_btw_BA,
-    rule_regex_search_before_A,
-    rule_regex_search_before_B,
 )
+from functools import lru_cache
 import numpy as np
-import random
 import re
 import pathlib
-import pandas as pd
-import nltk
-from nltk.stem import WordNetLemmatizer
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 
-random.seed(100)
+from utils.label_functions.bicluster_index import BiclusterIndex
+from utils.label_functions.candidate_context import (
+    batch_lf,
+    candidate_uniform,
+    candidate_uniform_batch,
+    get_between_tokens,
+    get_document_name,
+    get_phrase_hits,
+    get_sentence_position,
+    get_sentence_text,
+    get_tagged_text,
+    get_text_between,
+    memoize,
+    sentence_scoped,
+)
+from utils.label_functions.disease_index import get_disease_index
+from utils.label_functions.gene_index import get_gene_index
+from utils.label_functions.knowledge_base import KnowledgeBaseIndex
+from utils.label_functions.pos_tag_cache import sentence_has_verb
+from utils.label_functions.regex_bank import PhraseMatcher, RegexBank
+
 stop_word_list = stopwords.words('english')
 """
 Debugging to understand how LFs work
@@ -59,88 +67,88 @@ def LF_DEBUG(c):
     return 0
 
 
-# Helper function for label functions
-def ltp(tokens):
-    return '(' + '|'.join(tokens) + ')'
-
-
 """
 DISTANT SUPERVISION
 """
-path = pathlib.Path(__file__).joinpath('../../../../disease_gene/disease_associates_gene/disease_gene_pairs_association.csv.xz').resolve()
-pair_df = pd.read_csv(path, dtype={"sources": str})
-knowledge_base = set()
-for row in pair_df.itertuples():
-    if not row.sources or pd.isnull(row.sources):
-        continue
-    for source in row.sources.split('|'):
-        key = str(row.entrez_gene_id), row.doid_id, source
-        knowledge_base.add(key)
-        
-path = pathlib.Path(__file__).joinpath('../../../../disease_gene/disease_downregulates_gene.tsv.xz').resolve()
-pair_df = pd.read_table(path, dtype={"sources": str})
-for row in pair_df.itertuples():
-    if not row.sources or pd.isnull(row.sources):
-        continue
-    for source in row.sources.split('|'):
-        key = str(row.entrez_gene_id), row.doid_id, source+'_down'
-        knowledge_base.add(key)        
-
-path = pathlib.Path(__file__).joinpath('../../../../disease_gene/disease_upregulates_gene.tsv.xz').resolve()
-pair_df = pd.read_table(path, dtype={"sources": str})
-for row in pair_df.itertuples():
-    if not row.sources or pd.isnull(row.sources):
-        continue
-    for source in row.sources.split('|'):
-        key = str(row.entrez_gene_id), row.doid_id, source+'_up'
-        knowledge_base.add(key)
+# Opened on the first lookup (see knowledge_base.py and generate_datafiles/knowledge_base_index.py)
+knowledge_base = KnowledgeBaseIndex("disease_gene")
+
+def hetnet_sources(c):
+    """
+    This function returns the bitmask of knowledge base sources that contain
+    the candidate's disease gene pair. The lookup is done once per candidate
+    and shared by every LF_HETNET_* label function.
+    """
+    return memoize(c, "hetnet_sources", knowledge_base.lookup, c.Gene_cid, c.Disease_cid)
+
+def hetnet_sources_batch(batch):
+    """
+    This function returns the knowledge base bitmask of every candidate
+    in a CandidateBatch (the batch version of hetnet_sources).
+    """
+    return batch.lookup("hetnet_sources", knowledge_base.lookup_batch, batch["Gene_cid"], batch["Disease_cid"])
+
+def hetnet_batch(sources, found_label, missing_label):
+    """
+    This function builds the batch version of a LF_HETNET_* label function,
+    which labels a pair found_label if any of the sources contain it and missing_label otherwise.
+    """
+    def label_batch(batch):
+        found = hetnet_sources_batch(batch) & knowledge_base.source_mask(*sources)
+        return np.where(found, found_label, missing_label)
+    return label_batch
 
+@batch_lf(hetnet_batch(["DISEASES"], 1, 0))
 def LF_HETNET_DISEASES(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the Diseases database
     """
-    return 1 if (c.Gene_cid, c.Disease_cid, "DISEASES") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("DISEASES") else 0
 
+@batch_lf(hetnet_batch(["DOAF"], 1, 0))
 def LF_HETNET_DOAF(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the DOAF database
     """
-    return 1 if (c.Gene_cid, c.Disease_cid, "DOAF") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("DOAF") else 0
 
+@batch_lf(hetnet_batch(["DisGeNET"], 1, 0))
 def LF_HETNET_DisGeNET(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the DisGeNET database
     """
-    return 1 if (c.Gene_cid, c.Disease_cid, "DisGeNET") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("DisGeNET") else 0
 
+@batch_lf(hetnet_batch(["GWAS Catalog"], 1, 0))
 def LF_HETNET_GWAS(c):
     """
     This label function returns 1 if the given Disease Gene pair is
     located in the GWAS database
     """
-    return 1 if (c.Gene_cid, c.Disease_cid, "GWAS Catalog") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("GWAS Catalog") else 0
 
+@batch_lf(hetnet_batch(["strego_up"], 1, 0))
 def LF_HETNET_STARGEO_UP(c):
-    return 1 if (c.Gene_cid, c.Disease_cid, "strego_up") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("strego_up") else 0
 
+@batch_lf(hetnet_batch(["strego_down"], 1, 0))
 def LF_HETNET_STARGEO_DOWN(c):
-    return 1 if (c.Gene_cid, c.Disease_cid, "strego_down") in knowledge_base else 0
+    return 1 if hetnet_sources(c) & knowledge_base.source_mask("strego_down") else 0
 
+@batch_lf(hetnet_batch(["DISEASES", "DOAF", "DisGeNET", "GWAS Catalog"], 0, -1))
 def LF_HETNET_DaG_ABSENT(c):
     """
     This label function fires -1 if the given Disease Gene pair does not appear 
     in the databases above.
     """
-    return 0 if any([
-        LF_HETNET_DISEASES(c),
-        LF_HETNET_DOAF(c),
-        LF_HETNET_DisGeNET(c),
-        LF_HETNET_GWAS(c)
-    ]) else -1
+    return 0 if hetnet_sources(c) & knowledge_base.source_mask(
+        "DISEASES", "DOAF", "DisGeNET", "GWAS Catalog"
+    ) else -1
 
+@batch_lf(hetnet_batch(["strego_up"], 0, -1))
 def LF_HETNET_DuG_ABSENT(c):
     """
     This label function fires -1 if the given Disease Gene pair does not appear 
@@ -148,6 +156,7 @@ def LF_HETNET_DuG_ABSENT(c):
     """
     return 0 if LF_HETNET_STARGEO_UP(c) else -1
 
+@batch_lf(hetnet_batch(["strego_down"], 0, -1))
 def LF_HETNET_DdG_ABSENT(c):
     """
     This label function fires -1 if the given Disease Gene pair does not appear 
@@ -155,17 +164,6 @@ def LF_HETNET_DdG_ABSENT(c):
     """
     return 0 if LF_HETNET_STARGEO_DOWN(c) else -1
 
-# obtained from ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/ (ncbi's ftp server)
-# https://github.com/dhimmel/entrez-gene/blob/a7362748a34211e5df6f2d185bb3246279760546/download/Homo_sapiens.gene_info.gz <-- use pandas and trim i guess
-columns = [
-    "tax_id", "GeneID", "Symbol",
-    "LocusTag", "Synonyms", "dbXrefs",
-    "chromosome", "map_location", "description",
-    "type_of_gene", "Symbol_from_nomenclature_authority", "Full_name_from_nomenclature_authority",
-    "Nomenclature_status", "Other_designations", "Modification_date"
-]
-gene_desc = pd.read_table("https://github.com/dhimmel/entrez-gene/blob/a7362748a34211e5df6f2d185bb3246279760546/download/Homo_sapiens.gene_info.gz?raw=true", sep="\t", names=columns, compression="gzip", skiprows=1)
-
 
 def LF_DG_CHECK_GENE_TAG(c):
     """
@@ -176,65 +174,61 @@ def LF_DG_CHECK_GENE_TAG(c):
     sen = c[1].get_parent()
     gene_name = re.sub("\)", "", c[1].get_span().lower())
     gene_id = sen.entity_cids[c[1].get_word_start()]
-    gene_entry_df = gene_desc.query("GeneID == @gene_id")
+    return 0 if get_gene_index().matches(gene_id, gene_name) else -1
 
-    if gene_entry_df.empty:
-        return -1
-
-    for token in gene_name.split(" "):
-        if gene_entry_df["Symbol"].values[0].lower() == token or token in gene_entry_df["Synonyms"].values[0].lower():
-            return 0
-        elif token in gene_entry_df["description"].values[0].lower():
-            return 0
-    return -1
 
+# the label for a (disease mention, DOID) pair never changes, so the same mention
+# (which recurs thousands of times across the corpus) is only normalized once
+DISEASE_TAG_CACHE_SIZE = 2**16
+stop_words = set(stop_word_list)
 
-#disease_desc = pd.read_table("https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/xrefs-prop-slim.tsv")
-disease_normalization_df = pd.read_table("https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/slim-terms-prop.tsv")
-wordnet_lemmatizer = WordNetLemmatizer()
-
-def LF_DG_CHECK_DISEASE_TAG(c):
+def normalize_disease_name(span_text):
     """
-    This label function is used for labeling each passed candidate as either pos or neg.
-    Keyword Args:
-    c- the candidate object to be passed in.
+    This function strips closing parentheses, splits hyphenated words and drops
+    the stop words of a disease mention (e.g. "non-small cell lung cancer" -> "non small cell lung cancer").
     """
-    sen = c[0].get_parent()
-    disease_name = re.sub("\) ?", "", c[0].get_span())
+    disease_name = re.sub("\) ?", "", span_text)
     disease_name = re.sub(r"(\w)-(\w)", r"\g<1> \g<2>", disease_name)
-    disease_name = " ".join([word for word in word_tokenize(disease_name) if word not in set(stop_word_list)])
+    return " ".join([word for word in word_tokenize(disease_name) if word not in stop_words])
+
+@lru_cache(maxsize=DISEASE_TAG_CACHE_SIZE)
+def check_disease_tag(span_text, disease_id):
+    """
+    This function returns 0 if a disease mention normalizes to the slim DOID it was tagged
+    with (or is an abbreviation) and -1 otherwise. Results are cached per (span text, DOID).
+    """
+    disease_name = normalize_disease_name(span_text)
 
     # If abbreviation skip since no means of easy resolution
     if len(disease_name) <=5 and disease_name.isupper():
         return 0
 
-    disease_id = sen.entity_cids[c[0].get_word_start()]
-    result = disease_normalization_df[
-        disease_normalization_df["subsumed_name"].str.contains(disease_name.lower(), regex=False)
-    ]
+    slim_id = get_disease_index().first_slim_id(disease_name.lower())
     # If no match then return -1
-    if result.empty:
+    if slim_id is None:
 
         # check the reverse direction e.g. carcinoma lung -> lung carcinoma
         disease_name_tokens = word_tokenize(disease_name)
         if len(disease_name_tokens) == 2:
-            result = disease_normalization_df[
-                disease_normalization_df["subsumed_name"].str.contains(" ".join(disease_name_tokens[-1::0-1]).lower(), regex=False)
-            ]
-            
+            slim_id = get_disease_index().first_slim_id(" ".join(disease_name_tokens[-1::0-1]).lower())
+
             # if reversing doesn't work then output -t
-            if not result.empty:
-                slim_id = result['slim_id'].values[0]
-                if slim_id == disease_id:
-                    return 0
+            if slim_id is not None and slim_id == disease_id:
+                return 0
         return -1
     else:
         # If it can be normalized return 0 else -1
-        slim_id = result['slim_id'].values[0]
-        if slim_id == disease_id:
-            return 0
-        else:
-            return -1
+        return 0 if slim_id == disease_id else -1
+
+def LF_DG_CHECK_DISEASE_TAG(c):
+    """
+    This label function is used for labeling each passed candidate as either pos or neg.
+    Keyword Args:
+    c- the candidate object to be passed in.
+    """
+    sen = c[0].get_parent()
+    disease_id = sen.entity_cids[c[0].get_word_start()]
+    return check_disease_tag(c[0].get_span(), disease_id)
 
 """
 SENTENCE PATTERN MATCHING
@@ -326,15 +320,41 @@ title_indication = {
     "Inborn", "Episodic", "Detection of", "Immunostaining of"
 }
 
+"""
+Register every phrase set once so the label functions below
+scan each text a single time for all of them
+"""
+phrase_matcher = PhraseMatcher()
+phrase_matcher.register("BIOMARKER", biomarker_indicators)
+phrase_matcher.register("ASSOCIATION", direct_association)
+phrase_matcher.register("WEAK_ASSOCIATION", weak_association)
+phrase_matcher.register("NO_ASSOCIATION", no_direct_association)
+phrase_matcher.register("METHOD_DESC", method_indication)
+phrase_matcher.register("TITLE", title_indication)
+phrase_matcher.register("POSITIVE_DIRECTION", positive_direction)
+phrase_matcher.register("POSITIVE_DIRECTION_CASED", positive_direction, flags=0)
+phrase_matcher.register("NEGATIVE_DIRECTION", negative_direction)
+phrase_matcher.register("NEGATIVE_DIRECTION_CASED", negative_direction, flags=0)
+phrase_matcher.register("DIAGNOSIS", diagnosis_indicators)
+phrase_matcher.register("DIAGNOSIS_CASED", diagnosis_indicators, flags=0)
+
+ENTITY_TAGS = ("{{A}}", "{{B}}")
+NEGATIONS = ("not ", "no ")
+
+regex_bank = RegexBank()
+regex_bank.register("RISK", r"risk (of|for)")
+regex_bank.register("PATIENT_WITH", r"patient(s)? with {{A}}")
+
 def LF_DG_IS_BIOMARKER(c):
     """
     This label function examines a sentences to determine of a sentence
     is talking about a biomarker. (A biomarker leads towards D-G assocation
     c - The candidate obejct being passed in
     """
-    if re.search(ltp(biomarker_indicators) + r".*{{B}}", get_tagged_text(c), flags=re.I):
+    tagged_hits = get_phrase_hits(c, phrase_matcher, get_tagged_text(c))
+    if tagged_hits.search_before("BIOMARKER", ["{{B}}"]):
         return 1
-    elif re.search(r"{{B}}.*" + ltp(biomarker_indicators), get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_after("BIOMARKER", ["{{B}}"]):
         return 1
     else:
         return 0
@@ -344,11 +364,12 @@ def LF_DG_ASSOCIATION(c):
     This LF is designed to test if there is a key phrase that suggests
     a d-g pair is an association.
     """
-    if re.search(r'(?<!not )(?<!no )' + ltp(direct_association), get_text_between(c), flags=re.I):
+    tagged_hits = get_phrase_hits(c, phrase_matcher, get_tagged_text(c))
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("ASSOCIATION", not_preceded_by=NEGATIONS):
         return 1
-    elif re.search(r'(?<!not )(?<!no )' + ltp(direct_association) + r".*({{B}}|{{A}})", get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_before("ASSOCIATION", ENTITY_TAGS, not_preceded_by=NEGATIONS):
         return 1
-    elif re.search(r"({{B}}|{{A}}).*(?<!not )(?<!no )" + ltp(direct_association), get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_after("ASSOCIATION", ENTITY_TAGS, not_preceded_by=NEGATIONS):
         return 1
     else:
         return 0
@@ -358,11 +379,12 @@ def LF_DG_WEAK_ASSOCIATION(c):
     This label function is design to search for phrases that indicate a 
     weak association between the disease and gene
     """
-    if re.search(ltp(weak_association), get_text_between(c), flags=re.I):
+    tagged_hits = get_phrase_hits(c, phrase_matcher, get_tagged_text(c))
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("WEAK_ASSOCIATION"):
         return -1
-    elif re.search(ltp(weak_association) + r".*({{B}}|{{A}})", get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_before("WEAK_ASSOCIATION", ENTITY_TAGS):
         return -1
-    elif re.search(r"({{B}}|{{A}}).*" + ltp(weak_association), get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_after("WEAK_ASSOCIATION", ENTITY_TAGS):
         return -1
     else:
         return 0
@@ -372,11 +394,12 @@ def LF_DG_NO_ASSOCIATION(c):
     This LF is designed to test if there is a key phrase that suggests
     a d-g pair is no an association.
     """
-    if re.search(ltp(no_direct_association), get_text_between(c), flags=re.I):
+    tagged_hits = get_phrase_hits(c, phrase_matcher, get_tagged_text(c))
+    if get_phrase_hits(c, phrase_matcher, get_text_between(c)).search("NO_ASSOCIATION"):
         return -1
-    elif re.search(ltp(no_direct_association) + r".*({{B}}|{{A}})", get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_before("NO_ASSOCIATION", ENTITY_TAGS):
         return -1
-    elif re.search(r"({{B}}|{{A}}).*" + ltp(no_direct_association), get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search_after("NO_ASSOCIATION", ENTITY_TAGS):
         return -1
     else:
         return 0
@@ -386,7 +409,7 @@ def LF_DG_METHOD_DESC(c):
     This label function is designed to look for phrases 
     that imply a sentence is description an experimental design
     """
-    if re.search(ltp(method_indication), get_tagged_text(c), flags=re.I):
+    if get_phrase_hits(c, phrase_matcher, get_tagged_text(c)).search("METHOD_DESC"):
         return -1
     else:
         return 0
@@ -396,49 +419,56 @@ def LF_DG_TITLE(c):
     This label function is designed to look for phrases that inditcates
     a paper title
     """
-    if re.search(r'^'+ltp(title_indication), get_tagged_text(c), flags=re.I):
+    tagged_hits = get_phrase_hits(c, phrase_matcher, get_tagged_text(c))
+    if tagged_hits.search("TITLE", anchor_start=True):
         return -1
-    elif re.search(ltp(title_indication)+r'$', get_tagged_text(c), flags=re.I):
+    elif tagged_hits.search("TITLE", anchor_end=True):
         return -1
     else:
         return 0
 
+def direction_search(c, name):
+    # "{{A}}.*(phrases).*{{B}}", "{{B}}.*(phrases).*{{A}}" or (case sensitive) "tag.*tag.*(phrases)"
+    tagged_hits = get_phrase_hits(c, phrase_matcher, get_tagged_text(c))
+    return (
+        tagged_hits.search_between(name, ["{{A}}"], ["{{B}}"]) or
+        tagged_hits.search_between(name, ["{{B}}"], ["{{A}}"]) or
+        tagged_hits.search_after(name + "_CASED", ENTITY_TAGS, count=2)
+    )
+
 def LF_DG_POSITIVE_DIRECTION(c):
     """
     This label function is designed to search for words that indicate
     a sort of positive response or imply an upregulates association
     """
-    return 1 if any([rule_regex_search_btw_AB(c, r'.*'+ltp(positive_direction)+r'.*', 1), rule_regex_search_btw_BA(c, r'.*'+ltp(positive_direction)+r'.*', 1)]) or \
-        re.search(r'({{A}}|{{B}}).*({{A}}|{{B}}).*' + ltp(positive_direction), get_tagged_text(c)) else 0
+    return 1 if direction_search(c, "POSITIVE_DIRECTION") else 0
 
 def LF_DG_NEGATIVE_DIRECTION(c):
     """
     This label function is designed to search for words that indicate
     a sort of negative response or imply an downregulates association
     """
-    return 1 if any([rule_regex_search_btw_AB(c, r'.*'+ltp(negative_direction)+r'.*', 1), rule_regex_search_btw_BA(c, r'.*'+ltp(negative_direction)+r'.*', 1)]) or  \
-        re.search(r'({{A}}|{{B}}).*({{A}}|{{B}}).*' + ltp(negative_direction), get_tagged_text(c)) else 0
+    return 1 if direction_search(c, "NEGATIVE_DIRECTION") else 0
 
 def LF_DG_DIAGNOSIS(c):
     """
     This label function is designed to search for words that imply a patient diagnosis
     which will provide evidence for possible disease gene association.
     """
-    return 1 if any([rule_regex_search_btw_AB(c, r'.*'+ltp(diagnosis_indicators) + r".*", 1), rule_regex_search_btw_BA(c, r'.*'+ltp(diagnosis_indicators) + r".*", 1)]) or  \
-        re.search(r'({{A}}|{{B}}).*({{A}}|{{B}}).*' + ltp(diagnosis_indicators), get_tagged_text(c)) else 0
+    return 1 if direction_search(c, "DIAGNOSIS") else 0
 
 def LF_DG_RISK(c):
     """
     This label function searched for sentences that mention a patient being at risk for disease or 
     a signal implying increased/decreased risk of disease.
     """
-    return 1 if re.search(r"risk (of|for)", get_tagged_text(c), flags=re.I) else 0
+    return 1 if regex_bank["RISK"].search(get_tagged_text(c)) else 0
 
 def LF_DG_PATIENT_WITH(c):
     """
     This label function looks for the phrase "patients with" disease.
     """
-    return 1 if re.search(r"patient(s)? with {{A}}", get_tagged_text(c), flags=re.I) else 0
+    return 1 if regex_bank["PATIENT_WITH"].search(get_tagged_text(c)) else 0
 
 def LF_DG_PURPOSE(c):
     """"
@@ -537,6 +567,7 @@ def LF_DdG_CONCLUSION(c):
     else:
         return 0
 
+@batch_lf(lambda batch: np.where(batch.between_token_counts() <= 2, -1, 0))
 def LF_DG_DISTANCE_SHORT(c):
     """
     This LF is designed to make sure that the disease mention
@@ -544,6 +575,7 @@ def LF_DG_DISTANCE_SHORT(c):
     """
     return -1 if len(list(get_between_tokens(c))) <= 2 else 0
 
+@batch_lf(lambda batch: np.where(batch.between_token_counts() > 25, -1, 0))
 def LF_DG_DISTANCE_LONG(c):
     """
     This LF is designed to make sure that the disease mention
@@ -551,25 +583,38 @@ def LF_DG_DISTANCE_LONG(c):
     """
     return -1 if len(list(get_between_tokens(c))) > 25 else 0
 
+def allowed_distance_batch(batch):
+    """
+    This function is the batch version of LF_DG_ALLOWED_DISTANCE.
+    """
+    counts = batch.between_token_counts()
+    draws = candidate_uniform_batch(batch["candidate_id"], "LF_DG_ALLOWED_DISTANCE")
+    return np.where((counts <= 2) | (counts > 25), 0, np.where(draws < 0.65, 1, 0))
+
+@batch_lf(allowed_distance_batch)
 def LF_DG_ALLOWED_DISTANCE(c):
     """
     This LF is designed to make sure that the disease mention
     and the gene mention are in an acceptable distance between 
     each other
+    The random draw comes from a hash of the candidate id (see candidate_uniform),
+    so the label doesn't depend on the order candidates are labeled in
     """
     return 0 if any([
         LF_DG_DISTANCE_LONG(c),
         LF_DG_DISTANCE_SHORT(c)
-        ]) else 1 if random.random() < 0.65 else 0
+        ]) else 1 if candidate_uniform(c.id, "LF_DG_ALLOWED_DISTANCE") < 0.65 else 0
 
+@sentence_scoped
 def LF_DG_NO_VERB(c):
     """
     This label function is designed to fire if a given
     sentence doesn't contain a verb. Helps cut out some of the titles
     hidden in Pubtator abstracts
+    The verb check is cached per sentence (see pos_tag_cache)
     """
-    if len([x for x in  nltk.pos_tag(word_tokenize(c.get_parent().text)) if "VB" in x[1]]) == 0:
-        if "correlates with" in c.get_parent().text:
+    if not sentence_has_verb(c.get_parent()):
+        if "correlates with" in get_sentence_text(c):
             return 0
         return -1
     return 0
@@ -578,136 +623,150 @@ def LF_DG_NO_VERB(c):
 Bi-Clustering LFs
 """
 path = pathlib.Path(__file__).joinpath("../../../../disease_gene/biclustering/disease_gene_bicluster_results.tsv.xz").resolve()
-bicluster_dep_df = pd.read_table(path)
+bicluster_themes = ["U", "Ud", "D", "J", "Te", "Y", "G", "Md", "X", "L"]
+bicluster_index = BiclusterIndex.from_file(path, bicluster_themes)
+
+def bicluster_batch(theme):
+    """
+    This function builds the batch version of a LF_DG_BICLUSTER_* label function,
+    which labels a candidate 1 if its sentence has a score above 0 for the theme.
+    """
+    def label_batch(batch):
+        labels = batch.lookup(
+            "bicluster_labels", bicluster_index.label_batch,
+            batch["document_name"], batch["sentence_position"]
+        )
+        return labels[:, bicluster_index.theme_index[theme]]
+    return label_batch
 
+@batch_lf(bicluster_batch("U"))
+@sentence_scoped
 def LF_DG_BICLUSTER_CASUAL_MUTATIONS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["U"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "U") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("Ud"))
+@sentence_scoped
 def LF_DG_BICLUSTER_MUTATIONS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["Ud"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "Ud") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("D"))
+@sentence_scoped
 def LF_DG_BICLUSTER_DRUG_TARGETS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["D"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "D") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("J"))
+@sentence_scoped
 def LF_DG_BICLUSTER_PATHOGENESIS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["J"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "J") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("Te"))
+@sentence_scoped
 def LF_DG_BICLUSTER_THERAPEUTIC(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["Te"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "Te") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("Y"))
+@sentence_scoped
 def LF_DG_BICLUSTER_POLYMORPHISMS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["Y"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "Y") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("G"))
+@sentence_scoped
 def LF_DG_BICLUSTER_PROGRESSION(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["G"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "G") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("Md"))
+@sentence_scoped
 def LF_DG_BICLUSTER_BIOMARKERS(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["Md"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "Md") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("X"))
+@sentence_scoped
 def LF_DG_BICLUSTER_OVEREXPRESSION(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["X"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "X") > 0.0:
+        return 1
     return 0
 
+@batch_lf(bicluster_batch("L"))
+@sentence_scoped
 def LF_DG_BICLUSTER_REGULATION(c):
     """
     This label function uses the bicluster data located in the 
     A global network of biomedical relationships
     """
-    sen_pos = c.get_parent().position
-    pubmed_id = c.get_parent().document.name
-    query = bicluster_dep_df.query("pubmed_id==@pubmed_id&sentence_num==@sen_pos")
-    if not(query.empty):
-        if query["L"].sum() > 0.0:
-            return 1
+    sen_pos = get_sentence_position(c)
+    pubmed_id = get_document_name(c)
+    if bicluster_index.score(pubmed_id, sen_pos, "L") > 0.0:
+        return 1
     return 0
 
 """
@@ -0,0 +1,81 @@
+import bisect
+
+import pandas as pd
+
+from utils.data_cache import cached_path
+
+# disease ontology slim terms with every subsumed term name (dhimmel/disease-ontology)
+slim_terms_url = "https://raw.githubusercontent.com/dhimmel/disease-ontology/052ffcc960f5897a0575f5feff904ca84b7d2c1d/data/slim-terms-prop.tsv"
+
+
+class DiseaseIndex(object):
+    """Disease Ontology Name Index
+    This class answers "which slim DOID does the first term containing this name map to",
+    the question LF_DG_CHECK_DISEASE_TAG used to answer with
+    disease_normalization_df["subsumed_name"].str.contains(name, regex=False).
+    Every subsumed name is joined into one newline separated string, so a lookup is a single
+    str.find plus a binary search for the row, instead of a python loop over every row.
+    Names never contain a newline, so a match can't run across two rows.
+    """
+
+    def __init__(self, normalization_df):
+        """ Initialize the index
+
+        Keyword arguments:
+        self -- the class object
+        normalization_df -- the slim-terms-prop dataframe (subsumed_name and slim_id columns)
+        """
+        names = normalization_df["subsumed_name"].astype(str).tolist()
+        self.slim_ids = normalization_df["slim_id"].tolist()
+        self.names = "\n".join(names)
+
+        # offset of the first character of every name in self.names
+        self.row_starts = []
+        offset = 0
+        for name in names:
+            self.row_starts.append(offset)
+            offset += len(name) + 1
+
+    @classmethod
+    def from_url(cls, url=slim_terms_url):
+        """Read the slim terms file and build the index
+
+        Keyword arguments:
+        cls -- the class object
+        url -- the pinned location of slim-terms-prop.tsv (read through the local data cache)
+        """
+        return cls(pd.read_table(cached_path(url)))
+
+    def first_slim_id(self, name):
+        """Return the slim id of the first term whose name contains name (case sensitive)
+        or None if no term does
+
+        Keyword arguments:
+        self -- the class object
+        name -- the (lowercased) disease name
+        """
+        if not self.row_starts or "\n" in name:
+            return None
+
+        position = self.names.find(name)
+        if position == -1:
+            return None
+        return self.slim_ids[bisect.bisect_right(self.row_starts, position) - 1]
+
+
+# The index is built lazily, so label function fingerprints hash the pinned
+# slim_terms_url and the code that builds the index instead of the loaded object
+__fingerprint_exempt__ = {"_disease_index"}
+
+_disease_index = None
+
+
+def get_disease_index():
+    """
+    This function returns the disease index used by the disease tag
+    label function, building it the first time it is called.
+    """
+    global _disease_index
+    if _disease_index is None:
+        _disease_index = DiseaseIndex.from_url()
+    return _disease_index
@@ -0,0 +1,112 @@
+import re
+
+import pandas as pd
+
+from utils.data_cache import cached_path
+
+# obtained from ftp://ftp.ncbi.nlm.nih.gov/gene/DATA/ (ncbi's ftp server)
+gene_info_url = "https://github.com/dhimmel/entrez-gene/blob/a7362748a34211e5df6f2d185bb3246279760546/download/Homo_sapiens.gene_info.gz?raw=true"
+gene_info_columns = [
+    "tax_id", "GeneID", "Symbol",
+    "LocusTag", "Synonyms", "dbXrefs",
+    "chromosome", "map_location", "description",
+    "type_of_gene", "Symbol_from_nomenclature_authority", "Full_name_from_nomenclature_authority",
+    "Nomenclature_status", "Other_designations", "Modification_date"
+]
+
+
+def tokenize_description(description):
+    """
+    This function is designed to split a gene description into
+    lowercased word tokens (e.g. "tumor protein p53" -> {"tumor", "protein", "p53"})
+
+    description - the description string from the gene info file
+    """
+    return frozenset(token for token in re.split(r"[\s,;()\[\]]+", description.lower()) if token)
+
+
+class GeneIndex(object):
+    """Gene Symbol/Synonym Index
+    This class maps each entrez GeneID to a compact record of
+    (lowercased symbol, set of lowercased synonyms, set of description tokens).
+    The gene tag label functions use it to check a gene mention with one
+    dictionary lookup and a few set membership tests.
+    """
+
+    def __init__(self, gene_desc_df):
+        """ Initialize the index
+
+        Keyword arguments:
+        self -- the class object
+        gene_desc_df -- the ncbi Homo_sapiens.gene_info dataframe
+        """
+        self.records = {}
+        for row in gene_desc_df[["GeneID", "Symbol", "Synonyms", "description"]].itertuples(index=False):
+            synonyms = frozenset(
+                synonym for synonym in str(row.Synonyms).lower().split("|")
+                if synonym and synonym != "-"
+            )
+            self.records[int(row.GeneID)] = (
+                str(row.Symbol).lower(),
+                synonyms,
+                tokenize_description(str(row.description))
+            )
+
+    @classmethod
+    def from_url(cls, url=gene_info_url):
+        """Read the ncbi gene info file and build the index
+
+        Keyword arguments:
+        cls -- the class object
+        url -- the pinned location of Homo_sapiens.gene_info.gz (read through the local data cache)
+        """
+        gene_desc_df = pd.read_table(cached_path(url), sep="\t", names=gene_info_columns, compression="gzip", skiprows=1)
+        return cls(gene_desc_df)
+
+    def get(self, gene_id):
+        """Return the record for a gene or None if the id isn't indexed
+
+        Keyword arguments:
+        self -- the class object
+        gene_id -- the entrez gene id (int or string)
+        """
+        try:
+            return self.records.get(int(gene_id))
+        except (TypeError, ValueError):
+            return None
+
+    def matches(self, gene_id, gene_name):
+        """Check if a tagged gene mention agrees with the gene it was normalized to
+
+        Keyword arguments:
+        self -- the class object
+        gene_id -- the entrez gene id the mention was tagged with
+        gene_name -- the lowercased gene mention
+
+        Returns:
+        True if any token of the mention is the gene's symbol, one of its synonyms
+        or a word in its description. False if not or if the gene isn't indexed.
+        """
+        record = self.get(gene_id)
+        if record is None:
+            return False
+
+        symbol, synonyms, description_tokens = record
+        for token in gene_name.split(" "):
+            if token == symbol or token in synonyms or token in description_tokens:
+                return True
+        return False
+
+
+_gene_index = None
+
+
+def get_gene_index():
+    """
+    This function returns the gene index shared by every label function
+    module, building it the first time it is called.
+    """
+    global _gene_index
+    if _gene_index is None:
+        _gene_index = GeneIndex.from_url()
+    return _gene_index
@@ -0,0 +1,338 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+import pandas as pd
+
+repo_dir = pathlib.Path(__file__).joinpath('../../../..').resolve()
+
+# Bump when the layout of the saved index changes so old indices get rebuilt
+KB_INDEX_VERSION = 2
+
+# Builds kept next to an index: the current one and the one it replaced
+# (a process may have resolved the index link just before the swap)
+KB_KEEP_BUILDS = 2
+
+
+def strip_source_annotation(source):
+    # e.g. "ChEMBL (Ki)" -> "ChEMBL"
+    return re.sub(r' \(\w+\)', '', source)
+
+
+"""
+Files that make up each knowledge base.
+Each entry is (path, separator, other entity column, source suffix, source transform)
+"""
+KB_SPECS = {
+    "disease_gene": {
+        "index_dir": repo_dir / "disease_gene/disease_gene_kb_index",
+        "files": [
+            (repo_dir / "disease_gene/disease_associates_gene/disease_gene_pairs_association.csv.xz", ",", "doid_id", "", None),
+            (repo_dir / "disease_gene/disease_downregulates_gene.tsv.xz", "\t", "doid_id", "_down", None),
+            (repo_dir / "disease_gene/disease_upregulates_gene.tsv.xz", "\t", "doid_id", "_up", None),
+        ]
+    },
+    "compound_gene": {
+        "index_dir": repo_dir / "compound_gene/compound_gene_kb_index",
+        "files": [
+            (repo_dir / "compound_gene/compound_binds_gene/compound_gene_pairs_binds.csv", ",", "drugbank_id", "", strip_source_annotation),
+        ]
+    }
+}
+
+
+def read_kb_records(files):
+    """
+    This function is designed to read the pair files of a knowledge base
+    and output one row per (gene, other entity, source) triple.
+
+    files - a list of (path, separator, other entity column, source suffix, source transform) tuples
+
+    returns a dataframe with the columns gene, other and source
+    """
+    records = []
+    for path, sep, other_column, suffix, transform in files:
+        pair_df = pd.read_csv(
+            path, sep=sep, dtype={"sources": str, "entrez_gene_id": str},
+            usecols=["entrez_gene_id", other_column, "sources"]
+        )
+        pair_df = pair_df[pair_df.sources.notnull() & (pair_df.sources != "")]
+
+        for gene, other, sources in zip(pair_df.entrez_gene_id, pair_df[other_column], pair_df.sources):
+            for source in sources.split('|'):
+                source = source if transform is None else transform(source)
+                records.append((str(gene), str(other), source + suffix))
+
+    return pd.DataFrame(records, columns=["gene", "other", "source"]).drop_duplicates()
+
+
+def file_fingerprints(files):
+    return {
+        str(path): [os.path.getsize(path), os.path.getmtime(path)]
+        for path, *_ in files
+    }
+
+
+def build_kb_index(kb_df, index_dir, fingerprints=None):
+    """
+    This function is designed to write an integer encoded knowledge base index.
+    Genes and other entities are mapped to their position in a sorted vocabulary
+    and every (gene, other entity) pair becomes one int64 key. Each key is stored
+    with a bitmask of the sources that contain the pair (bit i = sources[i]).
+    The arrays are saved as .npy files so every worker process can memory map the same pages.
+
+    kb_df - the dataframe output by read_kb_records
+    index_dir - the directory to write the index into
+    fingerprints - the size/mtime of the files the index was built from
+    """
+    genes = np.array(sorted(kb_df.gene.unique()), dtype=str)
+    others = np.array(sorted(kb_df.other.unique()), dtype=str)
+    sources = np.array(sorted(kb_df.source.unique()), dtype=str)
+
+    if len(sources) > 32:
+        raise ValueError("Source bitmasks only hold 32 sources, but {} were given".format(len(sources)))
+
+    gene_codes = np.searchsorted(genes, kb_df.gene.values.astype(str)).astype(np.int64)
+    other_codes = np.searchsorted(others, kb_df.other.values.astype(str)).astype(np.int64)
+    source_bits = np.left_shift(1, np.searchsorted(sources, kb_df.source.values.astype(str))).astype(np.uint32)
+
+    # Combine the bits of every source that contains the same pair
+    pair_keys, pair_index = np.unique(gene_codes * len(others) + other_codes, return_inverse=True)
+    masks = np.zeros(len(pair_keys), dtype=np.uint32)
+    np.bitwise_or.at(masks, pair_index, source_bits)
+
+    index_dir = pathlib.Path(index_dir)
+    with index_lock(index_dir):
+        return _write_kb_index(index_dir, genes, others, sources, pair_keys, masks, fingerprints)
+
+
+def _write_kb_index(index_dir, genes, others, sources, pair_keys, masks, fingerprints):
+    # Write into a fresh build directory, so half written
+    # indices are never seen by other processes
+    builds_dir = index_dir.parent / (index_dir.name + "_builds")
+    builds_dir.mkdir(parents=True, exist_ok=True)
+    build_dir = pathlib.Path(tempfile.mkdtemp(dir=str(builds_dir)))
+    np.save(str(build_dir / "genes.npy"), genes)
+    np.save(str(build_dir / "others.npy"), others)
+    np.save(str(build_dir / "sources.npy"), sources)
+    np.save(str(build_dir / "pair_keys.npy"), pair_keys)
+    np.save(str(build_dir / "masks.npy"), masks)
+    with open(str(build_dir / "meta.json"), "w") as f:
+        json.dump({
+            "version": KB_INDEX_VERSION,
+            "fingerprints": fingerprints or {},
+            "num_pairs": int(len(pair_keys))
+        }, f)
+
+    # index_dir is a symlink to the current build. Swapping it with os.replace is atomic,
+    # and removing an older build doesn't break processes that memory mapped its files
+    # (the pages stay valid until they are unmapped).
+    if index_dir.exists() and not index_dir.is_symlink():
+        # move an index written before builds were kept aside
+        os.rename(str(index_dir), str(builds_dir / ("old_" + uuid.uuid4().hex)))
+    link_path = builds_dir / ("link_" + uuid.uuid4().hex)
+    os.symlink(os.path.relpath(str(build_dir), str(index_dir.parent)), str(link_path))
+    os.replace(str(link_path), str(index_dir))
+
+    old_builds = sorted(
+        (path for path in builds_dir.iterdir() if path.is_dir() and path != build_dir),
+        key=lambda path: path.stat().st_mtime, reverse=True
+    )
+    for path in old_builds[KB_KEEP_BUILDS - 1:]:
+        shutil.rmtree(str(path), ignore_errors=True)
+    return index_dir
+
+
+# lock files this process holds (index_lock can be nested)
+_held_locks = set()
+
+
+@contextlib.contextmanager
+def index_lock(index_dir):
+    """
+    This function is designed to hold an exclusive file lock on an index,
+    so only one process rebuilds it while the others wait for the result.
+
+    index_dir - the directory of the index to lock
+    """
+    index_dir = pathlib.Path(index_dir)
+    lock_path = str(index_dir.parent / (index_dir.name + ".lock"))
+    if lock_path in _held_locks:
+        yield
+        return
+
+    index_dir.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _held_locks.add(lock_path)
+        try:
+            yield
+        finally:
+            _held_locks.discard(lock_path)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_knowledge_base(name):
+    """
+    This function builds the index for one of the knowledge bases in KB_SPECS.
+
+    name - the knowledge base name (e.g. disease_gene)
+    """
+    spec = KB_SPECS[name]
+    kb_df = read_kb_records(spec["files"])
+    return build_kb_index(kb_df, spec["index_dir"], fingerprints=file_fingerprints(spec["files"]))
+
+
+class KnowledgeBaseIndex(object):
+    """Lazy Knowledge Base Index
+    This class replaces the python set of (gene, other entity, source) string tuples.
+    Nothing is read until the first lookup. Then the vocabularies are loaded into
+    small dictionaries and the key/bitmask arrays are memory mapped, so worker processes
+    share the same pages instead of each building their own set.
+    One lookup returns a bitmask of every source that contains a pair, so all of the
+    LF_HETNET_* label functions for a candidate come from a single search.
+    The old set syntax still works: (c.Gene_cid, c.Disease_cid, "DISEASES") in knowledge_base
+    """
+
+    def __init__(self, name):
+        """ Initialize the index
+
+        Keyword arguments:
+        self -- the class object
+        name -- the knowledge base name in KB_SPECS
+        """
+        self.name = name
+        self.index_dir = pathlib.Path(KB_SPECS[name]["index_dir"])
+        self.pair_keys = None
+
+    def _is_stale(self):
+        meta_file = self.index_dir / "meta.json"
+        if not meta_file.exists():
+            return True
+
+        with open(str(meta_file), "r") as f:
+            meta = json.load(f)
+
+        if meta.get("version") != KB_INDEX_VERSION:
+            return True
+
+        files = KB_SPECS[self.name]["files"]
+        if not all(os.path.exists(path) for path, *_ in files):
+            # can't check the source files (e.g. not downloaded) so trust the index
+            return False
+        return meta["fingerprints"] != file_fingerprints(files)
+
+    def _ensure_built(self):
+        if not self._is_stale():
+            return
+
+        with index_lock(self.index_dir):
+            # another process may have rebuilt the index while we waited
+            if self._is_stale():
+                build_knowledge_base(self.name)
+
+    def load(self):
+        """Open the index, building it first if it's missing or out of date
+
+        Keyword arguments:
+        self -- the class object
+        """
+        self._ensure_built()
+
+        # resolve the symlink once so every array comes from the same build
+        build_dir = pathlib.Path(os.path.realpath(str(self.index_dir)))
+        self.gene_vocab = {str(gene): code for code, gene in enumerate(np.load(str(build_dir / "genes.npy")))}
+        self.other_vocab = {str(other): code for code, other in enumerate(np.load(str(build_dir / "others.npy")))}
+        self.source_bits = {str(source): 1 << code for code, source in enumerate(np.load(str(build_dir / "sources.npy")))}
+        self.pair_keys = np.load(str(build_dir / "pair_keys.npy"), mmap_mode="r")
+        self.masks = np.load(str(build_dir / "masks.npy"), mmap_mode="r")
+        return self
+
+    def fingerprint(self):
+        """Return a hash of the index metadata (version, source file sizes/mtimes and pair count)
+        used to tell when cached label function output is stale
+
+        Keyword arguments:
+        self -- the class object
+        """
+        self._ensure_built()
+
+        with open(str(self.index_dir / "meta.json"), "r") as f:
+            meta = json.load(f)
+        return hashlib.sha256(json.dumps([self.name, meta], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def source_mask(self, *sources):
+        """Return the bitmask for one or more sources (unknown sources have no bit)
+
+        Keyword arguments:
+        self -- the class object
+        sources -- the names of the source databases
+        """
+        if self.pair_keys is None:
+            self.load()
+        mask = 0
+        for source in sources:
+            mask |= self.source_bits.get(source, 0)
+        return mask
+
+    def lookup(self, gene, other):
+        """Return the bitmask of sources that contain a pair (0 if none do)
+
+        Keyword arguments:
+        self -- the class object
+        gene -- the entrez gene id
+        other -- the other entity id (doid or drugbank id)
+        """
+        if self.pair_keys is None:
+            self.load()
+
+        gene_code = self.gene_vocab.get(str(gene))
+        other_code = self.other_vocab.get(str(other))
+        if gene_code is None or other_code is None:
+            return 0
+
+        key = gene_code * len(self.other_vocab) + other_code
+        position = self.pair_keys.searchsorted(key)
+        if position < len(self.pair_keys) and self.pair_keys[position] == key:
+            return int(self.masks[position])
+        return 0
+
+    def lookup_batch(self, genes, others):
+        """Return the source bitmasks for a batch of pairs
+
+        Keyword arguments:
+        self -- the class object
+        genes -- an iterable of entrez gene ids
+        others -- an iterable of other entity ids
+
+        Returns:
+        A uint32 array with one bitmask per pair (0 for pairs that aren't in the knowledge base)
+        """
+        if self.pair_keys is None:
+            self.load()
+
+        gene_codes = np.array([self.gene_vocab.get(str(gene), -1) for gene in genes], dtype=np.int64)
+        other_codes = np.array([self.other_vocab.get(str(other), -1) for other in others], dtype=np.int64)
+        masks = np.zeros(len(gene_codes), dtype=np.uint32)
+
+        known = (gene_codes >= 0) & (other_codes >= 0)
+        if not known.any() or len(self.pair_keys) == 0:
+            return masks
+
+        keys = gene_codes[known] * len(self.other_vocab) + other_codes[known]
+        positions = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        found = np.asarray(self.pair_keys[positions]) == keys
+        masks[np.flatnonzero(known)[found]] = self.masks[positions[found]]
+        return masks
+
+    def __contains__(self, triple):
+        gene, other, source = triple
+        return bool(self.lookup(gene, other) & self.source_mask(source))
@@ -0,0 +1,91 @@
+import os
+import pickle
+
+import nltk
+from nltk.tokenize import word_tokenize
+
+# Set to True to use the part of speech tags CoreNLP stored on each
+# snorkel Sentence instead of running nltk's tagger.
+# The two taggers don't always agree, so this changes the output of the NO_VERB label functions.
+USE_STORED_POS_TAGS = False
+
+# sentence stable_id -> whether nltk found a verb in the sentence
+verb_cache = {}
+
+# entries tagged since the last take_new_verb_entries call, so label_candidates
+# can send the entries its worker processes found back to the parent process
+new_verb_entries = {}
+
+# runtime caches left out of label function fingerprints (see label_cache.lf_fingerprint)
+__fingerprint_exempt__ = {"verb_cache", "new_verb_entries"}
+
+
+def sentence_has_verb(sentence):
+    """
+    This function is designed to check if a sentence contains a verb.
+    It either reads the stored CoreNLP tags (see USE_STORED_POS_TAGS)
+    or looks up the cached nltk tagging, tagging the sentence only if it hasn't been seen before.
+
+    sentence - the snorkel sentence object
+    """
+    if USE_STORED_POS_TAGS and sentence.pos_tags:
+        return any("VB" in tag for tag in sentence.pos_tags)
+
+    key = sentence.stable_id
+    if key not in verb_cache:
+        verb_cache[key] = any("VB" in tag for _, tag in nltk.pos_tag(word_tokenize(sentence.text)))
+        new_verb_entries[key] = verb_cache[key]
+    return verb_cache[key]
+
+
+def take_new_verb_entries():
+    """
+    This function is designed to return the entries tagged since it was last called
+    and forget them, e.g. to send a worker process's entries back with its labels.
+    """
+    entries = dict(new_verb_entries)
+    new_verb_entries.clear()
+    return entries
+
+
+def add_verb_entries(entries):
+    """
+    This function is designed to merge entries tagged in another process into the verb cache.
+
+    entries - a dictionary of sentence stable_id -> whether the sentence has a verb
+    """
+    verb_cache.update(entries)
+    return len(verb_cache)
+
+
+def load_pos_tag_cache(path):
+    """
+    This function is designed to load a previously saved verb cache
+    so sentences tagged in an earlier run don't need to be tagged again.
+
+    path - the pickle file written by save_pos_tag_cache
+    """
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            verb_cache.update(pickle.load(f))
+    return len(verb_cache)
+
+
+def save_pos_tag_cache(path):
+    """
+    This function is designed to save the verb cache to disk.
+    Entries already in the file are kept.
+
+    path - the pickle file to write
+    """
+    cache = {}
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            cache = pickle.load(f)
+    cache.update(verb_cache)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return len(cache)
@@ -0,0 +1,428 @@
+from collections import OrderedDict, deque
+import hashlib
+import re
+
+try:
+    import ahocorasick
+except ImportError:
+    # pyahocorasick is optional, PhraseMatcher falls back to a pure python automaton
+    ahocorasick = None
+
+REGEX_METACHARACTERS = frozenset("\\.^$*+?{}[]|()")
+
+
+# Helper function for label functions
+def ltp(tokens):
+    return '(' + '|'.join(tokens) + ')'
+
+
+class RegexBank(object):
+    """Compiled Regex Registry
+    This class holds every regular expression a label function module needs.
+    Each pattern is compiled once when it is registered (at import time),
+    so label functions never rebuild pattern strings or rely on the
+    re module's internal cache while labeling candidates.
+    """
+
+    def __init__(self):
+        """ Initialize the regex bank
+
+        Keyword arguments:
+        self -- the class object
+        """
+        self.sources = OrderedDict()
+        self.patterns = OrderedDict()
+
+    def register(self, name, pattern, flags=re.I):
+        """Compile a pattern and store it under the given name
+
+        Keyword arguments:
+        self -- the class object
+        name -- the key label functions use to grab the pattern
+        pattern -- the raw regular expression string
+        flags -- the re flags used to compile the pattern (case insensitive by default)
+
+        Returns:
+        The compiled pattern object
+        """
+        if name in self.patterns:
+            raise KeyError("Pattern {} has already been registered".format(name))
+
+        self.sources[name] = (pattern, flags)
+        self.patterns[name] = re.compile(pattern, flags)
+        return self.patterns[name]
+
+    def __getitem__(self, name):
+        return self.patterns[name]
+
+    def __contains__(self, name):
+        return name in self.patterns
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def fingerprint(self):
+        """Return a hash of every registered pattern and its flags
+        (used to tell when cached label function output is stale)
+
+        Keyword arguments:
+        self -- the class object
+        """
+        sha256 = hashlib.sha256()
+        for name, (pattern, flags) in self.sources.items():
+            sha256.update("{}\t{}\t{}\n".format(name, pattern, int(flags)).encode("utf-8"))
+        return sha256.hexdigest()
+
+
+def is_literal(phrase):
+    return not any(char in REGEX_METACHARACTERS for char in phrase)
+
+
+class PhraseAutomaton(object):
+    """Aho-Corasick Automaton
+    A pure python version of the parts of pyahocorasick's Automaton that
+    PhraseMatcher uses (add_word, make_automaton and iter).
+    It is only used when pyahocorasick isn't installed.
+    """
+
+    def __init__(self):
+        """ Initialize an empty automaton
+
+        Keyword arguments:
+        self -- the class object
+        """
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+
+    def add_word(self, key, value):
+        """Add a key to the trie
+
+        Keyword arguments:
+        self -- the class object
+        key -- the string to look for
+        value -- the object returned for every occurrence of the key
+        """
+        state = 0
+        for char in key:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.outputs[state].append(value)
+
+    def make_automaton(self):
+        """Compute the failure links (breadth first) so iter never backtracks
+
+        Keyword arguments:
+        self -- the class object
+        """
+        states = deque(self.goto[0].values())
+        while states:
+            state = states.popleft()
+            for char, next_state in self.goto[state].items():
+                states.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def iter(self, text):
+        """Yield (end index, value) for every occurrence of every key in one pass over the text
+
+        Keyword arguments:
+        self -- the class object
+        text -- the string to scan
+        """
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for value in outputs[state]:
+                yield index, value
+
+
+class PhraseMatcher(object):
+    """Multi Phrase Set Matcher
+    This class holds the phrase sets (e.g. method_indication) label functions search for.
+    Most phrases are plain strings, so the literal phrases of every set go into a
+    single Aho-Corasick automaton and a text is scanned once for all of them (scan).
+    The few phrases that are real regular expressions (e.g. "level(s)? (of|in)")
+    are kept per set and only searched when a label function asks about that set.
+    """
+
+    def __init__(self):
+        """ Initialize the matcher
+
+        Keyword arguments:
+        self -- the class object
+        """
+        self.sources = OrderedDict()
+        self.residuals = OrderedDict()
+        self._residual_variants = {}
+        self._automaton = None
+
+    def register(self, name, phrases, flags=re.I):
+        """Split a phrase set into literal phrases and residual regular expressions
+
+        Keyword arguments:
+        self -- the class object
+        name -- the key label functions use to ask about the set
+        phrases -- an iterable of phrases (plain strings or regular expressions)
+        flags -- re.I for case insensitive matching (the default) or 0
+        """
+        if name in self.sources:
+            raise KeyError("Phrase set {} has already been registered".format(name))
+        if flags & ~re.I:
+            raise ValueError("Phrase sets only support the re.I flag")
+
+        phrases = sorted(set(phrases))
+        residuals = [phrase for phrase in phrases if not is_literal(phrase)]
+        self.sources[name] = (phrases, flags)
+        self.residuals[name] = (ltp(residuals), flags) if residuals else None
+        # rebuilt on the next scan
+        self._automaton = None
+
+    def _build_automaton(self):
+        entries = OrderedDict()
+        for name, (phrases, flags) in self.sources.items():
+            for phrase in filter(is_literal, phrases):
+                # the automaton runs over the lowercased text, case sensitive sets are checked per match
+                entries.setdefault(phrase.lower(), []).append((name, phrase, not flags & re.I))
+
+        automaton = ahocorasick.Automaton() if ahocorasick is not None else PhraseAutomaton()
+        for key, value in entries.items():
+            automaton.add_word(key, (len(key), value))
+        if entries:
+            automaton.make_automaton()
+        return automaton, bool(entries)
+
+    def residual_pattern(self, name, anchor_start=False, anchor_end=False, not_preceded_by=()):
+        """Return the compiled residual regex of a set (with the requested anchors and lookbehinds)
+        or None if every phrase in the set is a literal
+
+        Keyword arguments:
+        self -- the class object
+        name -- the phrase set
+        anchor_start -- only match at the start of the text (^)
+        anchor_end -- only match at the end of the text ($)
+        not_preceded_by -- strings that can't come right before the phrase
+        """
+        if self.residuals[name] is None:
+            return None
+
+        key = (name, anchor_start, anchor_end, tuple(not_preceded_by))
+        if key not in self._residual_variants:
+            pattern, flags = self.residuals[name]
+            lookbehinds = "".join("(?<!{})".format(re.escape(prefix)) for prefix in not_preceded_by)
+            self._residual_variants[key] = re.compile(
+                ("^" if anchor_start else "") + lookbehinds + pattern + ("$" if anchor_end else ""),
+                flags
+            )
+        return self._residual_variants[key]
+
+    def scan(self, text):
+        """Find every literal phrase of every set in one pass over the text
+
+        Keyword arguments:
+        self -- the class object
+        text -- the sentence (or tagged/between text) to scan
+
+        Returns:
+        A PhraseHits object that answers which sets match and where
+        """
+        if self._automaton is None:
+            self._automaton = self._build_automaton()
+        automaton, has_words = self._automaton
+
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # a few characters lowercase to two characters, keep offsets aligned with the text
+            lowered = "".join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+        hits = {}
+        if has_words:
+            for end_index, (length, entries) in automaton.iter(lowered):
+                end = end_index + 1
+                start = end - length
+                for name, phrase, case_sensitive in entries:
+                    if case_sensitive and text[start:end] != phrase:
+                        continue
+                    hits.setdefault(name, []).append((start, end))
+
+        return PhraseHits(self, text, hits)
+
+    def __contains__(self, name):
+        return name in self.sources
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def fingerprint(self):
+        """Return a hash of every registered phrase set and its flags
+        (used to tell when cached label function output is stale)
+
+        Keyword arguments:
+        self -- the class object
+        """
+        sha256 = hashlib.sha256()
+        for name, (phrases, flags) in self.sources.items():
+            sha256.update("{}\t{}\t{}\n".format(name, "|".join(phrases), int(flags)).encode("utf-8"))
+        return sha256.hexdigest()
+
+
+class PhraseHits(object):
+    """Phrase Matches For One Text
+    This class is returned by PhraseMatcher.scan. It holds the literal phrase
+    matches of every set and answers the questions label functions used to ask
+    with regular expressions such as "{{A}}.*(phrases).*{{B}}" or "^(phrases)".
+    Like the regular expressions, ".*" never crosses a line break.
+    """
+
+    def __init__(self, matcher, text, hits):
+        """ Initialize the matches
+
+        Keyword arguments:
+        self -- the class object
+        matcher -- the PhraseMatcher that scanned the text
+        text -- the scanned text
+        hits -- a dictionary of set name -> list of (start, end) literal matches
+        """
+        self.matcher = matcher
+        self.text = text
+        self.hits = hits
+        self._markers = {}
+
+    def spans(self, name):
+        """Return the (start, end) offsets of the literal phrases of a set found in the text
+
+        Keyword arguments:
+        self -- the class object
+        name -- the phrase set
+        """
+        return list(self.hits.get(name, []))
+
+    def _is_preceded(self, start, prefixes, flags):
+        for prefix in prefixes:
+            if start < len(prefix):
+                continue
+            before = self.text[start - len(prefix):start]
+            if before == prefix or (flags & re.I and before.lower() == prefix.lower()):
+                return True
+        return False
+
+    def search(self, name, start=0, end=None, anchor_start=False, anchor_end=False, not_preceded_by=()):
+        """Return True if a phrase of the set matches inside text[start:end]
+
+        Keyword arguments:
+        self -- the class object
+        name -- the phrase set
+        start, end -- the part of the text the phrase has to fit in
+        anchor_start -- the phrase has to start the text (^)
+        anchor_end -- the phrase has to end at end ($)
+        not_preceded_by -- strings that can't come right before the phrase (negative lookbehinds)
+        """
+        end = len(self.text) if end is None else end
+        flags = self.matcher.sources[name][1]
+
+        for hit_start, hit_end in self.hits.get(name, ()):
+            if hit_start < start or hit_end > end:
+                continue
+            if anchor_start and hit_start != 0:
+                continue
+            if anchor_end and not (hit_end == end or (hit_end == end - 1 and self.text[hit_end] == "\n")):
+                continue
+            if not_preceded_by and self._is_preceded(hit_start, not_preceded_by, flags):
+                continue
+            return True
+
+        pattern = self.matcher.residual_pattern(name, anchor_start, anchor_end, not_preceded_by)
+        return pattern is not None and pattern.search(self.text, start, end) is not None
+
+    def _marker_spans(self, markers):
+        # every occurrence of the markers in text order
+        markers = tuple(markers)
+        if markers not in self._markers:
+            spans = []
+            for marker in markers:
+                position = self.text.find(marker)
+                while position != -1:
+                    spans.append((position, position + len(marker)))
+                    position = self.text.find(marker, position + 1)
+            self._markers[markers] = sorted(spans)
+        return self._markers[markers]
+
+    def _line_start(self, position):
+        return self.text.rfind("\n", 0, position) + 1
+
+    def _line_end(self, position):
+        line_end = self.text.find("\n", position)
+        return len(self.text) if line_end == -1 else line_end
+
+    def search_before(self, name, markers, **kwargs):
+        """Return True if a phrase of the set comes before one of the markers ("(phrases).*marker")
+
+        Keyword arguments:
+        self -- the class object
+        name -- the phrase set
+        markers -- strings such as "{{A}}" and "{{B}}"
+        kwargs -- passed on to search (e.g. not_preceded_by)
+        """
+        return any(
+            self.search(name, self._line_start(marker_start), marker_start, **kwargs)
+            for marker_start, marker_end in self._marker_spans(markers)
+        )
+
+    def search_after(self, name, markers, count=1, **kwargs):
+        """Return True if a phrase of the set comes after count markers ("marker.*marker.*(phrases)")
+
+        Keyword arguments:
+        self -- the class object
+        name -- the phrase set
+        markers -- strings such as "{{A}}" and "{{B}}"
+        count -- the number of markers that have to come before the phrase
+        kwargs -- passed on to search (e.g. not_preceded_by)
+        """
+        line_start = None
+        for marker_start, marker_end in self._marker_spans(markers):
+            if self._line_start(marker_start) != line_start:
+                line_start = self._line_start(marker_start)
+                seen, last_end = 0, line_start
+
+            # markers can't overlap, just like the regex alternation they replace
+            if marker_start < last_end:
+                continue
+            seen, last_end = seen + 1, marker_end
+
+            if seen == count and self.search(name, marker_end, self._line_end(marker_end), **kwargs):
+                return True
+        return False
+
+    def search_between(self, name, first_markers, second_markers, **kwargs):
+        """Return True if a phrase of the set sits between two markers ("first.*(phrases).*second")
+
+        Keyword arguments:
+        self -- the class object
+        name -- the phrase set
+        first_markers -- the markers that come before the phrase (e.g. ["{{A}}"])
+        second_markers -- the markers that come after the phrase (e.g. ["{{B}}"])
+        kwargs -- passed on to search (e.g. not_preceded_by)
+        """
+        for first_start, first_end in self._marker_spans(first_markers):
+            for second_start, second_end in self._marker_spans(second_markers):
+                if second_start < first_end or "\n" in self.text[first_end:second_start]:
+                    continue
+                if self.search(name, first_end, second_start, **kwargs):
+                    return True
+        return False
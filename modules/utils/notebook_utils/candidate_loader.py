@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+
+from sqlalchemy.orm import joinedload
+
+from snorkel.models import Candidate, Sentence, Span
+
+
+def get_candidate_class(session, candidate_ids):
+    """
+    This function is designed to find the candidate subclass (e.g. DiseaseGene)
+    of a list of candidates using the polymorphic type of the first candidate.
+
+    session - the session object
+    candidate_ids - the ids of the candidates
+
+    returns the candidate subclass or Candidate if the ids are empty/unknown
+    """
+    if len(candidate_ids) == 0:
+        return Candidate
+
+    candidate_type = (
+        session.query(Candidate.type)
+        .filter(Candidate.id == int(candidate_ids[0]))
+        .scalar()
+    )
+    mapper = Candidate.__mapper__.polymorphic_map.get(candidate_type)
+    return mapper.class_ if mapper is not None else Candidate
+
+
+def eager_candidate_query(session, candidate_class, candidate_ids):
+    """
+    This function is designed to build a query that loads candidates together
+    with their spans, the spans' sentences and the sentences' documents
+    in one round trip, so label functions never trigger lazy loads.
+
+    session - the session object
+    candidate_class - the candidate subclass (see get_candidate_class)
+    candidate_ids - the ids of the candidates to load
+    """
+    query = session.query(candidate_class).filter(candidate_class.id.in_(candidate_ids))
+
+    # snorkel's candidate arguments and Span.sentence both point at the generic Context
+    # table, so of_type is needed to load the span/sentence columns in the same join
+    for argname in getattr(candidate_class, "__argnames__", []):
+        query = query.options(
+            joinedload(getattr(candidate_class, argname).of_type(Span))
+            .joinedload(Span.sentence.of_type(Sentence))
+            .joinedload(Sentence.document)
+        )
+    return query
+
+
+def load_candidates(session, candidate_ids, candidate_class=None):
+    """
+    This function is designed to load a batch of candidates with everything
+    the label functions touch (spans, sentences and documents).
+    Ids that don't belong to candidate_class are loaded with a plain query.
+
+    session - the session object
+    candidate_ids - the ids of the candidates to load
+    candidate_class - the candidate subclass (inferred from the first id if not given)
+
+    returns a list of candidate objects (not in the order of candidate_ids)
+    """
+    if candidate_class is None:
+        candidate_class = get_candidate_class(session, candidate_ids)
+
+    candidates = eager_candidate_query(session, candidate_class, candidate_ids).all()
+
+    if len(candidates) < len(candidate_ids):
+        loaded_ids = set(candidate.id for candidate in candidates)
+        missing_ids = [cid for cid in candidate_ids if cid not in loaded_ids]
+        candidates += session.query(Candidate).filter(Candidate.id.in_(missing_ids)).all()
+
+    return candidates
+
+
+def prefetch_candidates(session_factory, candidate_ids, batch_size, candidate_class=None, prefetch_depth=2, stats=None):
+    """
+    This function is designed to load batches of candidates in a background
+    thread while the caller labels the batch it already has.
+    At most prefetch_depth loaded batches wait in the queue, so memory stays flat.
+    Every batch is loaded through its own session (and database connection),
+    which is closed once the caller asks for the next batch, so the background
+    thread and the caller never use the same session at the same time.
+
+    session_factory - a sessionmaker bound to the database engine
+    candidate_ids - the ids of the candidates to load
+    batch_size - the number of candidates per batch
+    candidate_class - the candidate subclass (see get_candidate_class)
+    prefetch_depth - the number of batches to load ahead (0 loads each batch when it's needed)
+    stats - an optional dictionary that collects "fetch" (time spent loading batches)
+        and "db_wait" (time the caller spent waiting on a batch) in seconds
+
+    yields a list of candidate objects per batch
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("fetch", 0.0)
+    stats.setdefault("db_wait", 0.0)
+    batches = [candidate_ids[start:start + batch_size] for start in range(0, len(candidate_ids), batch_size)]
+
+    def fetch(batch_ids):
+        start = time.perf_counter()
+        batch_session = session_factory()
+        candidates = load_candidates(batch_session, batch_ids, candidate_class)
+        stats["fetch"] += time.perf_counter() - start
+        return batch_session, candidates
+
+    if prefetch_depth <= 0:
+        for batch_ids in batches:
+            start = time.perf_counter()
+            batch_session, candidates = fetch(batch_ids)
+            stats["db_wait"] += time.perf_counter() - start
+            try:
+                yield candidates
+            finally:
+                batch_session.close()
+        return
+
+    batch_queue = queue.Queue(maxsize=prefetch_depth)
+    stop = threading.Event()
+
+    def producer():
+        try:
+            for batch_ids in batches:
+                if stop.is_set():
+                    break
+                batch_queue.put(fetch(batch_ids))
+        except Exception as error:
+            batch_queue.put(error)
+        finally:
+            batch_queue.put(None)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            start = time.perf_counter()
+            item = batch_queue.get()
+            stats["db_wait"] += time.perf_counter() - start
+
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            batch_session, candidates = item
+            try:
+                yield candidates
+            finally:
+                batch_session.close()
+    finally:
+        # Unblock the producer if the caller stopped early and close what it already loaded
+        stop.set()
+        while thread.is_alive() or not batch_queue.empty():
+            try:
+                item = batch_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            if isinstance(item, tuple):
+                item[0].close()
+        thread.join()
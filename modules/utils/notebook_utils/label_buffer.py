@@ -0,0 +1,145 @@
+import numpy as np
+import scipy.sparse as sparse
+
+# Labels are buffered as int8, but the returned matrices keep the int64 data label
+# matrices always had, so L.T @ L, L.sum(axis=0) or L.dot(...) can't overflow
+LABEL_MATRIX_DTYPE = np.int64
+
+
+class LabelBuffer(object):
+    """Growing COO Label Buffer
+    This class stores the nonzero labels of a label matrix in three preallocated
+    numpy arrays (int32 rows, int32 columns and int8 labels) instead of python
+    tuples/lists. When the arrays fill up their capacity is doubled, so appending
+    n labels only copies O(n) entries in total.
+    Labels have to fit into an int8 (-128 to 127).
+    The csr matrix built from the buffer has LABEL_MATRIX_DTYPE data.
+    """
+
+    def __init__(self, capacity=1024):
+        """ Initialize the buffer
+
+        Keyword arguments:
+        self -- the class object
+        capacity -- the number of labels to allocate room for up front
+        """
+        capacity = max(int(capacity), 1)
+        self.rows = np.empty(capacity, dtype=np.int32)
+        self.cols = np.empty(capacity, dtype=np.int32)
+        self.data = np.empty(capacity, dtype=np.int8)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.rows)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+
+        for name in ("rows", "cols", "data"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add_row(self, row, labels):
+        """Write the nonzero labels of one candidate
+
+        Keyword arguments:
+        self -- the class object
+        row -- the row of the candidate in the label matrix
+        labels -- the output of every label function for the candidate (zeros are skipped)
+        """
+        labels = np.asarray(labels, dtype=np.int8)
+        cols = np.flatnonzero(labels)
+
+        end = self.size + len(cols)
+        if end > self.capacity:
+            self._grow(end)
+
+        self.rows[self.size:end] = row
+        self.cols[self.size:end] = cols
+        self.data[self.size:end] = labels[cols]
+        self.size = end
+
+    def add(self, row, col, label):
+        """Write a single label
+
+        Keyword arguments:
+        self -- the class object
+        row -- the row of the candidate in the label matrix
+        col -- the column of the label function
+        label -- the label (zeros are skipped)
+        """
+        if label == 0:
+            return
+
+        if self.size == self.capacity:
+            self._grow(self.size + 1)
+
+        self.rows[self.size] = row
+        self.cols[self.size] = col
+        self.data[self.size] = label
+        self.size += 1
+
+    def add_column(self, rows, col, labels):
+        """Write the labels of one label function for a batch of candidates
+
+        Keyword arguments:
+        self -- the class object
+        rows -- the rows of the candidates in the label matrix
+        col -- the column of the label function
+        labels -- one label per row (zeros are skipped)
+        """
+        labels = np.asarray(labels, dtype=np.int8)
+        nonzero = np.flatnonzero(labels)
+
+        end = self.size + len(nonzero)
+        if end > self.capacity:
+            self._grow(end)
+
+        self.rows[self.size:end] = np.asarray(rows)[nonzero]
+        self.cols[self.size:end] = col
+        self.data[self.size:end] = labels[nonzero]
+        self.size = end
+
+    def coo(self):
+        """Return (rows, cols, data) trimmed to the labels written so far
+
+        Keyword arguments:
+        self -- the class object
+        """
+        return self.rows[:self.size], self.cols[:self.size], self.data[:self.size]
+
+    def to_csr(self, shape):
+        """Assemble the labels into a csr matrix
+
+        Keyword arguments:
+        self -- the class object
+        shape -- the (number of candidates, number of label functions) shape of the matrix
+        """
+        return coo_to_csr([self.coo()], shape)
+
+
+def coo_to_csr(coo_parts, shape):
+    """
+    This function is designed to stack (rows, cols, data) arrays from
+    several buffers (e.g. one per shard) into a single csr matrix.
+
+    coo_parts - a list of (rows, cols, data) array tuples
+    shape - the shape of the output matrix
+
+    returns a csr matrix with LABEL_MATRIX_DTYPE data
+    """
+    if not coo_parts:
+        coo_parts = [(np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.array([], dtype=np.int8))]
+
+    rows = np.concatenate([part[0] for part in coo_parts])
+    cols = np.concatenate([part[1] for part in coo_parts])
+    data = np.concatenate([part[2] for part in coo_parts]).astype(LABEL_MATRIX_DTYPE)
+    return sparse.csr_matrix((data, (rows, cols)), shape=shape)
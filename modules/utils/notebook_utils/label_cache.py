@@ -0,0 +1,241 @@
+import functools
+import hashlib
+import inspect
+import os
+import pathlib
+import re
+import types
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sparse
+
+from utils.notebook_utils.label_buffer import LABEL_MATRIX_DTYPE
+from utils.notebook_utils.label_matrix_helper import label_candidates
+from utils.notebook_utils.sharded_label_matrix import hash_candidate_ids
+
+# Bump when the way fingerprints are computed changes so old columns are ignored
+FINGERPRINT_VERSION = 1
+
+# Code from these modules is hashed line by line (and followed into the globals it uses).
+# Anything else (numpy, snorkel, nltk ...) is only identified by its name.
+TRACKED_MODULE_PREFIXES = ("utils.", "__main__")
+
+
+def _is_tracked(obj):
+    module = getattr(obj, "__module__", None) or ""
+    return module == "__main__" or module.startswith(TRACKED_MODULE_PREFIXES)
+
+
+def _code_names(code):
+    # global names used by a function, including its lambdas and comprehensions
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _function_source(func):
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        # e.g. functions typed into an interactive shell
+        code = func.__code__
+        return repr((code.co_code, code.co_consts, code.co_names))
+
+
+def _fingerprint_value(value, seen):
+    """
+    This function is designed to turn a value a label function depends on
+    into a string that changes whenever the value does.
+    Returns None for values that shouldn't be part of the fingerprint
+    (modules, lazily filled globals, objects without a stable representation).
+
+    value - the value to fingerprint
+    seen - a dictionary of id -> fingerprint for values already visited
+    """
+    if value is None or isinstance(value, types.ModuleType):
+        return None
+
+    key = id(value)
+    if key in seen:
+        return seen[key]
+    # placeholder so recursive references (e.g. a function calling itself) terminate
+    seen[key] = "<recursive>"
+
+    if isinstance(value, (bool, int, float, str, bytes)):
+        result = repr(value)
+    elif isinstance(value, (list, tuple)):
+        result = "[{}]".format(",".join(str(_fingerprint_value(item, seen)) for item in value))
+    elif isinstance(value, (set, frozenset)):
+        result = "{{{}}}".format(",".join(sorted(str(_fingerprint_value(item, seen)) for item in value)))
+    elif isinstance(value, dict):
+        result = "{{{}}}".format(",".join(sorted(
+            "{}:{}".format(_fingerprint_value(k, seen), _fingerprint_value(v, seen))
+            for k, v in value.items()
+        )))
+    elif hasattr(value, "fingerprint") and callable(value.fingerprint) and not inspect.isclass(value):
+        result = "{}:{}".format(type(value).__name__, value.fingerprint())
+    elif isinstance(value, type(re.compile(""))):
+        result = "re:{}:{}".format(value.pattern, value.flags)
+    elif isinstance(value, np.ndarray):
+        result = "ndarray:" + hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        result = "pandas:" + hashlib.sha256(pd.util.hash_pandas_object(value, index=True).values.tobytes()).hexdigest()
+    elif isinstance(value, types.FunctionType):
+        result = _fingerprint_function(value, seen)
+    elif isinstance(value, functools.partial):
+        result = "partial:{}:{}:{}".format(
+            _fingerprint_value(value.func, seen),
+            _fingerprint_value(list(value.args), seen),
+            _fingerprint_value(value.keywords or {}, seen)
+        )
+    elif isinstance(getattr(value, "__wrapped__", None), types.FunctionType):
+        # functools.lru_cache and other decorators that keep the original function
+        result = _fingerprint_function(value.__wrapped__, seen)
+    elif inspect.isclass(value):
+        result = _fingerprint_class(value, seen)
+    elif callable(value):
+        # builtins and other callables (e.g. functools.partial) from untracked code
+        result = "{}.{}".format(getattr(value, "__module__", ""), getattr(value, "__qualname__", type(value).__name__))
+    else:
+        result = None
+
+    seen[key] = result
+    return result
+
+
+def _fingerprint_function(func, seen):
+    if not _is_tracked(func):
+        return "{}.{}".format(func.__module__, func.__qualname__)
+
+    parts = [_function_source(func), "scope={}".format(getattr(func, "scope", None))]
+    if callable(getattr(func, "batch", None)):
+        parts.append("batch={}".format(_fingerprint_value(func.batch, seen)))
+    parts += ["default={}".format(_fingerprint_value(default, seen)) for default in (func.__defaults__ or ())]
+
+    # runtime caches (e.g. pos_tag_cache.verb_cache) fill up as candidates are labeled,
+    # so modules list them in __fingerprint_exempt__ to keep them out of the hash
+    exempt = func.__globals__.get("__fingerprint_exempt__", ())
+    for name in sorted(_code_names(func.__code__)):
+        if name in func.__globals__ and name not in exempt:
+            parts.append("{}={}".format(name, _fingerprint_value(func.__globals__[name], seen)))
+
+    for name, cell in zip(func.__code__.co_freevars, func.__closure__ or ()):
+        try:
+            parts.append("{}={}".format(name, _fingerprint_value(cell.cell_contents, seen)))
+        except ValueError:
+            # empty cell
+            parts.append("{}=<empty>".format(name))
+
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _fingerprint_class(cls, seen):
+    if not _is_tracked(cls):
+        return "{}.{}".format(cls.__module__, cls.__qualname__)
+
+    parts = [cls.__qualname__]
+    for name, member in sorted(vars(cls).items()):
+        if isinstance(member, (staticmethod, classmethod)):
+            member = member.__func__
+        if isinstance(member, property):
+            member = member.fget
+        if isinstance(member, types.FunctionType):
+            parts.append("{}={}".format(name, _fingerprint_function(member, seen)))
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def lf_name(lf):
+    """
+    This function is designed to return the name of a label function,
+    looking through functools.partial to the function it wraps.
+
+    lf - the label function
+    """
+    while isinstance(lf, functools.partial):
+        lf = lf.func
+    return getattr(lf, "__name__", type(lf).__name__)
+
+
+def lf_fingerprint(lf):
+    """
+    This function is designed to hash a label function together with everything
+    it depends on: its source code, the source of every helper function or class it
+    calls from this repo (followed recursively), constants and regexes it reads, and
+    the data objects it uses (anything with a fingerprint() method such as the
+    knowledge base, regex bank and bicluster indices, plus dataframes and arrays).
+    Globals named in a module's __fingerprint_exempt__ set (runtime caches) are skipped.
+
+    lf - the label function
+
+    returns a sha256 hex string
+    """
+    parts = [str(FINGERPRINT_VERSION), lf_name(lf), _fingerprint_value(lf, {})]
+    return hashlib.sha256("\n".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def _column_path(cache_dir, candidate_hash, lf, fingerprint):
+    return pathlib.Path(cache_dir) / candidate_hash[:16] / "{}_{}.npz".format(lf_name(lf), fingerprint[:16])
+
+
+def _read_column(path, num_rows):
+    with np.load(str(path)) as column:
+        rows = column["rows"]
+        data = column["data"].astype(LABEL_MATRIX_DTYPE)
+    return sparse.csc_matrix((data, (rows, np.zeros(len(rows), dtype=np.int32))), shape=(num_rows, 1))
+
+
+def _write_column(path, column):
+    column = sparse.coo_matrix(column)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.stem + ".tmp.npz")
+    np.savez(str(tmp_path), rows=column.row.astype(np.int32), data=column.data.astype(np.int8))
+    os.replace(str(tmp_path), str(path))
+
+
+def label_candidates_cached(session, candidate_ids, lfs, cache_dir="label_cache", verbose=True, **kwargs):
+    """
+    This function is designed to label candidates while reusing the output of every
+    label function that hasn't changed since the last run.
+    Each label function's column is saved under (hash of the candidate ids, lf_fingerprint(lf)),
+    so editing one label function (or the data it reads) only relabels that column
+    and the rest of the matrix is read from disk.
+
+    session - the session object
+    candidate_ids - the ids for candidates to be labeled
+    lfs - a list of label functions (single task format)
+    cache_dir - the directory that holds the cached columns
+    verbose - print how many columns were reused
+    kwargs - passed on to label_candidates (num_workers, batch_size ...)
+        except the options that don't return a single csr matrix (output_dir, multitask)
+
+    returns a csr matrix with one column per label function
+    """
+    unsupported = sorted(set(kwargs) & {"output_dir", "output_shard_size", "multitask", "existing_L", "existing_ids"})
+    if unsupported:
+        raise ValueError(
+            "label_candidates_cached only builds single task csr matrices in memory, "
+            "so it can't be called with {}".format(", ".join(unsupported))
+        )
+
+    candidate_ids = [int(cid) for cid in candidate_ids]
+    candidate_hash = hash_candidate_ids(candidate_ids)
+    paths = [_column_path(cache_dir, candidate_hash, lf, lf_fingerprint(lf)) for lf in lfs]
+
+    missing = [col for col, path in enumerate(paths) if not path.exists()]
+    if verbose:
+        print("Reusing {} of {} label function columns, labeling: {}".format(
+            len(lfs) - len(missing), len(lfs), ", ".join(lf_name(lfs[col]) for col in missing) or "none"
+        ))
+
+    if missing:
+        L_missing = label_candidates(session, candidate_ids, [lfs[col] for col in missing], **kwargs).tocsc()
+        for missing_index, col in enumerate(missing):
+            _write_column(paths[col], L_missing[:, missing_index])
+
+    if not lfs:
+        return sparse.csr_matrix((len(candidate_ids), 0), dtype=LABEL_MATRIX_DTYPE)
+
+    return sparse.hstack([_read_column(path, len(candidate_ids)) for path in paths], format="csr")
@@ -1,16 +1,26 @@
-import threading
-import queue
-import sys
+import json
+import multiprocessing
+import os
+import time
 import pandas as pd
 import numpy as np
 from scipy.stats import norm
 import scipy.sparse as sparse
+from sqlalchemy.orm import sessionmaker
 from tqdm import tqdm_notebook
 
-from snorkel.models import Candidate
+from utils.label_functions import pos_tag_cache
+from utils.label_functions.candidate_context import CandidateBatch, CandidateContext, has_batch, is_sentence_scoped
+from utils.notebook_utils.candidate_loader import get_candidate_class, prefetch_candidates
+from utils.notebook_utils.label_buffer import LabelBuffer, coo_to_csr
+from utils.notebook_utils.sharded_label_matrix import ShardedLabelMatrix
 
-candidate_queue = queue.Queue()
-data_queue = queue.Queue()
+# per process state (each worker gets its own copy after the fork)
+sentence_label_cache = {}
+worker_state = {}
+
+# timings of the last label_candidates call (see report in label_candidates)
+labeling_report = {}
 
 def get_columns(session, L_data, lf_hash, lf_name):
     """
@@ -73,56 +83,188 @@ def get_auc_significant_stats(data_df, model_aucs):
     return model_auc_df
 
 
-def get_overlap_matrix(L, normalize=False):
+def get_overlap_matrix(L, normalize=False, chunk_size=None):
     """
     This code is "borrowed" from the snorkel metal repo.
     It is designed to output a matrix of overlaps between label fucntions
+    L is never densified: the overlaps are the product of the sparse nonzero
+    indicator matrix with itself, summed over blocks of rows.
 
     L - a sparse label matrix  created by snorkel.annotations.LabelAnnotator, 
         contains output from each label function and extract information 
         such as names of the label functions
+        (a ShardedLabelMatrix is read one shard at a time)
+    normalize - divide the counts by the number of rows
+    chunk_size - the number of rows per block (None uses the whole matrix at once)
 
     returns a matrix that contains the overlaps between label functions
     """
-    L = L.todense() if sparse.issparse(L) else L
     n, m = L.shape
-    X = np.where(L != 0, 1, 0).T
-    G = X @ X.T
+    G = np.zeros((m, m), dtype=np.int64)
+
+    for block in _iter_label_blocks(L, chunk_size):
+        X = (block != 0).astype(np.int64)
+        G += (X.T @ X).toarray()
 
     if normalize:
         G = G / n
     return G
 
-def get_conflict_matrix(L, normalize=False):
+def get_conflict_matrix(L, normalize=False, chunk_size=None):
     """
     This code is "borrowed" from the snorkel metal repo.
     It is designed to output a matrix of overlaps between label fucntions
+    Conflicts are counted without densifying L: the overlap counts come from
+    the product of the nonzero indicator matrix with itself and the agreements
+    from the same product for each label value. conflicts = overlaps - agreements
 
     L - a sparse label matrix  created by snorkel.annotations.LabelAnnotator, 
         contains output from each label function and extract information 
         such as names of the label functions
+        (a ShardedLabelMatrix is read one shard at a time)
+    normalize - divide the counts by the number of rows
+    chunk_size - the number of rows per block (None uses the whole matrix at once)
 
     returns a matrix that contains the conflicts between label functions
     """
-    L = L.todense() if sparse.issparse(L) else L
     n, m = L.shape
-    C = np.zeros((m, m))
-
-    # Iterate over the pairs of LFs
-    for i in range(m):
-        for j in range(m):
-            # Get the overlapping non-zero indices
-            overlaps = list(
-                set(np.where(L[:, i] != 0)[0]).intersection(
-                    np.where(L[:, j] != 0)[0]
-                )
-            )
-            C[i, j] = np.where(L[overlaps, i] != L[overlaps, j], 1, 0).sum()
+    C = np.zeros((m, m), dtype=np.int64)
+
+    for block in _iter_label_blocks(L, chunk_size):
+        # (rows x m) indicator of every nonzero label
+        X = sparse.csr_matrix((np.ones(block.nnz, dtype=np.int64), block.indices, block.indptr), shape=block.shape)
+        C += (X.T @ X).toarray()
 
+        # remove the pairs that gave the same label
+        for value in np.unique(block.data):
+            # shares the block's index arrays, the explicit zeros don't change the product
+            X_value = sparse.csr_matrix(((block.data == value).astype(np.int64), block.indices, block.indptr), shape=block.shape)
+            C -= (X_value.T @ X_value).toarray()
+
+    C = C.astype(np.float64)
     if normalize:
         C = C / n
     return C
 
+def lf_statistics(L, Y=None, lf_names=None, chunk_size=None, pairwise=False):
+    """
+    This function is designed to compute every label function summary statistic
+    in a single pass over the sparse label matrix (instead of calling
+    get_overlap_matrix, get_conflict_matrix and metal's lf_summary separately).
+    The columns follow metal's lf_summary:
+        j - the column of the label function (only when lf_names is given)
+        Polarity - the label the label function emitted (a sorted list if it emitted several)
+        Coverage - the fraction of rows the label function labeled
+        Overlaps - the fraction of rows labeled by this and at least one other label function
+        Conflicts - the fraction of rows labeled by this label function where the labels disagree
+        Correct/Incorrect - labels that agree/disagree with the gold labels (rows with a gold label of 0 are skipped)
+        Emp. Acc. - the fraction of this label function's labels that equal the gold label (only when Y is given)
+
+    L - a sparse label matrix (a ShardedLabelMatrix is streamed one shard at a time)
+    Y - the gold labels for every row in the same label space as L (optional)
+    lf_names - the names of the label functions (the columns of L)
+    chunk_size - the number of rows per block (None uses the whole matrix at once)
+    pairwise - also return the label function x label function overlap and conflict counts
+
+    returns a dataframe with one row per label function
+        (plus the overlap and conflict dataframes when pairwise is True)
+    """
+    n, m = L.shape
+    columns = ["Polarity", "Coverage", "Overlaps", "Conflicts"]
+    if lf_names is not None:
+        lf_names = list(lf_names)
+        columns = ["j"] + columns
+    else:
+        lf_names = list(range(m))
+    Y = None if Y is None else np.ravel(np.asarray(Y))
+
+    coverage = np.zeros(m, dtype=np.int64)
+    overlaps = np.zeros(m, dtype=np.int64)
+    conflicts = np.zeros(m, dtype=np.int64)
+    correct = np.zeros(m, dtype=np.int64)
+    incorrect = np.zeros(m, dtype=np.int64)
+    value_counts = {}
+    overlap_matrix = np.zeros((m, m), dtype=np.int64)
+    agreement_matrix = np.zeros((m, m), dtype=np.int64)
+
+    row_offset = 0
+    for block in _iter_label_blocks(L, chunk_size):
+        X = sparse.csr_matrix((np.ones(block.nnz, dtype=np.int64), block.indices, block.indptr), shape=block.shape)
+        labels_per_row = np.ravel(X.sum(axis=1))
+
+        coverage += np.ravel(X.sum(axis=0))
+        overlaps += X.T @ (labels_per_row > 1).astype(np.int64)
+        overlap_matrix += (X.T @ X).toarray()
+
+        # a row is conflicted when its label functions emitted more than one distinct label
+        distinct_labels = np.zeros(block.shape[0], dtype=np.int64)
+        for value in np.unique(block.data):
+            X_value = sparse.csr_matrix(((block.data == value).astype(np.int64), block.indices, block.indptr), shape=block.shape)
+            agreement_matrix += (X_value.T @ X_value).toarray()
+            distinct_labels += np.ravel(X_value.sum(axis=1)) > 0
+            value_counts[value] = value_counts.get(value, 0) + np.ravel(X_value.sum(axis=0))
+        conflicts += X.T @ (distinct_labels > 1).astype(np.int64)
+
+        if Y is not None:
+            block_Y = np.repeat(Y[row_offset:row_offset + block.shape[0]], np.diff(block.indptr))
+            is_correct = block.data == block_Y
+            correct += np.bincount(block.indices[is_correct], minlength=m)
+            incorrect += np.bincount(block.indices[~is_correct & (block_Y != 0)], minlength=m)
+
+        row_offset += block.shape[0]
+
+    num_rows = max(n, 1)
+    polarities = [
+        sorted(int(value) for value, counts in value_counts.items() if counts[col] > 0)
+        for col in range(m)
+    ]
+    stats_df = pd.DataFrame(
+        {
+            "j": list(range(m)),
+            "Polarity": [polarity[0] if len(polarity) == 1 else polarity for polarity in polarities],
+            "Coverage": coverage/num_rows,
+            "Overlaps": overlaps/num_rows,
+            "Conflicts": conflicts/num_rows
+        },
+        index=lf_names,
+        columns=columns
+    )
+
+    if Y is not None:
+        stats_df["Correct"] = correct
+        stats_df["Incorrect"] = incorrect
+        # like metal, a label on a row without a gold label counts against the accuracy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            stats_df["Emp. Acc."] = np.where(coverage > 0, correct/coverage, np.nan)
+
+    if pairwise:
+        overlap_df = pd.DataFrame(overlap_matrix, index=lf_names, columns=lf_names)
+        conflict_df = pd.DataFrame(overlap_matrix - agreement_matrix, index=lf_names, columns=lf_names)
+        return stats_df, overlap_df, conflict_df
+    return stats_df
+
+def _iter_label_blocks(L, chunk_size=None):
+    """
+    This function yields a label matrix as csr blocks of rows (without explicit zeros).
+
+    L - a sparse or dense label matrix or a ShardedLabelMatrix (the first task for multitask)
+    chunk_size - the number of rows per block (None yields the whole matrix,
+        or one block per shard for a ShardedLabelMatrix)
+    """
+    if isinstance(L, ShardedLabelMatrix):
+        blocks = (block for candidate_ids, block in L.iter_shards(task=0))
+    else:
+        L = sparse.csr_matrix(L)
+        if chunk_size is None:
+            blocks = [L]
+        else:
+            blocks = (L[start:start + chunk_size] for start in range(0, L.shape[0], chunk_size))
+
+    for block in blocks:
+        block = sparse.csr_matrix(block, copy=True)
+        block.eliminate_zeros()
+        yield block
+
 def label_candidates_db(labeler, cids_query, label_functions, apply_existing=False):
     """
     This function is designed to label candidates and place the annotations inside a database.
@@ -139,111 +281,569 @@ def label_candidates_db(labeler, cids_query, label_functions, apply_existing=Fal
         return labeler.apply(cids_query=cids_query, parallelism=5)
 
 
-def label_candidates(session, candidate_ids, lfs, multitask=False, num_threads=4, batch_size=10):
+def label_candidates(
+    session, candidate_ids, lfs, multitask=False, num_workers=4, batch_size=10,
+    shard_size=None, prefetch_depth=2, report=False, output_dir=None, output_shard_size=50000,
+    profile=False, profile_path=None, num_threads=None
+):
     """
     This function returns a sparse matrix in memory. Helps bypass using a static database to store annotations
     Only catch is that this structure doesn't contain the names of label functions
+    The candidate ids are split into contiguous shards that are labeled by a pool of
+    worker processes (label functions are pure python, so threads never ran in parallel).
+    Each worker opens its own database session, loads its candidates and returns
+    coo arrays that are stacked into the final csr matrix.
+    Candidates are loaded with their spans, sentences and documents in one query
+    per batch, so the label functions never go back to the database.
+    A background thread in each worker loads the next batches while the current one is labeled.
+    Each candidate is wrapped in a CandidateContext, so label functions share
+    the tagged text, between text, token windows and parent sentence
+    Sentence scoped label functions are evaluated once per sentence and
+    the output is reused for every candidate in that sentence
+    Label functions with a batch version (see batch_lf) are called once per shard
+    on a CandidateBatch instead of once per candidate
+    In multitask format a label function shared by several tasks is only run
+    once per candidate and its label is copied into every task's matrix
+    When output_dir is given the labels are streamed to disk in blocks of
+    output_shard_size rows instead (see ShardedLabelMatrix). Running the same call
+    again after a crash skips every block that was already written, as long as
+    the candidates and label functions haven't changed.
+    To label only the candidates a matrix doesn't cover yet use extend_label_matrix.
+    With profile=True every label function call is timed (see lf_profile_table).
     
     session - the session object
     candidate_ids - the ids for candidates to be extracted
     lfs - a list of label functions to label candidates
     multitask - a boolean to signify that labels will be in multitask format
-    num_threads - the number of threads to execute
-    batch_size - the batch size to prevent a memory overload
+    num_workers - the number of worker processes (1 labels everything in this process)
+    batch_size - the number of candidates each worker pulls from the database at once
+    shard_size - the number of candidates per shard (default splits the ids into 4 shards per worker)
+    prefetch_depth - the number of batches each worker loads ahead (0 turns prefetching off)
+    report - print the throughput and how the time split between the database and the label functions
+    output_dir - the directory to stream the label matrix into (None keeps it in memory)
+    output_shard_size - the number of rows per block written to output_dir
+    profile - record the time, calls, nonzero rate and exceptions of every label function
+        and print them with the candidates/sec of each worker. Exceptions raised by a
+        label function are counted and the candidate gets a 0 instead of stopping the run
+    profile_path - write the profile to this json file (turns profile on)
+    num_threads - old name for num_workers, kept so existing notebooks still run
+
+    returns a csr matrix (a list of them for multitask) or a ShardedLabelMatrix when output_dir is given
     """
-    iteration = 0
-    started = False
-    
-    #set up the threads
-    thread_list = [
-    threading.Thread(target=_label_candidates_multithread, args=(lfs, multitask))
-    for t in range(num_threads) 
-    ]
-
-    with tqdm_notebook(total=len(candidate_ids)) as pbar:
-        while iteration < len(candidate_ids):
-            candidate_batch = candidate_ids[iteration:iteration + batch_size]
-            row_indicies = range(iteration, iteration + batch_size, 1)
+    if num_threads is not None:
+        num_workers = num_threads
+
+    # plain ints so psycopg2 can adapt them (pandas series hold numpy ints)
+    candidate_ids = [int(cid) for cid in candidate_ids]
+    num_tasks = len(lfs) if multitask else 1
+    num_columns = max([len(lf) for lf in lfs]) if multitask else len(lfs)
+
+    unique_lfs, task_columns = _dedupe_lfs(lfs if multitask else [lfs])
+    config = {
+        "lfs": unique_lfs,
+        "task_columns": task_columns,
+        "batch_size": batch_size,
+        # look up the subclass once so every batch can eager load its spans
+        "candidate_class": get_candidate_class(session, candidate_ids),
+        "prefetch_depth": prefetch_depth,
+        "profile": profile or profile_path is not None
+    }
+
+    labeling_report.clear()
+    labeling_report.update({"candidates": 0, "fetch": 0.0, "db_wait": 0.0, "compute": 0.0, "workers": {}})
+    if config["profile"]:
+        labeling_report["lf_names"] = [getattr(lf, "__name__", repr(lf)) for lf in unique_lfs]
+        labeling_report["lf_profile"] = _new_lf_profile(len(unique_lfs))
+    start_time = time.perf_counter()
+
+    if output_dir is not None:
+        result = _label_candidates_to_disk(
+            session, candidate_ids, config, num_workers, shard_size,
+            output_dir, output_shard_size, num_columns, num_tasks
+        )
+    else:
+        if shard_size is None:
+            shard_size = max(1, int(np.ceil(len(candidate_ids)/(max(num_workers, 1)*4))))
+        shards = [
+            (start, candidate_ids[start:start + shard_size])
+            for start in range(0, len(candidate_ids), shard_size)
+        ]
 
-            #Fire up the threads to label each candidate
-            candidates = session.query(Candidate).filter(Candidate.id.in_(candidate_batch)).all()
-            for row_index, cand_obj in zip(row_indicies, candidates):
-                candidate_queue.put((row_index, cand_obj))
+        coo_parts = [[] for task in range(num_tasks)]
+        with tqdm_notebook(total=len(candidate_ids)) as pbar:
+            for start, shard_length, shard_coo, shard_stats in _run_shards(session, shards, config, num_workers):
+                for task_index, task_coo in enumerate(shard_coo):
+                    coo_parts[task_index].append(task_coo)
+                _add_shard_stats(shard_length, shard_stats)
+                pbar.update(shard_length)
 
-            #Only start the threads once
-            if not(started):
-                for thread in thread_list:
-                    thread.start()
-                started = True
+        L_data = [
+            coo_to_csr(coo_parts[task_index], shape=(len(candidate_ids), num_columns))
+            for task_index in range(num_tasks)
+        ]
+        result = L_data if multitask else L_data[0]
 
-            pbar.update(batch_size)
-            iteration += batch_size
+    labeling_report["wall"] = time.perf_counter() - start_time
+    if report or config["profile"]:
+        print_labeling_report(labeling_report)
+    if config["profile"]:
+        print(lf_profile_table(labeling_report).to_string())
+    if profile_path is not None:
+        write_lf_profile(profile_path, labeling_report)
+    return result
 
-    for thread in thread_list:
-        thread.join()
 
+def extend_label_matrix(session, existing_L, existing_ids, candidate_ids, lfs, multitask=False, **kwargs):
+    """
+    This function is designed to label only the candidates that aren't
+    in existing_ids and append their rows after the rows of existing_L,
+    so adding candidates to a corpus doesn't relabel the ones already labeled.
 
-    # Once finished use appropiate 
-    # steps to form the matricies
-    if multitask:
-        multirow  = [[] for i in lfs]
-        multicol = [[] for i in lfs]
-        multidata = [[] for i in lfs]
+    session - the session object
+    existing_L - a label matrix (a list of them for multitask) from an earlier run
+    existing_ids - the candidate id of every row in existing_L
+    candidate_ids - the ids for candidates to be labeled (ids in existing_ids are skipped)
+    lfs - the label functions existing_L was labeled with
+    multitask - a boolean to signify that labels will be in multitask format
+    kwargs - passed on to label_candidates (num_workers, batch_size ...)
 
-        while not(data_queue.empty()):
-            entry = data_queue.get()
-            multirow[entry[0]].append(entry[1])
-            multicol[entry[0]].append(entry[2])
-            multidata[entry[0]].append(entry[3])
+    returns the updated csr matrix (a list of them for multitask)
+        and the candidate id of each of its rows
+    """
+    if "output_dir" in kwargs:
+        raise ValueError(
+            "existing_L is appended to in memory and can't be combined with output_dir, "
+            "resume the output_dir run instead (blocks that were already written are skipped)"
+        )
 
-        L_data = [
-        sparse.csr_matrix(
-            (
-                multidata[task_index], (multirow[task_index], multicol[task_index])),
-                shape=(len(candidate_ids), max([len(lf) for lf in lfs]))
+    existing_ids = [int(cid) for cid in existing_ids]
+    seen_ids = set(existing_ids)
+    new_ids = []
+    for cid in candidate_ids:
+        if int(cid) not in seen_ids:
+            seen_ids.add(int(cid))
+            new_ids.append(int(cid))
+
+    L_new = label_candidates(session, new_ids, lfs, multitask=multitask, **kwargs)
+    L_existing = existing_L if multitask else [existing_L]
+    L_new = L_new if multitask else [L_new]
+
+    L_data = []
+    for L_old, L_added in zip(L_existing, L_new):
+        if L_old.shape != (len(existing_ids), L_added.shape[1]):
+            raise ValueError(
+                "existing_L has shape {} but existing_ids has {} ids and there are {} label functions"
+                .format(L_old.shape, len(existing_ids), L_added.shape[1])
             )
-        for task_index in range(len(lfs))
-        ]
-        return L_data
+        L_data.append(sparse.vstack([sparse.csr_matrix(L_old), L_added], format="csr"))
+
+    return (L_data if multitask else L_data[0]), existing_ids + new_ids
+
+
+def _label_candidates_to_disk(session, candidate_ids, config, num_workers, shard_size, output_dir, output_shard_size, num_columns, num_tasks):
+    """
+    This function streams the label matrix into a ShardedLabelMatrix directory.
+    Every output block is split into shard_size pieces for the workers and
+    written as soon as all of its pieces are labeled.
+
+    session - the session object
+    candidate_ids - the ids for candidates to be labeled
+    config - the label functions and loading options shared by every worker
+    num_workers - the number of worker processes
+    shard_size - the number of candidates per worker shard (default splits each block across the workers)
+    output_dir - the directory to write into
+    output_shard_size - the number of rows per block
+    num_columns - the number of columns of the label matrix
+    num_tasks - the number of label matrices (1 unless multitask)
+    """
+    # label_cache imports this module, so import it when it's needed
+    from utils.notebook_utils.label_cache import lf_fingerprint, lf_name
+
+    task_lfs = [[config["lfs"][column] for column in columns] for columns in config["task_columns"]]
+    label_matrix = ShardedLabelMatrix.create(
+        output_dir, candidate_ids, output_shard_size, num_columns, num_tasks,
+        lf_names=[[lf_name(lf) for lf in lf_task] for lf_task in task_lfs],
+        lf_fingerprints=[[lf_fingerprint(lf) for lf in lf_task] for lf_task in task_lfs]
+    )
+
+    if shard_size is None:
+        shard_size = max(1, int(np.ceil(output_shard_size/max(num_workers, 1))))
+
+    # split the missing blocks into worker shards that never cross a block boundary
+    shards = []
+    remaining = {}
+    for block_index in label_matrix.missing_shards():
+        block_start, block_end = label_matrix.shard_rows(block_index)
+        remaining[block_index] = block_end - block_start
+        for start in range(block_start, block_end, shard_size):
+            shards.append((start, candidate_ids[start:min(start + shard_size, block_end)]))
+
+    coo_parts = {block_index: [[] for task in range(num_tasks)] for block_index in remaining}
+
+    with tqdm_notebook(total=sum(remaining.values())) as pbar:
+        for start, shard_length, shard_coo, shard_stats in _run_shards(session, shards, config, num_workers):
+            block_index = start // output_shard_size
+            for task_index, task_coo in enumerate(shard_coo):
+                coo_parts[block_index][task_index].append(task_coo)
+            _add_shard_stats(shard_length, shard_stats)
+            pbar.update(shard_length)
+
+            remaining[block_index] -= shard_length
+            if remaining[block_index] == 0:
+                block_start, block_end = label_matrix.shard_rows(block_index)
+                label_matrix.write_shard(block_index, [
+                    coo_to_csr(
+                        [(rows - block_start, cols, data) for rows, cols, data in task_parts],
+                        shape=(block_end - block_start, num_columns)
+                    )
+                    for task_parts in coo_parts.pop(block_index)
+                ])
+
+    return label_matrix
+
+
+def _dedupe_lfs(task_lfs):
+    """
+    This function is designed to find the label functions shared between tasks
+    (e.g. CHECK_GENE_TAG in DaG, DuG and DdG), so each one is evaluated once.
+    Label functions are matched by identity.
+
+    task_lfs - a list of label function lists (one per task)
+
+    returns the unique label functions and, for every task, the position
+    of each of its label functions in the unique list
+    """
+    unique_lfs = []
+    positions = {}
+    task_columns = []
+    for lf_task in task_lfs:
+        columns = []
+        for lf in lf_task:
+            if lf not in positions:
+                positions[lf] = len(unique_lfs)
+                unique_lfs.append(lf)
+            columns.append(positions[lf])
+        task_columns.append(columns)
+    return unique_lfs, task_columns
+
+
+def _add_shard_stats(shard_length, shard_stats):
+    labeling_report["candidates"] += shard_length
+    for key in ("fetch", "db_wait", "compute"):
+        labeling_report[key] += shard_stats[key]
+
+    worker = labeling_report["workers"].setdefault(
+        shard_stats["worker"], {"candidates": 0, "db_wait": 0.0, "compute": 0.0}
+    )
+    worker["candidates"] += shard_length
+    worker["db_wait"] += shard_stats["db_wait"]
+    worker["compute"] += shard_stats["compute"]
+
+    # verb checks tagged in a worker process, so save_pos_tag_cache sees them
+    pos_tag_cache.add_verb_entries(shard_stats.get("verb_entries", {}))
+
+    if shard_stats.get("lf_profile") is not None:
+        lf_profile = labeling_report["lf_profile"]
+        for key in ("calls", "cached", "nonzero", "exceptions", "time"):
+            lf_profile[key] += shard_stats["lf_profile"][key]
+        lf_profile["last_error"].update(shard_stats["lf_profile"]["last_error"])
+
+
+def _run_shards(session, shards, config, num_workers):
+    """
+    This function labels every shard and yields the results as they finish.
+
+    session - the session object
+    shards - a list of (row offset, candidate ids) tuples
+    config - the label functions and loading options shared by every worker
+    num_workers - the number of worker processes
+    """
+    engine = session.get_bind()
+
+    if num_workers <= 1:
+        _init_label_worker(config, engine)
+        for shard in shards:
+            yield _label_shard(shard)
+        return
+
+    # Close the pooled connections before forking so the
+    # workers never share a database socket with this process
+    engine.dispose()
+
+    # fork (instead of spawn) so label functions don't have to be pickled
+    context = multiprocessing.get_context("fork")
+    with context.Pool(num_workers, initializer=_init_label_worker, initargs=(config, engine)) as pool:
+        for result in pool.imap_unordered(_label_shard, shards):
+            yield result
+
+
+def _init_label_worker(config, engine):
+    """
+    This function is called once in each worker process.
+
+    config - the label functions and loading options shared by every worker
+        lfs - the unique label functions across every task
+        task_columns - for each task, the position of its label functions in lfs
+        batch_size - the number of candidates to pull from the database at once
+        candidate_class - the candidate subclass used to eager load each batch
+        prefetch_depth - the number of batches to load ahead
+        profile - time every label function call
+    engine - the database engine the worker opens its sessions on
+    """
+    worker_state.update(config)
+    worker_state["session_factory"] = sessionmaker(bind=engine)
+    sentence_label_cache.clear()
+    pos_tag_cache.take_new_verb_entries()
+
+
+def _label_shard(shard):
+    """
+    This function labels one shard of candidates.
+
+    shard - a (row offset, candidate ids) tuple
+
+    returns the row offset and number of candidates of the shard, a list of
+    (int32 rows, int32 cols, int8 data) arrays (one per task)
+    and the fetch/db_wait/compute timings in seconds (plus the label function profile
+    and the verb checks tagged while labeling, see pos_tag_cache)
+    """
+    start, shard_ids = shard
+    lfs = worker_state["lfs"]
+    task_columns = worker_state["task_columns"]
+
+    # Candidates don't come back from the database in the order they were
+    # asked for, so map each id back onto its row in the label matrix
+    row_index = {cid: start + offset for offset, cid in enumerate(shard_ids)}
+
+    # labels are written straight into numpy buffers
+    # instead of one python tuple per nonzero label
+    buffers = [LabelBuffer(capacity=2*len(shard_ids)) for task in task_columns]
+
+    # shards are contiguous, so sentences rarely span two of them
+    sentence_label_cache.clear()
+
+    # batch label functions run once on the whole shard after it's loaded
+    scalar_columns = [col for col, lf in enumerate(lfs) if not has_batch(lf)]
+    batch_columns = [col for col, lf in enumerate(lfs) if has_batch(lf)]
+    batch_records = []
+
+    profile = _new_lf_profile(len(lfs)) if worker_state["profile"] else None
+    stats = {"fetch": 0.0, "db_wait": 0.0, "compute": 0.0, "worker": os.getpid(), "lf_profile": profile}
+    batches = prefetch_candidates(
+        worker_state["session_factory"], shard_ids, worker_state["batch_size"],
+        candidate_class=worker_state["candidate_class"],
+        prefetch_depth=worker_state["prefetch_depth"], stats=stats
+    )
+
+    for candidates in batches:
+        compute_start = time.perf_counter()
+        for candidate in candidates:
+            row = row_index[candidate.id]
+
+            # Build the context once so every label function
+            # shares the same tagged text, windows and parent sentence
+            context = CandidateContext(candidate)
+
+            # run every unique label function once, then copy the labels into each task
+            labels = [0]*len(lfs)
+            for col in scalar_columns:
+                if profile is None:
+                    labels[col] = _apply_lf(lfs[col], context)
+                else:
+                    labels[col] = _apply_lf_profiled(col, lfs[col], context, profile)
+            for task_index, columns in enumerate(task_columns):
+                buffers[task_index].add_row(row, [labels[col] for col in columns])
+
+            if batch_columns:
+                # read the columns now, the batch's session is closed before the next batch
+                # and only the rows are kept, so the candidates can be freed
+                batch_records.append(CandidateBatch.record(context))
+        stats["compute"] += time.perf_counter() - compute_start
+
+    if batch_records:
+        compute_start = time.perf_counter()
+        batch = CandidateBatch.from_records(batch_records)
+        rows = np.array([row_index[record["candidate_id"]] for record in batch_records], dtype=np.int32)
+        for col in batch_columns:
+            labels = _apply_batch_lf(col, lfs[col], batch, profile)
+            for task_index, columns in enumerate(task_columns):
+                for task_col, lf_col in enumerate(columns):
+                    if lf_col == col:
+                        buffers[task_index].add_column(rows, task_col, labels)
+        stats["compute"] += time.perf_counter() - compute_start
+
+    stats["verb_entries"] = pos_tag_cache.take_new_verb_entries()
+    return start, len(shard_ids), [buffer.coo() for buffer in buffers], stats
+
+
+def _apply_lf(lf, context):
+    """
+    This function applies a label function to a candidate context.
+    Sentence scoped label functions are only run for the first candidate
+    of a sentence. Every other candidate reuses the cached label.
+
+    lf - the label function to run
+    context - the CandidateContext of the candidate being labeled
+    """
+    if is_sentence_scoped(lf):
+        key = (context.sentence_id, lf)
+        if key not in sentence_label_cache:
+            sentence_label_cache[key] = lf(context)
+        return sentence_label_cache[key]
+    return lf(context)
+
+
+def _apply_batch_lf(col, lf, batch, profile=None):
+    """
+    This function applies the batch version of a label function to a CandidateBatch.
+    With a profile the call is timed and an exception labels the whole batch 0.
+
+    col - the position of the label function in the profile
+    lf - the label function (with a batch attribute, see batch_lf)
+    batch - the CandidateBatch of the shard
+    profile - the profile dictionary of the current shard (None turns profiling off)
+
+    returns an int8 array with one label per candidate in the batch
+    """
+    if profile is None:
+        labels = np.asarray(lf.batch(batch), dtype=np.int8)
     else:
-        row = []
-        data =[]
-        col = []
-
-        while not(data_queue.empty()):
-            entry = data_queue.get()
-            row.append(entry[0])
-            col.append(entry[1])
-            data.append(entry[2])
-
-        return sparse.csr_matrix((data, (row, col)), shape=(len(candidate_ids),len(lfs)))
-
-def _label_candidates_multithread(lfs, multitask):
-    """
-    This function is called when each thread is created.
-
-    lfs - the label functions to annotate candidates
-    multitask - a boolean that tells the function to label candidates in a multitask format
-    """
-    while not(candidate_queue.empty()):
-       
-        candidate = candidate_queue.get()
-        sys.stdout.write("\r{:7d}".format(candidate_queue.qsize()))
-        sys.stdout.flush()
-        
-        if multitask:
-            for task_index, lf_task in enumerate(lfs):
-                for col_index, lf in enumerate(lf_task):
-                    val = lf(candidate[1])
-                    
-                    if val != 0:
-                        data_queue.put((task_index, candidate[0], col_index, val))
-        else:
-            for col_index, lf in enumerate(lfs):
-                val = lf(candidate[1])
-            
-                if val != 0:
-                    # put row_index, col_index and data onto a synchronized queue
-                    data = (candidate[0], col_index, val)
-                    data_queue.put(data)
-    
+        start = time.perf_counter()
+        try:
+            labels = np.asarray(lf.batch(batch), dtype=np.int8)
+        except Exception as error:
+            profile["exceptions"][col] += 1
+            profile["last_error"][col] = "{}: {}".format(type(error).__name__, error)
+            labels = np.zeros(len(batch), dtype=np.int8)
+        profile["time"][col] += time.perf_counter() - start
+        profile["calls"][col] += len(batch)
+        profile["nonzero"][col] += np.count_nonzero(labels)
+
+    if labels.shape != (len(batch),):
+        raise ValueError("{}.batch returned {} labels for {} candidates".format(
+            getattr(lf, "__name__", repr(lf)), labels.shape, len(batch)
+        ))
+    return labels
+
+
+def _new_lf_profile(num_lfs):
+    return {
+        "calls": np.zeros(num_lfs, dtype=np.int64),
+        "cached": np.zeros(num_lfs, dtype=np.int64),
+        "nonzero": np.zeros(num_lfs, dtype=np.int64),
+        "exceptions": np.zeros(num_lfs, dtype=np.int64),
+        "time": np.zeros(num_lfs, dtype=np.float64),
+        "last_error": {}
+    }
+
+
+def _apply_lf_profiled(col, lf, context, profile):
+    """
+    This function applies a label function like _apply_lf and records
+    how long it took, whether it fired and whether it raised an exception.
+
+    col - the position of the label function in the profile
+    lf - the label function to run
+    context - the CandidateContext of the candidate being labeled
+    profile - the profile dictionary of the current shard
+    """
+    if is_sentence_scoped(lf) and (context.sentence_id, lf) in sentence_label_cache:
+        profile["cached"][col] += 1
+        label = sentence_label_cache[(context.sentence_id, lf)]
+    else:
+        start = time.perf_counter()
+        try:
+            label = _apply_lf(lf, context)
+        except Exception as error:
+            profile["exceptions"][col] += 1
+            profile["last_error"][col] = "{}: {}".format(type(error).__name__, error)
+            label = 0
+        profile["time"][col] += time.perf_counter() - start
+        profile["calls"][col] += 1
+
+    if label != 0:
+        profile["nonzero"][col] += 1
+    return label
+
+
+def lf_profile_table(report=labeling_report):
+    """
+    This function is designed to turn the label function profile of a
+    label_candidates(profile=True) call into a table sorted by total time.
+    Shared work is charged to whichever label function asks for it first:
+    a batch label function's time includes every CandidateBatch.lookup it is
+    the first to make (and a scalar one the CandidateContext values it computes first),
+    so the label functions reusing those values look cheaper than they would alone.
+
+    report - the labeling_report dictionary filled by label_candidates
+
+    returns a dataframe with one row per label function
+    """
+    lf_profile = report["lf_profile"]
+    applied = np.maximum(lf_profile["calls"] + lf_profile["cached"], 1)
+    total_time = max(lf_profile["time"].sum(), 1e-9)
+
+    profile_df = pd.DataFrame(
+        {
+            "calls": lf_profile["calls"],
+            "cached": lf_profile["cached"],
+            "total_sec": lf_profile["time"],
+            "mean_ms": 1000*lf_profile["time"]/np.maximum(lf_profile["calls"], 1),
+            "time_share": lf_profile["time"]/total_time,
+            "nonzero_rate": lf_profile["nonzero"]/applied,
+            "exceptions": lf_profile["exceptions"],
+            "last_error": [lf_profile["last_error"].get(col, "") for col in range(len(lf_profile["calls"]))]
+        },
+        index=pd.Index(report["lf_names"], name="label_function"),
+        columns=["calls", "cached", "total_sec", "mean_ms", "time_share", "nonzero_rate", "exceptions", "last_error"]
+    )
+    return profile_df.sort_values("total_sec", ascending=False)
+
+
+def write_lf_profile(path, report=labeling_report):
+    """
+    This function is designed to save the label function profile and
+    the per worker throughput of a label_candidates call as json.
+
+    path - the json file to write
+    report - the labeling_report dictionary filled by label_candidates
+    """
+    profile_df = lf_profile_table(report).reset_index()
+    output = {
+        "candidates": report["candidates"],
+        "wall_sec": report["wall"],
+        "workers": _worker_rates(report),
+        "label_functions": json.loads(profile_df.to_json(orient="records"))
+    }
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2)
+
+
+def _worker_rates(report):
+    return [
+        {
+            "worker": worker,
+            "candidates": stats["candidates"],
+            "candidates_per_sec": stats["candidates"]/max(stats["db_wait"] + stats["compute"], 1e-9)
+        }
+        for worker, stats in sorted(report["workers"].items())
+    ]
+
+
+def print_labeling_report(report):
+    """
+    This function prints the throughput of a label_candidates call.
+    fetch, db_wait and compute are summed over every worker, so they
+    can add up to more than the wall time.
+
+    report - the labeling_report dictionary filled by label_candidates
+    """
+    print("Labeled {:,} candidates in {:.1f} sec ({:,.1f} candidates/sec)".format(
+        report["candidates"], report["wall"], report["candidates"]/max(report["wall"], 1e-9)
+    ))
+    busy = max(report["db_wait"] + report["compute"], 1e-9)
+    print("database fetch: {:.1f} sec, waiting on the database: {:.1f} sec ({:.0%}), label functions: {:.1f} sec ({:.0%})".format(
+        report["fetch"], report["db_wait"], report["db_wait"]/busy, report["compute"], report["compute"]/busy
+    ))
+    for worker in _worker_rates(report):
+        print("worker {worker}: {candidates:,} candidates ({candidates_per_sec:,.1f} candidates/sec)".format(**worker))
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import pathlib
+
+import numpy as np
+import scipy.sparse as sparse
+
+from utils.notebook_utils.label_buffer import LABEL_MATRIX_DTYPE
+
+# Bump when the layout of the shard files changes
+SHARD_FORMAT_VERSION = 2
+
+
+def hash_candidate_ids(candidate_ids):
+    return hashlib.sha256(np.asarray(candidate_ids, dtype=np.int64).tobytes()).hexdigest()
+
+
+class ShardedLabelMatrix(object):
+    """On Disk Label Matrix
+    This class stores a label matrix as a directory of fixed size shards, so the
+    labels for a whole corpus never have to fit in memory and a crash only loses
+    the shard that was being written.
+
+    directory/
+        manifest.json        -- the shape of the matrix, the label functions and the shards that are complete
+        candidate_ids.npy    -- the candidate id of every row (in row order)
+        shard_00000.npz      -- the csr block(s) and candidate ids of rows [0, shard_size)
+        ...
+
+    A shard file is written to a temporary name and renamed into place before
+    the manifest marks it complete, so a half written shard is never read.
+    """
+
+    def __init__(self, directory):
+        """ Open an existing label matrix directory
+
+        Keyword arguments:
+        self -- the class object
+        directory -- the directory written by label_candidates(output_dir=...)
+        """
+        self.directory = pathlib.Path(directory)
+        with open(str(self.directory / "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self._candidate_ids = None
+
+    @classmethod
+    def create(cls, directory, candidate_ids, shard_size, num_columns, num_tasks=1, lf_names=None, lf_fingerprints=None):
+        """Start a new label matrix or resume the one already in the directory
+
+        Keyword arguments:
+        cls -- the class object
+        directory -- the directory to write the shards into
+        candidate_ids -- the candidate id of every row
+        shard_size -- the number of rows per shard
+        num_columns -- the number of label functions (the widest task for multitask)
+        num_tasks -- the number of label matrices (1 unless labeling in multitask format)
+        lf_names -- the names of the label functions of every task
+        lf_fingerprints -- the fingerprints of the label functions of every task (see lf_fingerprint),
+            a directory labeled by other label functions is never resumed
+        """
+        directory = pathlib.Path(directory)
+        manifest = {
+            "version": SHARD_FORMAT_VERSION,
+            "candidate_ids_hash": hash_candidate_ids(candidate_ids),
+            "num_rows": len(candidate_ids),
+            "num_columns": num_columns,
+            "num_tasks": num_tasks,
+            "lf_names": lf_names,
+            "lf_fingerprints": lf_fingerprints,
+            "shard_size": shard_size,
+            "num_shards": int(np.ceil(len(candidate_ids)/shard_size)),
+            "complete_shards": []
+        }
+
+        if (directory / "manifest.json").exists():
+            label_matrix = cls(directory)
+            settings = ["version", "candidate_ids_hash", "num_rows", "num_columns", "num_tasks", "shard_size"]
+            if any(label_matrix.manifest.get(key) != manifest[key] for key in settings):
+                raise ValueError(
+                    "{} already holds a label matrix for different candidates, label functions "
+                    "or shard size. Pick another directory or delete it to start over.".format(directory)
+                )
+            if any(label_matrix.manifest.get(key) != manifest[key] for key in ["lf_names", "lf_fingerprints"]):
+                raise ValueError(
+                    "{} was labeled by different label functions (or the label functions changed "
+                    "since). Pick another directory or delete it to start over.".format(directory)
+                )
+            return label_matrix
+
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(str(directory / "candidate_ids.npy"), np.asarray(candidate_ids, dtype=np.int64))
+        _write_json(directory / "manifest.json", manifest)
+        return cls(directory)
+
+    @property
+    def shape(self):
+        return (self.manifest["num_rows"], self.manifest["num_columns"])
+
+    @property
+    def num_shards(self):
+        return self.manifest["num_shards"]
+
+    @property
+    def is_complete(self):
+        return len(self.manifest["complete_shards"]) == self.num_shards
+
+    @property
+    def candidate_ids(self):
+        if self._candidate_ids is None:
+            self._candidate_ids = np.load(str(self.directory / "candidate_ids.npy"), mmap_mode="r")
+        return self._candidate_ids
+
+    def shard_path(self, shard_index):
+        return self.directory / "shard_{:05d}.npz".format(shard_index)
+
+    def shard_rows(self, shard_index):
+        """Return the (start, end) rows covered by a shard
+
+        Keyword arguments:
+        self -- the class object
+        shard_index -- the position of the shard
+        """
+        start = shard_index * self.manifest["shard_size"]
+        return start, min(start + self.manifest["shard_size"], self.manifest["num_rows"])
+
+    def missing_shards(self):
+        """Return the shards that still need to be labeled
+
+        Keyword arguments:
+        self -- the class object
+        """
+        complete = set(self.manifest["complete_shards"])
+        return [
+            shard_index for shard_index in range(self.num_shards)
+            if shard_index not in complete or not self.shard_path(shard_index).exists()
+        ]
+
+    def write_shard(self, shard_index, matrices):
+        """Save one shard and mark it complete in the manifest
+
+        Keyword arguments:
+        self -- the class object
+        shard_index -- the position of the shard
+        matrices -- a list of csr matrices (one per task) covering the shard's rows
+        """
+        start, end = self.shard_rows(shard_index)
+        arrays = {"candidate_ids": np.asarray(self.candidate_ids[start:end])}
+        for task_index, matrix in enumerate(matrices):
+            matrix = sparse.csr_matrix(matrix)
+            # labels are stored as int8 on disk and read back as LABEL_MATRIX_DTYPE
+            arrays["data_{}".format(task_index)] = matrix.data.astype(np.int8)
+            arrays["indices_{}".format(task_index)] = matrix.indices
+            arrays["indptr_{}".format(task_index)] = matrix.indptr
+
+        # np.savez adds .npz to names without it, so keep the suffix on the temporary file
+        tmp_path = self.directory / "shard_{:05d}.tmp.npz".format(shard_index)
+        np.savez(str(tmp_path), **arrays)
+        os.replace(str(tmp_path), str(self.shard_path(shard_index)))
+
+        if shard_index not in self.manifest["complete_shards"]:
+            self.manifest["complete_shards"] = sorted(self.manifest["complete_shards"] + [shard_index])
+        _write_json(self.directory / "manifest.json", self.manifest)
+
+    def read_shard(self, shard_index, task=None):
+        """Load one shard
+
+        Keyword arguments:
+        self -- the class object
+        shard_index -- the position of the shard
+        task -- the task to load (None loads every task, or the only one for single task matrices)
+
+        Returns:
+        The candidate ids of the shard's rows and the csr matrix (or list of matrices for multitask)
+        """
+        start, end = self.shard_rows(shard_index)
+        shape = (end - start, self.manifest["num_columns"])
+        tasks = range(self.manifest["num_tasks"]) if task is None else [task]
+
+        with np.load(str(self.shard_path(shard_index))) as shard:
+            matrices = [
+                sparse.csr_matrix(
+                    (
+                        shard["data_{}".format(task_index)].astype(LABEL_MATRIX_DTYPE),
+                        shard["indices_{}".format(task_index)],
+                        shard["indptr_{}".format(task_index)]
+                    ),
+                    shape=shape
+                )
+                for task_index in tasks
+            ]
+            candidate_ids = shard["candidate_ids"]
+
+        return candidate_ids, matrices[0] if len(matrices) == 1 else matrices
+
+    def iter_shards(self, task=None):
+        """Yield (candidate ids, label matrix) for every shard in row order,
+        so downstream models can train without loading the whole matrix
+
+        Keyword arguments:
+        self -- the class object
+        task -- the task to load (see read_shard)
+        """
+        missing = self.missing_shards()
+        if missing:
+            raise ValueError("{} shards haven't been labeled yet (e.g. shard {})".format(len(missing), missing[0]))
+
+        for shard_index in range(self.num_shards):
+            yield self.read_shard(shard_index, task=task)
+
+    def to_csr(self, task=None):
+        """Concatenate every shard into one in memory csr matrix
+        (or a list of matrices for multitask)
+
+        Keyword arguments:
+        self -- the class object
+        task -- the task to load (see read_shard)
+        """
+        blocks = [matrices for candidate_ids, matrices in self.iter_shards(task=task)]
+        if not blocks:
+            return sparse.csr_matrix(self.shape, dtype=LABEL_MATRIX_DTYPE)
+
+        if isinstance(blocks[0], list):
+            return [
+                sparse.vstack([block[task_index] for block in blocks], format="csr")
+                for task_index in range(len(blocks[0]))
+            ]
+        return sparse.vstack(blocks, format="csr")
+
+
+def _write_json(path, data):
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, str(path))